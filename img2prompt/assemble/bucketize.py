@@ -1,5 +1,6 @@
 from typing import Dict, List
-import re
+
+from ..utils import caption_text
 
 
 # Seed tags for each bucket used for initial categorisation.
@@ -63,6 +64,17 @@ BUCKET_SEEDS: Dict[str, List[str]] = {
 
 
 BUCKET_ORDER = list(BUCKET_SEEDS.keys())
+BUCKET_LIMIT = 10
+TOTAL_LIMIT = 70
+
+
+def _seed_index() -> Dict[str, List[str]]:
+    """Seed tag -> buckets listing it, in ``BUCKET_ORDER``."""
+    index: Dict[str, List[str]] = {}
+    for bucket, seeds in BUCKET_SEEDS.items():
+        for seed in dict.fromkeys(seeds):
+            index.setdefault(seed, []).append(bucket)
+    return index
 
 
 def bucketize(tags: Dict[str, float]) -> Dict[str, List[str]]:
@@ -79,35 +91,37 @@ def bucketize(tags: Dict[str, float]) -> Dict[str, List[str]]:
 
     sorted_tags = sorted(tags.items(), key=lambda x: x[1], reverse=True)
 
-    # First pass – assign tags matching seeds
-    for bucket, seeds in BUCKET_SEEDS.items():
-        for tag, _ in sorted_tags:
-            if tag in seeds and tag not in used and len(buckets[bucket]) < 10:
+    # First pass – assign tags matching seeds (each bucket in turn, by score)
+    index = _seed_index()
+    matches: Dict[str, List[str]] = {k: [] for k in BUCKET_SEEDS}
+    for tag, _ in sorted_tags:
+        for bucket in index.get(tag, ()):
+            matches[bucket].append(tag)
+    for bucket in BUCKET_SEEDS:
+        for tag in matches[bucket]:
+            if tag not in used and len(buckets[bucket]) < BUCKET_LIMIT:
                 buckets[bucket].append(tag)
                 used.add(tag)
 
     # Collect remaining tags
-    remaining = [(t, s) for t, s in sorted_tags if t not in used]
+    remaining = [t for t, _ in sorted_tags if t not in used]
+    pos = 0
 
     # Round-robin fill up to 10 per bucket
-    idx = 0
-    while remaining and any(len(buckets[b]) < 10 for b in BUCKET_ORDER):
-        bucket = BUCKET_ORDER[idx % len(BUCKET_ORDER)]
-        if len(buckets[bucket]) < 10:
-            tag, _ = remaining.pop(0)
-            if tag not in used:
-                buckets[bucket].append(tag)
-                used.add(tag)
-        idx += 1
+    open_buckets = [b for b in BUCKET_ORDER if len(buckets[b]) < BUCKET_LIMIT]
+    while pos < len(remaining) and open_buckets:
+        for bucket in open_buckets:
+            if pos == len(remaining):
+                break
+            buckets[bucket].append(remaining[pos])
+            used.add(remaining[pos])
+            pos += 1
+        open_buckets = [b for b in open_buckets if len(buckets[b]) < BUCKET_LIMIT]
 
     # Add any leftover tags to the extra bucket up to a total of 70
     total = sum(len(v) for v in buckets.values())
-    while remaining and total < 70:
-        tag, _ = remaining.pop(0)
-        if tag not in used:
-            buckets["extra"].append(tag)
-            used.add(tag)
-            total += 1
+    take = max(0, min(len(remaining) - pos, TOTAL_LIMIT - total))
+    buckets["extra"].extend(remaining[pos : pos + take])
 
     return buckets
 
@@ -132,14 +146,9 @@ def ensure_50_70(
     max_total: int = 70,
     allow=None,
 ) -> List[str]:
-    import re
     allow = allow or (lambda w: True)
 
-    nounish = [
-        p.strip()
-        for p in re.findall(r"[a-z][a-z ]{2,40}", (caption or "").lower())
-        if 1 <= len(p.split()) <= 4
-    ]
+    nounish = caption_text.nounish_phrases(caption)
 
     merged: List[str] = []
     seen: set[str] = set()
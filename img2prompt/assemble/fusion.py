@@ -0,0 +1,149 @@
+"""Multi-source tag score fusion over one tag id space.
+
+``TagVocab`` gives every tag of every source (WD14, DeepDanbooru, CLIP
+Interrogator) an integer id, with a synonym table (``normalize.SYNONYMS``
+for ``merge_tags``) resolved when a name is interned, so "serafuku" and
+"school uniform" share an id.  Scores then live in arrays and fusing the
+sources is one elementwise reduction:
+
+- ``max``: the highest weighted score (what ``merge_tags`` has always done)
+- ``mean``: the mean weighted score over all sources (absent counts as 0)
+- ``noisy_or``: ``1 - prod(1 - weighted score)``
+
+``fuse_dicts`` fuses per-image score dicts for a whole batch at once and
+``fuse_columns`` fuses raw score matrices of models with fixed columns.
+CLIP Interrogator phrases are free text, so ``fuse_dicts`` interns into a
+vocabulary of its own per call unless one is passed in; keep a long-lived
+``TagVocab`` only for fixed model vocabularies.
+"""
+
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from ..utils.vocab import Vocab
+
+# WD14 / DeepDanbooru / CLIP Interrogator
+SOURCE_WEIGHTS = (1.0, 0.8, 0.7)
+
+
+def _max(x: np.ndarray) -> np.ndarray:
+    return x.max(axis=0)
+
+
+def _mean(x: np.ndarray) -> np.ndarray:
+    return x.mean(axis=0)
+
+
+def _noisy_or(x: np.ndarray) -> np.ndarray:
+    return 1.0 - np.prod(1.0 - np.clip(x, 0.0, 1.0), axis=0)
+
+
+FUSIONS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "max": _max,
+    "mean": _mean,
+    "noisy_or": _noisy_or,
+}
+
+
+class TagVocab:
+    """Tag id space: a ``Vocab`` of canonical names plus a synonym lookup."""
+
+    def __init__(self, names: Iterable[str] = (), synonyms: Optional[Dict[str, str]] = None):
+        self.synonyms: Dict[str, str] = dict(synonyms or {})
+        self.vocab = Vocab()
+        self._alias: Dict[str, int] = {}
+        for n in names:
+            self.id(n)
+
+    def __len__(self) -> int:
+        return len(self.vocab)
+
+    @property
+    def names(self) -> List[str]:
+        """Canonical name of each id."""
+        return self.vocab.terms
+
+    def id(self, name: str) -> int:
+        """Id of ``name`` (its canonical form), adding it if new."""
+        i = self._alias.get(name)
+        if i is None:
+            i = self._alias[name] = self.vocab.intern(self.synonyms.get(name, name))
+        return i
+
+    def ids(self, names: Iterable[str]) -> np.ndarray:
+        return np.fromiter((self.id(n) for n in names), dtype=np.int64)
+
+
+def fuse_dicts(
+    batch: Sequence[Sequence[Dict[str, float]]],
+    weights: Sequence[float] = SOURCE_WEIGHTS,
+    how: str = "max",
+    vocab: Optional[TagVocab] = None,
+    synonyms: Optional[Dict[str, str]] = None,
+) -> List[Dict[str, float]]:
+    """Fuse per-source score dicts for each image of ``batch``.
+
+    ``batch[n]`` holds one dict per source, in the order of ``weights``.
+    Each result maps canonical tags to fused scores, highest first; ties
+    keep the order in which the tags first appear across the sources.
+    Within one source, synonyms keep their highest score, and weighted
+    scores are floored at 0.  Without ``vocab``, tags are interned into a
+    new ``TagVocab(synonyms=synonyms)`` that lives for this call only.
+    """
+    fuse = FUSIONS[how]
+    vocab = vocab if vocab is not None else TagVocab(synonyms=synonyms)
+    w = np.asarray(weights, dtype=np.float64)
+    img_l, src_l, id_l, sc_l = [], [], [], []
+    for n, sources in enumerate(batch):
+        for s, d in enumerate(sources):
+            if not d:
+                continue
+            id_l.append(vocab.ids(d.keys()))
+            sc_l.append(np.fromiter(d.values(), dtype=np.float64, count=len(d)) * w[s])
+            img_l.append(np.full(len(d), n, dtype=np.int64))
+            src_l.append(np.full(len(d), s, dtype=np.int64))
+    out: List[Dict[str, float]] = [{} for _ in batch]
+    if not id_l:
+        return out
+
+    img, src = np.concatenate(img_l), np.concatenate(src_l)
+    ids, sc = np.concatenate(id_l), np.concatenate(sc_l)
+    keys, inv = np.unique(img * len(vocab) + ids, return_inverse=True)
+    per_source = np.zeros((len(w), len(keys)))
+    np.maximum.at(per_source, (src, inv), sc)
+    fused = fuse(per_source)
+    first = np.full(len(keys), len(inv), dtype=np.int64)
+    np.minimum.at(first, inv, np.arange(len(inv)))
+
+    key_img, key_id = np.divmod(keys, len(vocab))
+    order = np.lexsort((first, -fused, key_img))
+    bounds = np.searchsorted(key_img[order], np.arange(len(batch) + 1))
+    names = vocab.names
+    for n in range(len(batch)):
+        sel = order[bounds[n] : bounds[n + 1]]
+        out[n] = {names[i]: s for i, s in zip(key_id[sel].tolist(), fused[sel].tolist())}
+    return out
+
+
+def fuse_columns(
+    scores: Sequence[np.ndarray],
+    column_ids: Sequence[np.ndarray],
+    size: int,
+    weights: Sequence[float] = SOURCE_WEIGHTS,
+    how: str = "max",
+) -> np.ndarray:
+    """Fuse raw ``(N, C_s)`` score matrices whose columns map to ``column_ids[s]``.
+
+    ``column_ids[s]`` is ``vocab.ids(names)`` of the model's column names,
+    computed once per model.  Returns an ``(N, size)`` matrix over the
+    vocabulary ids (0 where no source has the tag).
+    """
+    fuse = FUSIONS[how]
+    n = scores[0].shape[0] if len(scores) else 0
+    per_source = np.zeros((len(scores), n, size))
+    for s, (x, cols) in enumerate(zip(scores, column_ids)):
+        x = np.asarray(x, dtype=np.float64) * weights[s]
+        # 同義語で複数の列が同じ id になる場合は最大値を取る
+        np.maximum.at(per_source[s], (slice(None), cols), x)
+    return fuse(per_source)
@@ -1,8 +1,9 @@
 """Tag normalization and merging utilities."""
 
-from collections import defaultdict
 from typing import Dict
 
+from .fusion import fuse_dicts
+
 SYNONYMS = {
     "serafuku": "school uniform",
 }
@@ -23,24 +24,11 @@ def remove_placeholders(tags: Dict[str, float]) -> Dict[str, float]:
 
 
 def merge_tags(wd: Dict[str, float], dd: Dict[str, float], ci: Dict[str, float]) -> Dict[str, float]:
-    """Merge tag sources with weighting."""
-
-    combined: Dict[str, float] = defaultdict(float)
-
-    def add(src: Dict[str, float], weight: float) -> None:
-        for tag, score in src.items():
-            combined[tag] = max(combined.get(tag, 0.0), score * weight)
-
-    add(wd, 1.0)
-    add(dd, 0.8)
-    add(ci, 0.7)
+    """Merge tag sources with weighting.
 
-    normalized: Dict[str, float] = {}
-    for tag, score in combined.items():
-        canonical = SYNONYMS.get(tag, tag)
-        if canonical in normalized:
-            normalized[canonical] = max(normalized[canonical], score)
-        else:
-            normalized[canonical] = score
-    return dict(sorted(normalized.items(), key=lambda x: x[1], reverse=True))
+    The weighted maximum over WD14 (1.0), DeepDanbooru (0.8) and CLIP
+    Interrogator (0.7) with ``SYNONYMS`` resolved, highest score first
+    (see ``fusion.fuse_dicts`` for batches and other fusion functions).
+    """
 
+    return fuse_dicts([(wd, dd, ci)], synonyms=SYNONYMS)[0]
@@ -1,48 +1,115 @@
-"""Extract dominant colours from an image."""
+"""Extract dominant colours from an image.
+
+Pure NumPy: pixels are binned into a 4-bit-per-channel histogram, the
+populated bins are split by weighted median cut and the cut centres are
+refined with a few weighted k-means steps.  The result is deterministic.
+"""
 
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 import logging
 
+import numpy as np
+
 logger = logging.getLogger(__name__)
 
+SMALL_SIZE = 256
+BLACK_SUBSTITUTE = "#2a3d6d"
+FALLBACK_PALETTE = [
+    "#2a3d6d",
+    "#ddc6ae",
+    "#a5806c",
+    "#5c4032",
+    "#2c455b",
+]
+_BITS = 4
+_REFINE_ITERS = 4
+
+
+def load_small(path: Path, size: int = SMALL_SIZE) -> np.ndarray:
+    """Decode ``path`` and downsample to ``size`` px on the long side (``uint8`` HxWx3)."""
+    from PIL import Image
+
+    img = Image.open(path).convert("RGB")
+    if img.width > img.height:
+        img = img.resize((size, max(1, int(size * img.height / img.width))), Image.BICUBIC)
+    else:
+        img = img.resize((max(1, int(size * img.width / img.height)), size), Image.BICUBIC)
+    return np.asarray(img)
+
+
+def _histogram(pixels: np.ndarray):
+    """Mean colour and pixel count of every populated histogram bin."""
+    px = pixels.reshape(-1, 3).astype(np.int64)
+    q = px >> (8 - _BITS)
+    idx = (q[:, 0] << (2 * _BITS)) | (q[:, 1] << _BITS) | q[:, 2]
+    size = 1 << (3 * _BITS)
+    counts = np.bincount(idx, minlength=size)
+    sums = np.stack([np.bincount(idx, weights=px[:, c], minlength=size) for c in range(3)], 1)
+    used = counts > 0
+    return sums[used] / counts[used, None], counts[used].astype(np.float64)
+
+
+def _median_cut(colors: np.ndarray, weights: np.ndarray, k: int) -> np.ndarray:
+    """Weighted centres of up to ``k`` boxes split along their widest channel."""
+    def span(b):
+        return np.ptp(colors[b], axis=0) if len(b) > 1 else np.zeros(3)
+
+    boxes = [np.arange(len(colors))]
+    spans = [span(boxes[0])]
+    while len(boxes) < k:
+        i = int(np.argmax([s.max() for s in spans]))
+        if spans[i].max() <= 0:
+            break
+        box, ch = boxes.pop(i), int(np.argmax(spans.pop(i)))
+        box = box[np.argsort(colors[box, ch], kind="stable")]
+        cum = np.cumsum(weights[box])
+        cut = int(np.searchsorted(cum, cum[-1] / 2.0))
+        cut = min(max(cut, 1), len(box) - 1)
+        boxes[i:i] = [box[:cut], box[cut:]]
+        spans[i:i] = [span(box[:cut]), span(box[cut:])]
+    return np.stack([np.average(colors[b], axis=0, weights=weights[b]) for b in boxes])
+
+
+def _refine(colors: np.ndarray, weights: np.ndarray, centers: np.ndarray):
+    """A few weighted Lloyd steps; returns centres and their total weight."""
+    for _ in range(_REFINE_ITERS):
+        d = (centers ** 2).sum(1)[None, :] - 2.0 * colors @ centers.T
+        label = d.argmin(1)
+        mass = np.bincount(label, weights=weights, minlength=len(centers))
+        for c in range(3):
+            s = np.bincount(label, weights=weights * colors[:, c], minlength=len(centers))
+            centers[:, c] = np.where(mass > 0, s / np.maximum(mass, 1e-12), centers[:, c])
+    return centers, mass
+
+
+def _to_hex(c) -> str:
+    return "#%02x%02x%02x" % (int(c[0]), int(c[1]), int(c[2]))
+
+
+def palette_from_array(pixels: np.ndarray, k: int = 5) -> List[str]:
+    """Dominant colours of an RGB array, most common first, avoiding pure black."""
+    colors, weights = _histogram(pixels)
+    centers, mass = _refine(colors, weights, _median_cut(colors, weights, k))
+    order = np.argsort(-mass, kind="stable")
+    hexes = [_to_hex(np.clip(np.rint(c), 0, 255)) for c in centers[order]]
+    hexes = [h if h.lower() != "#000000" else BLACK_SUBSTITUTE for h in hexes]
+    # 単色に近い画像で k 色に満たない場合は既定色で補う
+    hexes += [h for h in FALLBACK_PALETTE if h not in hexes][: k - len(hexes)]
+    return hexes[:k]
+
+
+def extract_palette(path: Path, k: int = 5, pixels: Optional[np.ndarray] = None) -> List[str]:
+    """Extract ``k`` dominant colours as hex values, avoiding pure black.
 
-def extract_palette(path: Path, k: int = 5) -> List[str]:
-    """Extract ``k`` dominant colours as hex values, avoiding pure black."""
+    ``pixels`` may pass an already downsampled RGB array (see ``load_small``)
+    to skip decoding ``path`` again.
+    """
 
     try:
-        from PIL import Image
-        import numpy as np
-        from sklearn.cluster import KMeans
-
-        img = Image.open(path).convert("RGB")
-        # Downsample to roughly 256px on the long side for speed.
-        if img.width > img.height:
-            img_small = img.resize((256, int(256 * img.height / img.width)), Image.BICUBIC)
-        else:
-            img_small = img.resize((int(256 * img.width / img.height), 256), Image.BICUBIC)
-
-        arr = np.array(img_small).reshape(-1, 3).astype("float32")
-
-        # Limit to 50k pixels for stable clustering speed.
-        if arr.shape[0] > 50000:
-            idx = np.random.RandomState(0).choice(arr.shape[0], 50000, replace=False)
-            arr = arr[idx]
-
-        km = KMeans(n_clusters=k, n_init=4, random_state=0)
-        km.fit(arr)
-        centers = km.cluster_centers_.astype("uint8")
-
-        to_hex = lambda c: "#%02x%02x%02x" % (int(c[0]), int(c[1]), int(c[2]))
-        hexes = [to_hex(c) for c in centers]
-        hexes = [h if h.lower() != "#000000" else "#2a3d6d" for h in hexes]
-        return hexes
+        if pixels is None:
+            pixels = load_small(path)
+        return palette_from_array(pixels, k)
     except Exception as exc:  # pragma: no cover - fallback path
         logger.warning("Palette extraction failed: %s", exc, exc_info=True)
-        return [
-            "#2a3d6d",
-            "#ddc6ae",
-            "#a5806c",
-            "#5c4032",
-            "#2c455b",
-        ][:k]
+        return FALLBACK_PALETTE[:k]
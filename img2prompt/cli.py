@@ -1,60 +1,293 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 import logging
+import time
 
-from .extract import blip, clip_interrogator, deepdanbooru, wd14_onnx
+from .extract import (
+    caption_backends,
+    captioner,
+    clip_interrogator,
+    deepdanbooru,
+    health,
+    runtime,
+    wd14_onnx,
+)
+from .extract.ci_banks import BANK_PROFILES
 from .assemble import normalize, bucketize, palette, style
+from .utils import text_filters
 from .utils.text_filters import (
+    FULLBODY_CUES,
+    MULTI_CUES,
+    SINGLE_CUES,
+    choose_style,
     clean_tokens,
     is_bad_token,
     finalize_pipeline,
+    select_profile,
 )
 from .options.style_presets import apply_style, STYLE_PRESETS
 from .export import writer
 
 logger = logging.getLogger(__name__)
 
+CAPTION_REUSE = ("blip", "ci")
 
-def run(image_path: str, style_preset: str | None = None) -> Path:
-    image_path = Path(image_path)
-    caption = blip.generate_caption(image_path)
+# --deadline のステージを流す共有スレッドプール。期限切れで見捨てたステージは
+# 裏で走り続けるが、ワーカー数で頭打ちになる（溢れた分は次の画像の期限内に
+# 終わらなければ同じく打ち切られる）。
+STAGE_WORKERS = 8
+_stage_pool = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="img2prompt-stage")
 
-    # --- tag extraction with error capture
-    tags_debug = {}
+# WD14 だけで十分と判断する条件（--cascade）
+CASCADE_DEFAULTS = {"min_tags": 20, "require_style": True, "require_profile": True}
+
+
+def cascade_decision(
+    wd14_tags,
+    min_tags: int = 20,
+    require_style: bool = True,
+    require_profile: bool = True,
+) -> dict:
+    """Decide from the WD14 tags alone whether CI and DeepDanbooru can be skipped.
+
+    WD14 is enough when at least ``min_tags`` of its tags survive
+    ``is_bad_token`` and its tags (all of them, as ``finalize_pipeline`` sees
+    them) name the style (photo is only the fallback of
+    ``choose_style``, so it never counts as clear) and they carry a count or
+    framing cue for ``select_profile``.
+    """
+    tags = list(wd14_tags)
+    good = [t for t in tags if not is_bad_token(t)]
+    low = {t.lower().strip() for t in tags}
+    style_name = choose_style(tags, "")
+    style_clear = style_name == "anime"
+    profile_clear = any(k in low for k in (*MULTI_CUES, *FULLBODY_CUES, *SINGLE_CUES))
+    skip = (
+        len(good) >= min_tags
+        and (style_clear or not require_style)
+        and (profile_clear or not require_profile)
+    )
+    return {
+        "good_tags": len(good),
+        "style": style_name if style_clear else None,
+        "profile": select_profile(tags, "") if profile_clear else None,
+        "skip": skip,
+    }
 
+
+def _attach_health(tags_debug: dict, name: str) -> None:
+    """Report a tripped or recovering extractor breaker in ``tags_debug``."""
+    rep = health.report(name)
+    if rep["state"] != "closed":
+        tags_debug[name]["health"] = rep
+
+
+def _wd14_stage(image_path: Path):
     try:
-        wd14_tags_raw = wd14_onnx.extract_tags(image_path)
-        wd14_tags = normalize.remove_placeholders(wd14_tags_raw)
-        tags_debug["wd14_onnx"] = {"count": len(wd14_tags), "ok": True}
+        raw = wd14_onnx.extract_tags(image_path)
+        tags = normalize.remove_placeholders(raw)
+        return (raw, tags), {"count": len(tags), "ok": True}
     except Exception as exc:  # pragma: no cover - should be rare
         logger.warning("WD14 extractor failed: %s", exc, exc_info=True)
-        wd14_tags = {}
-        tags_debug["wd14_onnx"] = {"count": 0, "ok": False, "error": str(exc)}
+        return ({}, {}), {"count": 0, "ok": False, "error": str(exc)}
+
 
+def _dd_stage(image_path: Path):
     try:
         dd_raw, dd_err = deepdanbooru.extract_tags(image_path)
         dd_tags = normalize.remove_placeholders(dd_raw)
         dbg = {"count": len(dd_tags), "ok": dd_err is None}
         if dd_err:
             dbg["error"] = dd_err
-        tags_debug["deepdanbooru"] = dbg
+        return dd_tags, dbg
     except Exception as exc:  # pragma: no cover - should be rare
         logger.warning("DeepDanbooru extractor failed: %s", exc, exc_info=True)
-        dd_tags = {}
-        tags_debug["deepdanbooru"] = {"count": 0, "ok": False, "error": str(exc)}
+        return {}, {"count": 0, "ok": False, "error": str(exc)}
 
+
+def _ci_stage(image_path: Path, ci_kwargs: dict, want_caption: bool):
     try:
-        ci_tags, ci_picks, ci_raw = clip_interrogator.extract_tags(image_path)
+        if want_caption:
+            ci_tags, ci_picks, ci_raw, ci_caption = clip_interrogator.interrogate(
+                image_path, **ci_kwargs
+            )
+        else:
+            ci_tags, ci_picks, ci_raw = clip_interrogator.extract_tags(image_path, **ci_kwargs)
+            ci_caption = None
         ci_tags = normalize.remove_placeholders(ci_tags)
-        tags_debug["clip_interrogator"] = {"count": len(ci_tags), "ok": True}
+        return (ci_tags, ci_picks, ci_raw, ci_caption), {"count": len(ci_tags), "ok": True}
     except Exception as exc:  # pragma: no cover - should be rare
         logger.warning("CLIP Interrogator extractor failed: %s", exc, exc_info=True)
-        ci_tags, ci_picks, ci_raw = {}, [], ""
-        tags_debug["clip_interrogator"] = {
-            "count": 0,
-            "ok": False,
-            "error": str(exc),
-        }
+        return ({}, [], "", None), {"count": 0, "ok": False, "error": str(exc)}
+
+
+def _run_stages(stages, deadline: float | None = None):
+    """Run ``(name, fn)`` stages; ``fn`` gets a ``get(name)`` accessor for earlier results.
+
+    Without a deadline the stages run in order. With one they run
+    concurrently and any stage still running after ``deadline`` seconds is
+    abandoned (its thread is left to finish in the background) and listed in
+    the returned ``dropped``.
+    """
+    if deadline is None:
+        results = {}
+        for name, fn in stages:
+            results[name] = fn(results.__getitem__)
+        return results, []
+
+    futures = {}
+    for name, fn in stages:
+        futures[name] = _stage_pool.submit(fn, lambda n: futures[n].result())
+    done, _ = wait(futures.values(), timeout=max(0.0, deadline))
+    for fut in futures.values():
+        fut.cancel()
+    results, dropped = {}, []
+    for name, fut in futures.items():
+        if fut in done:
+            results[name] = fut.result()
+        else:
+            dropped.append(name)
+    return results, dropped
+
+
+def _late_caption(captioner_mod, image_path: Path, remaining: float) -> str | None:
+    """Caption within what is left of the deadline, or None if it runs out.
+
+    Covers ``caption_reuse="ci"`` when CLIP Interrogator was skipped or gave
+    no caption.
+    """
+    if remaining <= 0:
+        return None
+    fut = _stage_pool.submit(captioner_mod.generate_caption, image_path)
+    done, _ = wait([fut], timeout=remaining)
+    if fut not in done:
+        fut.cancel()
+        return None
+    return fut.result()
+
+
+def _palette_pixels(image_path: Path):
+    """Downsampled RGB array for the palette, or None if the image cannot be read."""
+    try:
+        return palette.load_small(image_path)
+    except Exception as exc:
+        logger.warning("Could not decode %s for the palette: %s", image_path, exc)
+        return None
+
+
+def run(
+    image_path: str,
+    style_preset: str | None = None,
+    ci_banks: str | None = None,
+    caption_reuse: str | None = None,
+    caption_backend: str = "blip",
+    deadline: float | None = None,
+    cascade: dict | None = None,
+    trace_pipeline: bool = False,
+    fill: str = "chain",
+) -> Path:
+    """Generate ``<image>.prompt.json`` for ``image_path``.
+
+    ``caption_reuse="blip"`` hands the main caption to CLIP Interrogator and
+    ``"ci"`` uses the Interrogator's caption as the main caption, so each
+    image is captioned only once. ``caption_backend`` picks the main
+    captioner (see ``extract.caption_backends``).
+
+    ``deadline`` (seconds) runs captioning, the extractors and the palette
+    concurrently and assembles the prompt from whatever finished in time;
+    SAFE_FILL/FLOOR backfill still brings the prompt to 55+ tokens. A caption
+    missing once the stages are in is generated with the remaining budget.
+
+    ``cascade`` (thresholds over ``CASCADE_DEFAULTS``, ``{}`` for the
+    defaults) runs WD14 first and skips CLIP Interrogator and DeepDanbooru
+    when ``cascade_decision`` finds WD14's tags sufficient.
+
+    ``trace_pipeline`` records every text post-processing stage (tokens in
+    and out, drops per rule, fill draws, microseconds) in
+    ``meta.rules_flags.stages``.
+
+    ``fill`` is the SAFE_FILL top-up of ``text_filters.run_pipeline``:
+    ``"chain"`` (the retry chain) or ``"constrained"`` (one rule-aware pass).
+    """
+    t0 = time.perf_counter()
+    image_path = Path(image_path)
+    # パレット用に一度だけ縮小デコードしておく（extract_palette で再デコードしない）
+    pixels = _palette_pixels(image_path)
+    captioner_mod = caption_backends.get_backend(caption_backend)
+    ci_kwargs = {"bank_profile": ci_banks} if ci_banks else {}
+
+    stages = []
+    if caption_reuse != "ci":
+        stages.append(("caption", lambda get: captioner_mod.generate_caption(image_path)))
+    stages.append(("wd14_onnx", lambda get: _wd14_stage(image_path)))
+
+    decision: dict = {}
+    skipped_dbg = {"count": 0, "ok": True, "skipped": "cascade"}
+
+    def cascade_skip(get) -> bool:
+        if cascade is None:
+            return False
+        if not decision:
+            (_, tags), _ = get("wd14_onnx")
+            decision.update(cascade_decision(tags, **{**CASCADE_DEFAULTS, **cascade}))
+        return decision["skip"]
+
+    def dd_job(get):
+        if cascade_skip(get):
+            return {}, dict(skipped_dbg)
+        return _dd_stage(image_path)
+
+    stages.append(("deepdanbooru", dd_job))
+
+    def ci_job(get):
+        if cascade_skip(get):
+            return ({}, [], "", None), dict(skipped_dbg)
+        kwargs = dict(ci_kwargs)
+        if caption_reuse == "blip":
+            kwargs["caption"] = get("caption")
+        return _ci_stage(image_path, kwargs, want_caption=caption_reuse == "ci")
+
+    stages.append(("clip_interrogator", ci_job))
+    if deadline is not None:
+        stages.append(
+            ("palette", lambda get: palette.extract_palette(image_path, pixels=pixels))
+        )
+
+    results, dropped = _run_stages(stages, deadline)
+
+    # --- tag extraction with error capture
+    tags_debug = {}
+    dropped_dbg = {"count": 0, "ok": False, "dropped": "deadline"}
+    (wd14_tags_raw, wd14_tags), tags_debug["wd14_onnx"] = results.get(
+        "wd14_onnx", (({}, {}), dict(dropped_dbg))
+    )
+    dd_tags, tags_debug["deepdanbooru"] = results.get(
+        "deepdanbooru", ({}, dict(dropped_dbg))
+    )
+    (ci_tags, ci_picks, ci_raw, ci_caption), tags_debug["clip_interrogator"] = results.get(
+        "clip_interrogator", (({}, [], "", None), dict(dropped_dbg))
+    )
+
+    caption = ci_caption if caption_reuse == "ci" else results.get("caption")
+    if not caption:
+        if deadline is None:
+            caption = captioner_mod.generate_caption(image_path)
+        else:
+            caption = _late_caption(captioner_mod, image_path, deadline - (time.perf_counter() - t0))
+            if caption is None:
+                caption = caption_backends.FALLBACK_CAPTION
+                if "caption" not in dropped:
+                    dropped.append("caption")
+
+    for name in ("wd14_onnx", "deepdanbooru", "clip_interrogator"):
+        _attach_health(tags_debug, name)
+
+    if deadline is None:
+        palette_hex = palette.extract_palette(image_path, pixels=pixels)
+    else:
+        # 期限切れのパレットは再計算せず既定色にする（meta.deadline.dropped に残る）
+        palette_hex = results.get("palette") or palette.FALLBACK_PALETTE[:5]
 
     merged = normalize.merge_tags(wd14_tags, dd_tags, ci_tags)
     buckets = bucketize.bucketize(merged)
@@ -88,6 +321,8 @@ def run(image_path: str, style_preset: str | None = None) -> Path:
         caption=caption,
         wd14_tags=wd14_tags,
         ci_picks=ci_picks,
+        trace=[] if trace_pipeline else None,
+        fill=fill,
     )
     final_count = len(prompt_tags)
     prompt = ", ".join(prompt_tags)
@@ -114,12 +349,23 @@ def run(image_path: str, style_preset: str | None = None) -> Path:
             "openpose": False,
         },
         "meta": {
-            "palette_hex": palette.extract_palette(image_path),
+            "palette_hex": palette_hex,
             "tags_debug": tags_debug,
             "selected_profile": pf,
             "rules_flags": flags,
         },
     }
+    if cascade is not None:
+        data["meta"]["cascade"] = dict(
+            decision,
+            skipped=["clip_interrogator", "deepdanbooru"] if decision.get("skip") else [],
+        )
+    if deadline is not None:
+        data["meta"]["deadline"] = {
+            "budget_s": deadline,
+            "elapsed_s": round(time.perf_counter() - t0, 3),
+            "dropped": dropped,
+        }
     out_path = image_path.with_name(image_path.name + ".prompt.json")
     writer.write_prompt(out_path, data)
     return out_path
@@ -129,8 +375,108 @@ def main() -> None:
     parser = argparse.ArgumentParser(description="Generate prompt JSON from an image")
     parser.add_argument("image", help="Path to input image")
     parser.add_argument("--style", choices=STYLE_PRESETS.keys(), help="Style preset", default=None)
+    parser.add_argument(
+        "--ci-banks",
+        choices=BANK_PROFILES.keys(),
+        help="Pruned CLIP Interrogator bank profile",
+        default=None,
+    )
+    parser.add_argument(
+        "--caption-reuse",
+        choices=CAPTION_REUSE,
+        help="Caption once and share it: 'blip' feeds CI, 'ci' replaces BLIP",
+        default=None,
+    )
+    parser.add_argument(
+        "--caption-backend",
+        choices=caption_backends.CAPTION_BACKENDS.keys(),
+        help="Main caption model",
+        default="blip",
+    )
+    parser.add_argument(
+        "--blip-backend",
+        choices=captioner.BACKENDS,
+        help="BLIP backend ('int8' quantizes Linear layers for CPU)",
+        default="torch",
+    )
+    parser.add_argument(
+        "--runtime",
+        choices=runtime.RUNTIME_PROFILES.keys(),
+        help="Torch CPU runtime profile for BLIP/CLIP",
+        default="default",
+    )
+    parser.add_argument("--threads", type=int, help="Torch intra-op threads", default=None)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Worker processes sharing this host (splits cores for 'shared')",
+        default=1,
+    )
+    parser.add_argument(
+        "--breaker-failures",
+        type=int,
+        help="Consecutive failures before an extractor is disabled",
+        default=3,
+    )
+    parser.add_argument(
+        "--breaker-cooldown",
+        type=float,
+        help="Seconds before a disabled extractor is retried (<0: never)",
+        default=300.0,
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        help="Per-image time budget in seconds; late extractors are dropped",
+        default=None,
+    )
+    parser.add_argument(
+        "--cascade",
+        action="store_true",
+        help="Skip CLIP Interrogator and DeepDanbooru when WD14 alone is sufficient",
+    )
+    parser.add_argument(
+        "--cascade-min-tags",
+        type=int,
+        help="Usable WD14 tags needed to skip the other extractors",
+        default=CASCADE_DEFAULTS["min_tags"],
+    )
+    parser.add_argument(
+        "--rules",
+        help="JSON rule file added to the built-in rules (reloaded when it changes)",
+        default=None,
+    )
+    parser.add_argument(
+        "--trace-pipeline",
+        action="store_true",
+        help="Record per-stage token counts, rule drops and timings in meta.rules_flags",
+    )
+    parser.add_argument(
+        "--fill",
+        choices=text_filters.FILL_MODES,
+        help="Prompt top-up: 'chain' (fill and re-check) or 'constrained' (one rule-aware pass)",
+        default="chain",
+    )
     args = parser.parse_args()
-    out = run(args.image, style_preset=args.style)
+    if args.rules:
+        text_filters.use_rule_file(args.rules)
+    health.configure(
+        args.breaker_failures,
+        None if args.breaker_cooldown < 0 else args.breaker_cooldown,
+    )
+    runtime.configure(args.runtime, threads=args.threads, workers=args.workers)
+    captioner.configure(args.blip_backend)
+    out = run(
+        args.image,
+        style_preset=args.style,
+        ci_banks=args.ci_banks,
+        caption_reuse=args.caption_reuse,
+        caption_backend=args.caption_backend,
+        deadline=args.deadline,
+        cascade={"min_tags": args.cascade_min_tags} if args.cascade else None,
+        trace_pipeline=args.trace_pipeline,
+        fill=args.fill,
+    )
     print(out)
 
 
@@ -0,0 +1,108 @@
+"""Compare caption backends on a local image set.
+
+Usage::
+
+    python -m img2prompt.eval.caption_bench path/to/images --backends blip blip-int8 florence2
+
+The first backend is the reference: the others report their speedup over it
+and how close their captions are to its captions.
+"""
+
+from pathlib import Path
+from typing import Dict, List, Sequence
+import argparse
+import difflib
+import time
+
+from ..extract import captioner
+from ..extract.caption_backends import get_backend
+
+# ベンチ名 -> (caption backend, BLIP backend)
+BENCH_BACKENDS = {
+    "blip": ("blip", "torch"),
+    "blip-int8": ("blip", "int8"),
+    "florence2": ("florence2", None),
+}
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+
+def list_images(paths: Sequence[str]) -> List[Path]:
+    """Expand files and directories in ``paths`` into a sorted image list."""
+    out: List[Path] = []
+    for p in map(Path, paths):
+        if p.is_dir():
+            out.extend(sorted(q for q in p.iterdir() if q.suffix.lower() in IMAGE_SUFFIXES))
+        elif p.suffix.lower() in IMAGE_SUFFIXES:
+            out.append(p)
+    return out
+
+
+def caption_similarity(a: str, b: str) -> float:
+    """Word-level similarity of two captions in ``[0, 1]``."""
+    return difflib.SequenceMatcher(a=a.lower().split(), b=b.lower().split()).ratio()
+
+
+def run_backend(name: str, images: Sequence[Path], batch_size: int = 8) -> Dict:
+    backend, blip_mode = BENCH_BACKENDS[name]
+    if blip_mode:
+        captioner.configure(blip_mode)
+    mod = get_backend(backend)
+    t0 = time.perf_counter()
+    mod.load()
+    load_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    captions = mod.generate_captions(images, batch_size=batch_size)
+    caption_s = time.perf_counter() - t0
+    words = [len(c.split()) for c in captions]
+    return {
+        "backend": name,
+        "load_s": load_s,
+        "sec_per_image": caption_s / max(1, len(images)),
+        "mean_words": sum(words) / len(words) if words else 0.0,
+        "captions": captions,
+    }
+
+
+def compare(
+    images: Sequence[Path],
+    backends: Sequence[str] = ("blip", "blip-int8"),
+    batch_size: int = 8,
+) -> List[Dict]:
+    """Run every backend on ``images`` and score it against the first one."""
+    results = [run_backend(b, images, batch_size) for b in backends]
+    ref = results[0]
+    for r in results:
+        r["speedup"] = ref["sec_per_image"] / r["sec_per_image"] if r["sec_per_image"] else 0.0
+        sims = [caption_similarity(a, b) for a, b in zip(ref["captions"], r["captions"])]
+        r["similarity"] = sum(sims) / len(sims) if sims else 0.0
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare caption backends on local images")
+    parser.add_argument("images", nargs="+", help="Image files or directories")
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        choices=BENCH_BACKENDS.keys(),
+        default=["blip", "blip-int8"],
+        help="Backends to compare; the first is the reference",
+    )
+    parser.add_argument("--batch-size", type=int, default=8)
+    args = parser.parse_args()
+
+    images = list_images(args.images)
+    if not images:
+        parser.error("no images found")
+    for r in compare(images, args.backends, args.batch_size):
+        print(
+            f"{r['backend']:>10}: load={r['load_s']:.1f}s "
+            f"{r['sec_per_image'] * 1000:.0f}ms/img speedup={r['speedup']:.2f}x "
+            f"words={r['mean_words']:.1f} similarity={r['similarity']:.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
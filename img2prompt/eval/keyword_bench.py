@@ -0,0 +1,72 @@
+"""Time ``KeywordMatcher.search`` against the ``any(k in t ...)`` scan.
+
+Usage::
+
+    python -m img2prompt.eval.keyword_bench --tokens 800 --runs 20
+
+Runs the safe/ban substring tables of ``text_filters`` (and synthetic
+tables of growing size) over random tokens and prints seconds per method.
+"""
+
+from typing import Dict, Sequence
+import argparse
+import random
+import time
+
+from ..utils import text_filters
+from ..utils.keyword_matcher import KeywordMatcher
+
+
+def sample_tokens(n: int, keywords: Sequence[str], seed: int = 0) -> list:
+    """``n`` tokens, about one in ten containing a keyword."""
+    rng = random.Random(seed)
+    words = ["soft", "light", "girl", "smile", "outdoor", "red", "dress", "tree", "hair"]
+    out = []
+    for _ in range(n):
+        t = " ".join(rng.choice(words) for _ in range(rng.randint(1, 4)))
+        if keywords and rng.random() < 0.1:
+            t += " " + rng.choice(list(keywords))
+        out.append(t)
+    return out
+
+
+def bench(keywords: Sequence[str], tokens: Sequence[str], runs: int) -> Dict[str, float]:
+    keywords = list(keywords)
+    matcher = KeywordMatcher(keywords)
+
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        scan = [any(k in t for k in keywords) for t in tokens]
+    scan_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        hits = [matcher.search(t) for t in tokens]
+    matcher_s = time.perf_counter() - t0
+
+    assert hits == scan
+    return {"keywords": len(keywords), "any_scan_s": scan_s, "matcher_s": matcher_s}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark keyword substring matching")
+    parser.add_argument("--tokens", type=int, default=800)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    tables = {
+        "SAFE_SUBSTR": sorted(text_filters.SAFE_SUBSTR),
+        "BAN_SUBSTR": sorted(text_filters.BAN_SUBSTR | text_filters.BAN_PHRASES_SUBSTR),
+    }
+    for size in (100, 1000):
+        tables[f"synthetic_{size}"] = [f"kw{i}x" for i in range(size)]
+    for name, keywords in tables.items():
+        r = bench(keywords, sample_tokens(args.tokens, keywords), args.runs)
+        print(
+            f"{name:14s} keywords={r['keywords']:5d}  "
+            f"any()={r['any_scan_s']:.4f}s  matcher={r['matcher_s']:.4f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,27 @@
 """Image feature extraction modules."""
 
-from . import blip, clip_interrogator, deepdanbooru, wd14_onnx
+from . import (
+    blip,
+    caption_backends,
+    captioner,
+    ci_banks,
+    clip_interrogator,
+    deepdanbooru,
+    florence2,
+    health,
+    runtime,
+    wd14_onnx,
+)
 
-__all__ = ["blip", "clip_interrogator", "deepdanbooru", "wd14_onnx"]
+__all__ = [
+    "blip",
+    "caption_backends",
+    "captioner",
+    "ci_banks",
+    "clip_interrogator",
+    "deepdanbooru",
+    "florence2",
+    "health",
+    "runtime",
+    "wd14_onnx",
+]
@@ -2,34 +2,69 @@
 
 from pathlib import Path
 import logging
-from typing import Optional
+from typing import List, Sequence
+
+from . import captioner, runtime
+from .caption_backends import FALLBACK_CAPTION, caption_in_batches
 
 
 logger = logging.getLogger(__name__)
 
-_processor = None
-_model = None
+DEFAULT_MAX_NEW_TOKENS = 48
 
 
-def _load() -> None:
-    """Load BLIP processor and model lazily."""
-    global _processor, _model
-    if _processor is not None and _model is not None:
-        return
-    try:
-        from transformers import BlipProcessor, BlipForConditionalGeneration
+def load() -> bool:
+    """Load the shared BLIP model and report whether it is usable."""
+    processor, model = captioner.get()
+    return processor is not None and model is not None
 
-        _processor = BlipProcessor.from_pretrained(
-            "Salesforce/blip-image-captioning-base"
-        )
-        _model = BlipForConditionalGeneration.from_pretrained(
-            "Salesforce/blip-image-captioning-base"
+
+def _to_model(inputs, model):
+    """Move processor outputs to the model's device and float dtype."""
+    device = getattr(model, "device", None)
+    if device is not None:
+        inputs = inputs.to(device)
+    pixels = inputs["pixel_values"]
+    dtype = getattr(model, "dtype", None)
+    if dtype is not None and pixels.is_floating_point():
+        pixels = pixels.to(dtype)
+    inputs["pixel_values"] = runtime.prepare_pixels(pixels)
+    return inputs
+
+
+def _generate(processor, model, images, num_beams: int, max_new_tokens: int) -> List[str]:
+    # 画像は processor が同一解像度にリサイズするので、そのまま1バッチに積める
+    inputs = _to_model(processor(images=images, return_tensors="pt"), model)
+    with runtime.inference():
+        out = model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            num_beams=num_beams,
         )
-        _model.eval()
-    except Exception as exc:  # pragma: no cover - fallback path
-        logger.warning("Failed to load BLIP model: %s", exc, exc_info=True)
-        _processor = None
-        _model = None
+    return processor.batch_decode(out, skip_special_tokens=True)
+
+
+def generate_captions(
+    images: Sequence,
+    batch_size: int = 8,
+    num_beams: int = 1,
+    max_new_tokens: int = DEFAULT_MAX_NEW_TOKENS,
+) -> List[str]:
+    """Caption ``images`` (paths or PIL images) in batches.
+
+    ``num_beams=1`` is greedy decoding. Any image that cannot be opened or
+    captioned gets the generic fallback caption.
+    """
+
+    processor, model = captioner.get()
+    if processor is None or model is None:
+        logger.warning("Caption generation failed: BLIP model unavailable")
+        return [FALLBACK_CAPTION] * len(images)
+    return caption_in_batches(
+        images,
+        batch_size,
+        lambda ims: _generate(processor, model, ims, num_beams, max_new_tokens),
+    )
 
 
 def generate_caption(path: Path) -> str:
@@ -38,20 +73,4 @@ def generate_caption(path: Path) -> str:
     Falls back to a generic caption on error.
     """
 
-    try:
-        _load()
-        if _processor is None or _model is None:
-            raise RuntimeError("BLIP model unavailable")
-
-        from PIL import Image
-        import torch
-
-        image = Image.open(path).convert("RGB")
-        inputs = _processor(images=image, return_tensors="pt")
-        with torch.no_grad():
-            out = _model.generate(**inputs, max_new_tokens=48)
-        caption = _processor.decode(out[0], skip_special_tokens=True).strip()
-        return caption or "an image"
-    except Exception as exc:  # pragma: no cover - fallback path
-        logger.warning("Caption generation failed: %s", exc, exc_info=True)
-        return "an image"
+    return generate_captions([path], batch_size=1)[0]
@@ -0,0 +1,81 @@
+"""Pluggable caption backends.
+
+A backend is a module exposing::
+
+    load() -> bool
+    generate_caption(path) -> str
+    generate_captions(images, batch_size=8, num_beams=1, max_new_tokens=...) -> list[str]
+
+``generate_captions`` accepts paths or PIL images and never raises: images
+that cannot be captioned get ``FALLBACK_CAPTION``.
+"""
+
+from importlib import import_module
+import logging
+from typing import Callable, List, Sequence
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_CAPTION = "an image"
+
+# 名前 -> img2prompt.extract 配下のモジュール名
+CAPTION_BACKENDS = {
+    "blip": "blip",
+    "florence2": "florence2",
+}
+
+
+def get_backend(name: str):
+    """Return the backend module registered as ``name``."""
+    if name not in CAPTION_BACKENDS:
+        raise ValueError(f"unknown caption backend: {name}")
+    return import_module(f".{CAPTION_BACKENDS[name]}", __package__)
+
+
+def open_image(item):
+    """Accept a path or an already decoded PIL image."""
+    from PIL import Image
+
+    if isinstance(item, Image.Image):
+        return item.convert("RGB")
+    return Image.open(item).convert("RGB")
+
+
+def caption_in_batches(
+    images: Sequence,
+    batch_size: int,
+    generate: Callable[[list], List[str]],
+) -> List[str]:
+    """Run ``generate`` over ``images`` in batches with per-image fallback.
+
+    A failing batch is retried image by image so one bad input does not sink
+    its neighbours.
+    """
+    captions = [FALLBACK_CAPTION] * len(images)
+
+    loaded = []
+    for i, item in enumerate(images):
+        try:
+            loaded.append((i, open_image(item)))
+        except Exception as exc:  # pragma: no cover - unreadable input
+            logger.warning("Caption generation failed: %s", exc, exc_info=True)
+
+    step = max(1, int(batch_size))
+    for start in range(0, len(loaded), step):
+        chunk = loaded[start:start + step]
+        try:
+            outs = generate([im for _, im in chunk])
+            for (i, _), cap in zip(chunk, outs):
+                captions[i] = cap.strip() or FALLBACK_CAPTION
+            continue
+        except Exception as exc:
+            if len(chunk) == 1:
+                logger.warning("Caption generation failed: %s", exc, exc_info=True)
+                continue
+            logger.warning("Batched captioning failed, retrying per image: %s", exc)
+        for i, im in chunk:
+            try:
+                captions[i] = generate([im])[0].strip() or FALLBACK_CAPTION
+            except Exception as exc:
+                logger.warning("Caption generation failed: %s", exc, exc_info=True)
+    return captions
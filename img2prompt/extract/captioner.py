@@ -0,0 +1,120 @@
+"""Shared BLIP caption model.
+
+``blip.generate_caption`` and CLIP Interrogator both need a BLIP captioner.
+Loading it here once keeps a single copy of the weights per process and lets
+the Interrogator reuse it instead of pulling its own ``blip-large``.
+"""
+
+import logging
+import threading
+from typing import Optional, Tuple
+
+from . import health, runtime
+
+
+logger = logging.getLogger(__name__)
+
+NAME = "blip"
+
+MODEL_ID = "Salesforce/blip-image-captioning-base"
+# clip_interrogator.CAPTION_MODELS のキー
+CI_MODEL_NAME = "blip-base"
+
+# torch: float32 そのまま / int8: Linear 層を動的量子化（CPU向け）
+BACKENDS = ("torch", "int8")
+
+_processor = None
+_model = None
+_backend = "torch"
+# deadline モードでは複数のステージスレッドが同時に初回ロードに来る
+_lock = threading.Lock()
+# バックエンド切替でモデルを捨てるたびに増える（共有先の CI が付け直しに使う）
+MODEL_VERSION = 0
+
+
+def configure(backend: str = "torch") -> None:
+    """Select the BLIP backend; a loaded model is dropped if it changes.
+
+    Dropping the model bumps ``MODEL_VERSION`` so holders of the old model
+    (CLIP Interrogator) attach the new one on their next use.
+    """
+    global _processor, _model, _backend, MODEL_VERSION
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown BLIP backend: {backend}")
+    with _lock:
+        if backend != _backend:
+            _processor = _model = None
+            MODEL_VERSION += 1
+        _backend = backend
+
+
+def _quantize(model):
+    import torch
+
+    return torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def _load() -> None:
+    """Load BLIP processor and model lazily (once, even across threads)."""
+    if _processor is not None and _model is not None:
+        return
+    with _lock:
+        _load_locked()
+
+
+def _load_locked() -> None:
+    global _processor, _model
+    if _processor is not None and _model is not None:
+        return
+    if not health.available(NAME):
+        return
+    try:
+        from transformers import BlipProcessor, BlipForConditionalGeneration
+
+        runtime.apply_threads()
+        processor = BlipProcessor.from_pretrained(MODEL_ID)
+        try:
+            model = BlipForConditionalGeneration.from_pretrained(
+                MODEL_ID, **runtime.model_kwargs()
+            )
+        except ValueError as exc:  # SDPA 非対応の transformers
+            logger.info("BLIP without runtime kwargs: %s", exc)
+            model = BlipForConditionalGeneration.from_pretrained(MODEL_ID)
+        model = runtime.prepare(model)
+        if _backend == "int8":
+            model = _quantize(model)
+        _processor, _model = processor, model
+        health.record_success(NAME)
+    except Exception as exc:  # pragma: no cover - fallback path
+        logger.warning("Failed to load BLIP model: %s", exc, exc_info=True)
+        health.record_failure(NAME, exc)
+        _processor = None
+        _model = None
+
+
+def get() -> Tuple[Optional[object], Optional[object]]:
+    """Return ``(processor, model)``; both are None when BLIP is unavailable."""
+    _load()
+    return _processor, _model
+
+
+def attach(config) -> bool:
+    """Hand the shared model to a ``clip_interrogator.Config``.
+
+    ``config.device`` is left alone, so CLIP still runs where the
+    Interrogator puts it (CUDA when available).  The Interrogator must not
+    caption with the shared model itself: it would move it to that device
+    and cast inputs to float16, breaking the float32 (or int8, CPU-only)
+    model ``blip.py`` uses; ``clip_interrogator`` captions through
+    ``blip.generate_captions`` instead.  Returns False (leaving ``config``
+    untouched) when BLIP could not be loaded.
+    """
+    processor, model = get()
+    if processor is None or model is None:
+        return False
+    config.caption_model = model
+    config.caption_processor = processor
+    config.caption_model_name = CI_MODEL_NAME
+    return True
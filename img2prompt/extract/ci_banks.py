@@ -0,0 +1,176 @@
+"""Pruned label banks for CLIP Interrogator.
+
+Most of the stock label banks can never reach a prompt: ``_rank_phrases``
+only keeps short ASCII phrases and ``text_filters.is_bad_token`` drops
+artist names, manga/comic terms and meta tags.  This module writes a copy of
+the banks without those labels, together with their text embeddings, in
+CLIP Interrogator's own ``data_path``/``cache_path`` layout so that an
+Interrogator can be built directly on the smaller matrices.
+
+Build a profile once::
+
+    python -m img2prompt.extract.ci_banks pruned
+"""
+
+from pathlib import Path
+from typing import List, Optional, Sequence
+import argparse
+import hashlib
+import logging
+import re
+import shutil
+
+import numpy as np
+
+from ..utils.text_filters import is_bad_token
+from .clip_interrogator import _keep_phrase
+
+logger = logging.getLogger(__name__)
+
+BANK_ROOTS = [
+    Path(__file__).resolve().parent / "models" / "ci_banks",
+    Path.cwd() / "models" / "ci_banks",
+]
+
+# artists: "by X" / "inspired by X" を残すかどうか
+BANK_PROFILES = {
+    "pruned": {"artists": True},
+    "pruned_no_artists": {"artists": False},
+}
+
+PRUNED_BANKS = ("flavors", "mediums", "movements")
+
+
+def keep_label(label: str) -> bool:
+    """Return True if ``label`` can survive ``_rank_phrases`` and ``is_bad_token``."""
+    for c in re.split(r"[,\n;/]", (label or "").lower()):
+        c = c.strip()
+        if _keep_phrase(c) and not is_bad_token(c):
+            return True
+    return False
+
+
+def prune_labels(labels: Sequence[str]) -> List[int]:
+    """Return indices of ``labels`` worth keeping."""
+    return [i for i, label in enumerate(labels) if keep_label(label)]
+
+
+def _labels_hash(labels: Sequence[str]) -> str:
+    # clip_interrogator.LabelTable と同じハッシュ
+    return hashlib.sha256(",".join(labels).encode()).hexdigest()
+
+
+def _cache_name(clip_model_name: str, desc: str) -> str:
+    sanitized = clip_model_name.replace("/", "_").replace("@", "_")
+    return f"{sanitized}_{desc}.safetensors"
+
+
+def write_bank(
+    out_dir: Path,
+    clip_model_name: str,
+    desc: str,
+    labels: Sequence[str],
+    embeds,
+) -> Path:
+    """Write embeddings for ``labels`` as a CLIP Interrogator cache file."""
+    from safetensors.numpy import save_file
+
+    digest = _labels_hash(labels)
+    arr = np.asarray(embeds, dtype=np.float16)
+    if len(labels):
+        arr = arr.reshape(len(labels), -1)
+    path = Path(out_dir) / _cache_name(clip_model_name, desc)
+    save_file(
+        {
+            "embeds": arr,
+            "hash": np.array([ord(c) for c in digest], dtype=np.int8),
+        },
+        str(path),
+    )
+    return path
+
+
+def _write_list(path: Path, items: Sequence[str]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("".join(f"{x}\n" for x in items))
+
+
+def find_profile(profile: str) -> Optional[Path]:
+    """Return the directory holding ``profile`` or None if it was never built."""
+    for root in BANK_ROOTS:
+        d = root / profile
+        if (d / "flavors.txt").exists():
+            return d
+    return None
+
+
+def configure(config, profile: str) -> None:
+    """Point a ``clip_interrogator.Config`` at the pruned banks of ``profile``."""
+    if profile not in BANK_PROFILES:
+        raise ValueError(f"unknown CI bank profile: {profile}")
+    d = find_profile(profile)
+    if d is None:
+        raise FileNotFoundError(
+            f"CI bank profile '{profile}' not built; run "
+            f"`python -m img2prompt.extract.ci_banks {profile}`"
+        )
+    config.data_path = str(d)
+    config.cache_path = str(d)
+    config.download_cache = False
+
+
+def build_profile(profile: str, out_root: Optional[Path] = None, ci=None) -> Path:
+    """Prune the stock banks of ``ci`` and store them under ``out_root/profile``."""
+    from clip_interrogator import Config, Interrogator
+    from clip_interrogator.clip_interrogator import load_list
+
+    if profile not in BANK_PROFILES:
+        raise ValueError(f"unknown CI bank profile: {profile}")
+    opts = BANK_PROFILES[profile]
+    ci = ci or Interrogator(Config())
+    cfg = ci.config
+    out_dir = Path(out_root or BANK_ROOTS[0]) / profile
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    for desc in PRUNED_BANKS:
+        table = getattr(ci, desc)
+        idx = prune_labels(table.labels)
+        labels = [table.labels[i] for i in idx]
+        _write_list(out_dir / f"{desc}.txt", labels)
+        write_bank(out_dir, cfg.clip_model_name, desc, labels, [table.embeds[i] for i in idx])
+        logger.info("[ci_banks] %s: %d -> %d", desc, len(table.labels), len(labels))
+
+    # artists は "by X" と "inspired by X" の2行で1名ぶん
+    raw = load_list(cfg.data_path, "artists.txt")
+    n = len(raw)
+    kept = []
+    if opts["artists"]:
+        kept = [
+            i for i, a in enumerate(raw)
+            if keep_label(f"by {a}") or keep_label(f"inspired by {a}")
+        ]
+    _write_list(out_dir / "artists.txt", [raw[i] for i in kept])
+    labels = [f"by {raw[i]}" for i in kept] + [f"inspired by {raw[i]}" for i in kept]
+    rows = [ci.artists.embeds[i] for i in kept] + [ci.artists.embeds[n + i] for i in kept]
+    write_bank(out_dir, cfg.clip_model_name, "artists", labels, rows)
+    logger.info("[ci_banks] artists: %d -> %d", 2 * n, len(labels))
+
+    # 固定の小さい表はそのまま写す
+    shutil.copyfile(Path(cfg.data_path) / "negative.txt", out_dir / "negative.txt")
+    for desc in ("trendings", "negative"):
+        table = getattr(ci, desc)
+        write_bank(out_dir, cfg.clip_model_name, desc, table.labels, table.embeds)
+    return out_dir
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build pruned CLIP Interrogator label banks")
+    parser.add_argument("profile", choices=BANK_PROFILES.keys(), help="Bank profile to build")
+    parser.add_argument("--out", default=None, help="Output root directory")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(build_profile(args.profile, Path(args.out) if args.out else None))
+
+
+if __name__ == "__main__":
+    main()
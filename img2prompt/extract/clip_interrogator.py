@@ -1,45 +1,107 @@
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 from PIL import Image
 from clip_interrogator import Config, Interrogator
-import re, logging, math
+import logging
+
+from . import blip, captioner, health, runtime
+from ..utils import caption_text
 logger = logging.getLogger(__name__)
 
+NAME = "clip_interrogator"
+
 KEYS = [
     "lighting","light","bokeh","grain","35mm","cinematic","sharp focus",
     "depth of field","studio","natural","photograph","photography",
     "soft light","hard light","rim light","volumetric","backlight"
 ]
 
+_ci = None
+_ci_profile = None
+_ci_caption_version = None  # _ci が使っている captioner.MODEL_VERSION
+_ci_shared = False  # _ci のキャプションモデルが captioner の共有モデルか
+
+
+def _reattach(ci) -> bool:
+    """Point an existing Interrogator at the current shared BLIP model."""
+    if not captioner.attach(ci.config):
+        return False
+    ci.caption_model = ci.config.caption_model
+    ci.caption_processor = ci.config.caption_processor
+    # 共有モデルを CI の device へ移させない
+    ci.caption_offloaded = False
+    return True
+
+
+def _caption(image) -> str:
+    if _ci_shared:
+        # 共有モデルはそのモデル自身の device / dtype で回す
+        return blip.generate_captions(
+            [image], batch_size=1, max_new_tokens=_ci.config.caption_max_length
+        )[0]
+    return _ci.generate_caption(image)
+
+
+def _load(bank_profile: Optional[str] = None) -> None:
+    """Lazily build the Interrogator, optionally on a pruned bank profile.
+
+    After ``captioner.configure`` switched the BLIP backend, the cached
+    Interrogator gets the new shared model (or is rebuilt if it cannot).
+    """
+    global _ci, _ci_profile, _ci_caption_version, _ci_shared
+    if _ci is not None and _ci_profile == bank_profile:
+        if _ci_caption_version == captioner.MODEL_VERSION:
+            return
+        if _reattach(_ci):
+            _ci_caption_version = captioner.MODEL_VERSION
+            _ci_shared = True
+            return
+    runtime.apply_threads()
+    config = Config()
+    # BLIPは blip.py と共有（二重ロードを避ける）
+    shared = captioner.attach(config)
+    if bank_profile:
+        from . import ci_banks
+
+        ci_banks.configure(config, bank_profile)
+    _ci = Interrogator(config)
+    if shared:
+        _ci.caption_offloaded = False
+    _ci_shared = shared
+    _ci.clip_model = runtime.prepare(_ci.clip_model)
+    _ci_profile = bank_profile
+    _ci_caption_version = captioner.MODEL_VERSION
+
+
+def _keep_phrase(c: str) -> bool:
+    """``_rank_phrases`` が残すチャンクか（2〜48文字・英数/空白/ハイフンのみ）。"""
+    return caption_text.keep_phrase(c)
+
+
 def _rank_phrases(raw: str, max_take: int = 20) -> List[str]:
-    # ざっくりtf-idf風（長さと广杉性を重視）
-    chunks = [c.strip().lower() for c in re.split(r"[,\n;/]", raw) if 2 <= len(c.strip()) <= 48]
-    # フィルタ：英数・空白・ハイフンのみ通す
-    chunks = [c for c in chunks if re.fullmatch(r"[a-z0-9 \-]+", c) is not None]
-    # KEYSに触れているものは最優先
-    keyed = [c for c in chunks if any(k in c for k in KEYS)]
-    # スコア付け（単語数・ユニーク率）
-    scores = {}
-    for c in set(chunks):
-        tokens = [t for t in c.split() if len(t) > 1]
-        if not tokens: continue
-        uniq = len(set(tokens)) / len(tokens)
-        length = min(len(tokens), 6)
-        bonus = 1.2 if c in keyed else 1.0
-        scores[c] = (uniq * length) * bonus
-    ranked = [c for c,_ in sorted(scores.items(), key=lambda kv: kv[1], reverse=True)]
-    # 最終 picks
-    seen, picks = set(), []
-    for c in ranked:
-        if c not in seen:
-            seen.add(c); picks.append(c)
-        if len(picks) >= max_take:
-            break
-    return picks
-
-def extract_tags(path) -> Tuple[Dict[str,float], List[str], str]:
+    # ざっくりtf-idf風（長さと广杉性を重視）、KEYSに触れているものは1.2倍
+    return caption_text.rank_phrases(raw, KEYS, max_take)
+
+def interrogate(
+    path,
+    caption: Optional[str] = None,
+    bank_profile: Optional[str] = None,
+) -> Tuple[Dict[str,float], List[str], str, str]:
+    """``extract_tags`` と同じ結果に、CIが使ったキャプションを加えて返す。
+
+    ``caption`` を渡すとBLIPでの再生成を省く。
+    """
+    if not health.available(NAME):
+        return {}, [], "", ""
+    try:
+        image = Image.open(path).convert("RGB")
+    except Exception as e:  # 読めない入力は抽出器の故障として数えない
+        logger.warning("CLIP Interrogator could not read %s: %s", path, e)
+        return {}, [], "", ""
     try:
-        ci = Interrogator(Config())
-        raw = ci.interrogate_fast(Image.open(path).convert("RGB"))
+        _load(bank_profile)
+        with runtime.inference():
+            caption = caption or _caption(image)
+            raw = _ci.interrogate_fast(image, caption=caption)
         raw_low = raw.lower()
 
         result: Dict[str,float] = {}
@@ -53,7 +115,18 @@ def extract_tags(path) -> Tuple[Dict[str,float], List[str], str]:
         for c in picks:
             result.setdefault(c, 0.50)
 
-        return result, picks[:20], raw
+        health.record_success(NAME)
+        return result, picks[:20], raw, caption
     except Exception as e:
         logger.warning("CLIP Interrogator failed: %s", e, exc_info=True)
-        return {}, [], ""
+        health.record_failure(NAME, e)
+        return {}, [], "", ""
+
+
+def extract_tags(
+    path,
+    bank_profile: Optional[str] = None,
+    caption: Optional[str] = None,
+) -> Tuple[Dict[str,float], List[str], str]:
+    tags, picks, raw, _ = interrogate(path, caption=caption, bank_profile=bank_profile)
+    return tags, picks, raw
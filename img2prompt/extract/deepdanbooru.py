@@ -1,68 +1,224 @@
-"""Tag extraction using the official DeepDanbooru project."""
+"""Tag extraction using the official DeepDanbooru project.
+
+When a converted ONNX model is present (see ``convert_to_onnx``) it is run
+with onnxruntime instead, so TensorFlow is not needed at runtime::
+
+    python -m img2prompt.extract.deepdanbooru convert
+"""
 
 from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
+import argparse
 import logging
 
+import numpy as np
+
+try:  # pragma: no cover - optional dependency for tests
+    import onnxruntime as ort
+except Exception:  # pragma: no cover - handled gracefully at runtime
+    ort = None  # type: ignore
+
+from . import health
+from ..assemble.normalize import PLACEHOLDER_PREFIXES
+from ..utils import tag_verdicts
+
 logger = logging.getLogger(__name__)
 
+NAME = "deepdanbooru"
+INPUT_SIZE = 512
+ONNX_FILE = "model.onnx"
+TAGS_FILE = "tags.txt"
+
+MODEL_DIRS = [
+    Path(__file__).resolve().parent / "models" / "deepdanbooru",
+    Path.cwd() / "models" / "deepdanbooru",
+]
+
 _model = None
+_session = None
 _tags = None
+# 出力ベクトルのうち使う列（rating: 以外）と、その表示名（_ は空白に置換済み）
+_tag_index: Optional[np.ndarray] = None
+_tag_names: Optional[np.ndarray] = None
+_verdicts: Optional[tag_verdicts.TagVerdicts] = None
+
+
+def _set_tags(tags: Sequence[str], verdict_cache: Optional[Path] = None) -> None:
+    """Precompute the output columns and display names for ``tags``.
+
+    Placeholder tags are dropped from the columns up front, and the filter
+    verdicts of the whole list are built (or read from ``verdict_cache``)
+    and installed in ``text_filters``.
+    """
+    global _tags, _tag_index, _tag_names, _verdicts
+    keep = np.asarray([not t.startswith("rating:") for t in tags], dtype=bool)
+    try:
+        _verdicts = tag_verdicts.load_or_build(tags, verdict_cache)
+        _verdicts.install()
+        keep &= _verdicts.keep
+    except Exception as exc:  # pragma: no cover - verdicts are an optimization only
+        logger.warning("DeepDanbooru tag verdicts failed: %s", exc, exc_info=True)
+        _verdicts = None
+        keep &= [not tag_verdicts.display_name(t).startswith(PLACEHOLDER_PREFIXES) for t in tags]
+    _tags = list(tags)
+    _tag_index = np.flatnonzero(keep).astype(np.int64)
+    _tag_names = np.asarray([tag_verdicts.display_name(tags[i]) for i in _tag_index], dtype=object)
+
+
+def _find_onnx() -> Optional[Path]:
+    for d in MODEL_DIRS:
+        if (d / ONNX_FILE).exists() and (d / TAGS_FILE).exists():
+            return d
+    return None
+
+
+def _read_tags(path: Path) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
 
 
 def _load() -> None:
-    """Lazily load the DeepDanbooru model."""
-    global _model, _tags
-    if _model is not None and _tags is not None:
+    """Lazily load the DeepDanbooru model (ONNX first, then TensorFlow)."""
+    global _model, _session, _tags
+    if (_model is not None or _session is not None) and _tags is not None:
+        return
+    onnx_dir = _find_onnx() if ort is not None else None
+    if onnx_dir is not None:
+        _session = ort.InferenceSession(
+            str(onnx_dir / ONNX_FILE), providers=["CPUExecutionProvider"]
+        )
+        _set_tags(_read_tags(onnx_dir / TAGS_FILE), tag_verdicts.cache_path(NAME))
         return
     try:
         import deepdanbooru as dd  # type: ignore
-    except ImportError:
+    except ImportError as exc:
         logger.info("[deepdanbooru] disabled")
+        health.record_failure(NAME, exc)
         _model = _tags = None
         return
 
     project_path = dd.project.default_project_path()
     _model = dd.project.load_model_from_project(project_path)
-    _tags = dd.project.load_tags_from_project(project_path)
-    _model.eval()
+    _set_tags(
+        dd.project.load_tags_from_project(project_path), tag_verdicts.cache_path(NAME)
+    )
 
 
-def extract_tags(path: Path, threshold: float = 0.35) -> Tuple[Dict[str, float], Optional[str]]:
-    """Return tags and an optional error message for ``path``."""
+def _load_error(exc: Exception) -> str:
+    return (
+        "tensorflow_io missing"
+        if isinstance(exc, ModuleNotFoundError) and "tensorflow_io" in str(exc)
+        else str(exc)
+    )
+
+
+def _preprocess(path) -> np.ndarray:
+    from PIL import Image
+
+    image = Image.open(path).convert("RGB")
+    image = image.resize((INPUT_SIZE, INPUT_SIZE))
+    return np.asarray(image, dtype=np.float32) / 255.0
+
 
+def _predict(x: np.ndarray) -> np.ndarray:
+    """Run the model on a ``(N, 512, 512, 3)`` batch and return ``(N, num_tags)``."""
+    if _session is not None:
+        input_name = _session.get_inputs()[0].name
+        return _session.run(None, {input_name: x})[0]
+    return np.asarray(_model(x, training=False))
+
+
+def _threshold(y: np.ndarray, threshold: float) -> List[Dict[str, float]]:
+    """Vectorized score filter over the precomputed tag columns."""
+    scores = y[:, _tag_index]
+    mask = scores >= threshold
+    out = []
+    for row, m in zip(scores, mask):
+        out.append(dict(zip(_tag_names[m].tolist(), row[m].astype(float).tolist())))
+    return out
+
+
+def extract_tags_batch(
+    paths: Sequence[Path],
+    threshold: float = 0.35,
+    batch_size: int = 8,
+) -> List[Tuple[Dict[str, float], Optional[str]]]:
+    """Return ``(tags, error)`` for each of ``paths``, running the model per batch."""
+
+    if not health.available(NAME):
+        return [({}, None) for _ in paths]
     try:
         _load()
     except Exception as exc:  # pragma: no cover - load failures
         logger.warning("DeepDanbooru load failed: %s", exc, exc_info=True)
-        msg = (
-            "tensorflow_io missing"
-            if isinstance(exc, ModuleNotFoundError) and "tensorflow_io" in str(exc)
-            else str(exc)
-        )
-        return {}, msg
+        health.record_failure(NAME, exc)
+        return [({}, _load_error(exc)) for _ in paths]
 
-    if _model is None or _tags is None:
-        return {}, None
+    if (_model is None and _session is None) or _tags is None:
+        return [({}, None) for _ in paths]
 
-    try:
-        from PIL import Image
-        import numpy as np
-        import torch
-
-        image = Image.open(path).convert("RGB")
-        image = image.resize((512, 512))
-        x = np.asarray(image, dtype=np.float32) / 255.0
-        x = x[None, ...]
-        with torch.no_grad():
-            y = _model(x)[0].numpy()
-
-        result: Dict[str, float] = {}
-        for tag, score in zip(_tags, y):
-            if score >= threshold and not tag.startswith("rating:"):
-                tag = tag.replace("_", " ")
-                result[tag] = float(score)
-        return result, None
-    except Exception as exc:  # pragma: no cover - inference failures
-        logger.warning("DeepDanbooru inference failed: %s", exc, exc_info=True)
-        return {}, str(exc)
+    results: List[Tuple[Dict[str, float], Optional[str]]] = [({}, None)] * len(paths)
+    loaded = []
+    for i, p in enumerate(paths):
+        try:
+            loaded.append((i, _preprocess(p)))
+        except Exception as exc:  # pragma: no cover - unreadable input
+            logger.warning("DeepDanbooru inference failed: %s", exc, exc_info=True)
+            results[i] = ({}, str(exc))
+
+    step = max(1, int(batch_size))
+    for start in range(0, len(loaded), step):
+        chunk = loaded[start:start + step]
+        try:
+            y = _predict(np.stack([x for _, x in chunk]))
+            for (i, _), tags in zip(chunk, _threshold(y, threshold)):
+                results[i] = (tags, None)
+            health.record_success(NAME)
+        except Exception as exc:  # pragma: no cover - inference failures
+            logger.warning("DeepDanbooru inference failed: %s", exc, exc_info=True)
+            health.record_failure(NAME, exc)
+            for i, _ in chunk:
+                results[i] = ({}, str(exc))
+    return results
+
+
+def extract_tags(path: Path, threshold: float = 0.35) -> Tuple[Dict[str, float], Optional[str]]:
+    """Return tags and an optional error message for ``path``."""
+
+    return extract_tags_batch([path], threshold=threshold, batch_size=1)[0]
+
+
+def convert_to_onnx(out_dir: Optional[Path] = None, opset: int = 13) -> Path:
+    """Export the DeepDanbooru project model and its tag list for onnxruntime.
+
+    Needs TensorFlow, ``deepdanbooru`` and ``tf2onnx``; only run once.
+    """
+    import deepdanbooru as dd  # type: ignore
+    import tensorflow as tf  # type: ignore
+    import tf2onnx  # type: ignore
+
+    out_dir = Path(out_dir or MODEL_DIRS[0])
+    out_dir.mkdir(parents=True, exist_ok=True)
+    project_path = dd.project.default_project_path()
+    model = dd.project.load_model_from_project(project_path)
+    tags = dd.project.load_tags_from_project(project_path)
+
+    spec = (tf.TensorSpec((None, INPUT_SIZE, INPUT_SIZE, 3), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(
+        model, input_signature=spec, opset=opset, output_path=str(out_dir / ONNX_FILE)
+    )
+    with open(out_dir / TAGS_FILE, "w", encoding="utf-8") as f:
+        f.write("".join(f"{t}\n" for t in tags))
+    return out_dir
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="DeepDanbooru model utilities")
+    parser.add_argument("command", choices=["convert"], help="Export the model to ONNX")
+    parser.add_argument("--out", default=None, help="Output directory")
+    args = parser.parse_args()
+    print(convert_to_onnx(Path(args.out) if args.out else None))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Image captioning using Florence-2 base."""
+
+from pathlib import Path
+import logging
+from typing import List, Sequence
+
+from . import health, runtime
+from .caption_backends import FALLBACK_CAPTION, caption_in_batches
+
+
+logger = logging.getLogger(__name__)
+
+NAME = "florence2"
+
+MODEL_ID = "microsoft/Florence-2-base"
+# <CAPTION> / <DETAILED_CAPTION> / <MORE_DETAILED_CAPTION>
+TASK = "<DETAILED_CAPTION>"
+DEFAULT_MAX_NEW_TOKENS = 64
+
+_processor = None
+_model = None
+
+
+def _load() -> None:
+    """Load Florence-2 processor and model lazily."""
+    global _processor, _model
+    if _processor is not None and _model is not None:
+        return
+    if not health.available(NAME):
+        return
+    try:
+        from transformers import AutoModelForCausalLM, AutoProcessor
+
+        runtime.apply_threads()
+        _processor = AutoProcessor.from_pretrained(MODEL_ID, trust_remote_code=True)
+        model = AutoModelForCausalLM.from_pretrained(MODEL_ID, trust_remote_code=True)
+        _model = runtime.prepare(model)
+        health.record_success(NAME)
+    except Exception as exc:  # pragma: no cover - fallback path
+        logger.warning("Failed to load Florence-2 model: %s", exc, exc_info=True)
+        health.record_failure(NAME, exc)
+        _processor = None
+        _model = None
+
+
+def load() -> bool:
+    """Load the model and report whether it is usable."""
+    _load()
+    return _processor is not None and _model is not None
+
+
+def _generate(images, num_beams: int, max_new_tokens: int) -> List[str]:
+    inputs = _processor(text=[TASK] * len(images), images=images, return_tensors="pt")
+    with runtime.inference():
+        out = _model.generate(
+            input_ids=inputs["input_ids"],
+            pixel_values=runtime.prepare_pixels(inputs["pixel_values"]),
+            max_new_tokens=max_new_tokens,
+            num_beams=num_beams,
+        )
+    return _processor.batch_decode(out, skip_special_tokens=True)
+
+
+def generate_captions(
+    images: Sequence,
+    batch_size: int = 8,
+    num_beams: int = 1,
+    max_new_tokens: int = DEFAULT_MAX_NEW_TOKENS,
+) -> List[str]:
+    """Caption ``images`` (paths or PIL images) in batches.
+
+    Same contract as ``blip.generate_captions``.
+    """
+
+    if not load():
+        logger.warning("Caption generation failed: Florence-2 model unavailable")
+        return [FALLBACK_CAPTION] * len(images)
+    return caption_in_batches(
+        images,
+        batch_size,
+        lambda ims: _generate(ims, num_beams, max_new_tokens),
+    )
+
+
+def generate_caption(path: Path) -> str:
+    """Generate an English caption for ``path``.
+
+    Falls back to a generic caption on error.
+    """
+
+    return generate_captions([path], batch_size=1)[0]
@@ -0,0 +1,98 @@
+"""Per-extractor health state (circuit breaker).
+
+An extractor that fails ``failure_threshold`` times in a row, or fails with
+an ImportError, is marked unavailable for the rest of the process so that
+large batches do not pay for the same failing load on every image.  After
+``cooldown_s`` seconds one retry is let through; ``cooldown_s=None`` never
+retries.
+"""
+
+import threading
+import time
+from typing import Dict, Optional
+
+_settings = {"failure_threshold": 3, "cooldown_s": 300.0}
+_state: Dict[str, Dict] = {}
+_lock = threading.Lock()
+
+
+def configure(failure_threshold: int = 3, cooldown_s: Optional[float] = 300.0) -> None:
+    _settings["failure_threshold"] = max(1, int(failure_threshold))
+    _settings["cooldown_s"] = cooldown_s
+
+
+def reset(name: Optional[str] = None) -> None:
+    """Forget the state of ``name`` (or of every extractor)."""
+    with _lock:
+        if name is None:
+            _state.clear()
+        else:
+            _state.pop(name, None)
+
+
+def _entry(name: str) -> Dict:
+    return _state.setdefault(
+        name,
+        {"failures": 0, "opened_at": None, "half_open": False, "last_error": None},
+    )
+
+
+def available(name: str) -> bool:
+    """True if ``name`` may run now (closed, or cool-down just elapsed)."""
+    with _lock:
+        st = _state.get(name)
+        if st is None or st["opened_at"] is None:
+            return True
+        cooldown = _settings["cooldown_s"]
+        if cooldown is None or time.monotonic() - st["opened_at"] < cooldown:
+            return False
+        # 冷却期間明け: 1回だけ再試行させる
+        st["opened_at"] = None
+        st["half_open"] = True
+        return True
+
+
+def record_success(name: str) -> None:
+    with _lock:
+        if name in _state:
+            _state[name] = {
+                "failures": 0,
+                "opened_at": None,
+                "half_open": False,
+                "last_error": None,
+            }
+
+
+def record_failure(name: str, exc: BaseException) -> None:
+    with _lock:
+        st = _entry(name)
+        st["failures"] += 1
+        st["last_error"] = str(exc) or type(exc).__name__
+        if (
+            isinstance(exc, ImportError)
+            or st["half_open"]
+            or st["failures"] >= _settings["failure_threshold"]
+        ):
+            st["opened_at"] = time.monotonic()
+        st["half_open"] = False
+
+
+def report(name: str) -> Dict:
+    """State of ``name`` for ``tags_debug``."""
+    with _lock:
+        st = _state.get(name)
+        if st is None:
+            return {"state": "closed", "failures": 0}
+        if st["opened_at"] is not None:
+            state = "open"
+        elif st["half_open"]:
+            state = "half_open"
+        else:
+            state = "closed"
+        out = {"state": state, "failures": st["failures"]}
+        if st["last_error"]:
+            out["last_error"] = st["last_error"]
+        if state == "open" and _settings["cooldown_s"] is not None:
+            left = _settings["cooldown_s"] - (time.monotonic() - st["opened_at"])
+            out["retry_in_s"] = round(max(0.0, left), 1)
+        return out
@@ -0,0 +1,120 @@
+"""Torch CPU runtime settings for the BLIP and CLIP models.
+
+A profile is applied when a torch model is loaded: intra/inter-op thread
+counts, ``inference_mode`` instead of ``no_grad``, the SDPA attention kernel
+and channels-last weights.  When several workers share one host, configure
+each with ``workers=N`` so that together they use the cores once instead of
+N times over.
+"""
+
+from contextlib import contextmanager
+import logging
+import os
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# threads: None = torch の既定 / "auto" = コア数 ÷ workers
+RUNTIME_PROFILES: Dict[str, Dict] = {
+    "default": {
+        "threads": None,
+        "interop_threads": None,
+        "inference_mode": True,
+        "sdpa": True,
+        "channels_last": False,
+    },
+    "shared": {
+        "threads": "auto",
+        "interop_threads": 1,
+        "inference_mode": True,
+        "sdpa": True,
+        "channels_last": True,
+    },
+    "legacy": {
+        "threads": None,
+        "interop_threads": None,
+        "inference_mode": False,
+        "sdpa": False,
+        "channels_last": False,
+    },
+}
+
+_settings: Dict = dict(RUNTIME_PROFILES["default"])
+_threads_applied = False
+
+
+def configure(
+    profile: str = "default",
+    threads: Optional[int] = None,
+    workers: int = 1,
+) -> Dict:
+    """Select a runtime profile for this process and return the resolved settings.
+
+    ``threads`` overrides the profile's intra-op thread count.
+    """
+    global _settings, _threads_applied
+    if profile not in RUNTIME_PROFILES:
+        raise ValueError(f"unknown runtime profile: {profile}")
+    cfg = dict(RUNTIME_PROFILES[profile])
+    if threads:
+        cfg["threads"] = int(threads)
+    if cfg["threads"] == "auto":
+        cfg["threads"] = max(1, (os.cpu_count() or 1) // max(1, int(workers)))
+    _settings = cfg
+    _threads_applied = False
+    return dict(cfg)
+
+
+def settings() -> Dict:
+    return dict(_settings)
+
+
+def apply_threads() -> None:
+    """Apply the thread counts once per process (called at model load time)."""
+    global _threads_applied
+    if _threads_applied:
+        return
+    import torch
+
+    if _settings["threads"]:
+        torch.set_num_threads(int(_settings["threads"]))
+    if _settings["interop_threads"]:
+        try:
+            torch.set_num_interop_threads(int(_settings["interop_threads"]))
+        except RuntimeError as exc:  # 既に並列処理が走った後は変更できない
+            logger.debug("set_num_interop_threads skipped: %s", exc)
+    _threads_applied = True
+
+
+def model_kwargs() -> Dict:
+    """Extra ``from_pretrained`` keyword arguments for transformers models."""
+    return {"attn_implementation": "sdpa"} if _settings["sdpa"] else {}
+
+
+def prepare(model):
+    """Put a loaded model into eval mode with the configured memory format."""
+    model.eval()
+    if _settings["channels_last"]:
+        import torch
+
+        model = model.to(memory_format=torch.channels_last)
+    return model
+
+
+def prepare_pixels(pixel_values):
+    """Match image batches to the model's memory format."""
+    if _settings["channels_last"]:
+        import torch
+
+        return pixel_values.contiguous(memory_format=torch.channels_last)
+    return pixel_values
+
+
+@contextmanager
+def inference():
+    """``torch.inference_mode`` or ``torch.no_grad`` depending on the profile."""
+    import torch
+
+    ctx = torch.inference_mode() if _settings["inference_mode"] else torch.no_grad()
+    with ctx:
+        yield
@@ -10,6 +10,9 @@ import numpy as np
 from PIL import Image
 from huggingface_hub import hf_hub_download
 
+from . import health
+from ..utils import tag_verdicts
+
 try:  # pragma: no cover - optional dependency for tests
     import onnxruntime as ort
 except Exception:  # pragma: no cover - handled gracefully at runtime
@@ -17,6 +20,8 @@ except Exception:  # pragma: no cover - handled gracefully at runtime
 
 logger = logging.getLogger(__name__)
 
+NAME = "wd14_onnx"
+
 MODEL_REPO = "SmilingWolf/wd-v1-4-convnextv2-tagger-v2"
 MODEL_FILE = "model.onnx"
 TAGS_FILE = "selected_tags.csv"
@@ -27,6 +32,10 @@ _session = None
 _names_cats: List[tuple[str, str]] | None = None
 _names: List[str] | None = None
 _cats: List[str] | None = None
+# _names/_cats から前計算した出力列（rating:・character・数字だけの名前を除く）
+_columns: tuple | None = None
+
+CATEGORY_PRIORITY = {"general": 0, "clothing": 1, "selfie": 2, "accessories": 3, "other": 9}
 
 
 def _ensure_files(model_dir: Path):
@@ -65,7 +74,7 @@ def _load() -> None:
         return
     try:
         if ort is None:
-            raise RuntimeError("onnxruntime not installed")
+            raise ImportError("onnxruntime not installed")
 
         bases = [
             Path(__file__).resolve().parent / "models",
@@ -85,42 +94,85 @@ def _load() -> None:
         _names_cats = _read_wd14_tags_csv(tags_path)
         _names = [n for n, _ in _names_cats]
         _cats = [c for _, c in _names_cats]
+        _install_verdicts(tag_verdicts.cache_path(NAME))
     except Exception as exc:  # pragma: no cover - fallback path
         logger.warning("WD14 load failed: %s", exc, exc_info=True)
+        health.record_failure(NAME, exc)
         _session, _names_cats = None, None
 
 
-def _postprocess_wd14(scores, threshold: float = 0.23, topk: int = 60) -> Dict[str, float]:
-    names_cats = list(zip(_names or [], _cats or []))
-    # 1) threshold filter and basic cleaning
-    items = []
-    for (tag, cat), sc in zip(names_cats, scores.tolist()):
-        s = float(sc)
-        if tag.startswith("rating:"):
-            continue
-        if cat == "character":
+def _install_verdicts(cache_path: Path) -> None:
+    """Precompute (or load) the filter verdicts of the usable tag names.
+
+    Their placeholder mask is applied to the output columns, so such names
+    never reach top-K selection.
+    """
+    global _columns
+    try:
+        names, cats, idx, shown, prio = _get_columns()
+        v = tag_verdicts.load_or_build(shown, cache_path)
+        v.install()
+        keep = v.keep
+        _columns = (
+            names,
+            cats,
+            idx[keep],
+            [t for t, k in zip(shown, keep.tolist()) if k],
+            prio[keep],
+        )
+    except Exception as exc:  # pragma: no cover - verdicts are an optimization only
+        logger.warning("WD14 tag verdicts failed: %s", exc, exc_info=True)
+
+
+def _column_table(names: List[str], cats: List[str]):
+    """Usable columns of ``names``/``cats``: indices, display names and category priority."""
+    idx, shown, prio = [], [], []
+    for i, (tag, cat) in enumerate(zip(names, cats)):
+        if tag.startswith("rating:") or cat == "character":
             continue
         t = tag.replace("_", " ").strip().lower()
         if NUMERIC_PAT.match(t):
             continue
-        items.append((t, cat, s))
+        idx.append(i)
+        shown.append(t)
+        prio.append(CATEGORY_PRIORITY.get(cat, 5))
+    return (
+        names,
+        cats,
+        np.asarray(idx, dtype=np.int64),
+        shown,
+        np.asarray(prio, dtype=np.int64),
+    )
+
+
+def _get_columns():
+    global _columns
+    names, cats = _names or [], _cats or []
+    if _columns is None or _columns[0] is not names or _columns[1] is not cats:
+        _columns = _column_table(names, cats)
+    return _columns
 
-    # 2) sort by score desc
-    items.sort(key=lambda x: x[2], reverse=True)
 
-    # 3) category priority for top-K
-    priority = {"general": 0, "clothing": 1, "selfie": 2, "accessories": 3, "other": 9}
-    items.sort(key=lambda x: (priority.get(x[1], 5), -x[2]))
+def _postprocess_wd14(scores, threshold: float = 0.23, topk: int = 60) -> Dict[str, float]:
+    # 1) threshold filter and basic cleaning (precomputed per vocabulary)
+    _names_ref, _cats_ref, idx, shown, prio = _get_columns()
+    if not len(idx):
+        return {}
+    sc = np.asarray(scores, dtype=np.float64)[idx]
+
+    # 2) + 3) category priority, then score desc; ties keep column order
+    order = np.lexsort((-sc, prio))[:topk]
+    items = [(shown[i], float(sc[i])) for i in order.tolist()]
 
     # 4) select top-K respecting threshold
     out: Dict[str, float] = {}
-    for t, c, s in items[:topk]:
+    for t, s in items:
         if s >= threshold:
             out[t] = s
 
     # ensure at least 30 entries
     if len(out) < 30:
-        for t, c, s in items[:topk]:
+        for t, s in items:
             if t not in out:
                 out[t] = s
                 if len(out) >= 30:
@@ -131,18 +183,27 @@ def _postprocess_wd14(scores, threshold: float = 0.23, topk: int = 60) -> Dict[s
 
 def extract_tags(path: Path, threshold: float = 0.23, topk: int = 60) -> Dict[str, float]:
     """Return tags for ``path`` using the WD14 ONNX model."""
+    if not health.available(NAME):
+        return {}
+    try:
+        img = Image.open(path).convert("RGB").resize((448, 448), Image.BICUBIC)
+    except Exception as exc:  # 読めない入力は抽出器の故障として数えない
+        logger.warning("WD14 could not read %s: %s", path, exc)
+        return {}
+    x = np.asarray(img, dtype=np.float32) / 255.0  # (448,448,3)
+    x = x[np.newaxis, ...]  # (1,448,448,3)
     try:
         _load()
         if _session is None or _names_cats is None:
-            raise RuntimeError("WD14 unavailable")
+            return {}
 
-        img = Image.open(path).convert("RGB").resize((448, 448), Image.BICUBIC)
-        x = np.asarray(img, dtype=np.float32) / 255.0  # (448,448,3)
-        x = x[np.newaxis, ...]  # (1,448,448,3)
         input_name = _session.get_inputs()[0].name
         y = _session.run(None, {input_name: x})[0][0]  # (num_tags,)
-        return _postprocess_wd14(y, threshold, topk)
+        tags = _postprocess_wd14(y, threshold, topk)
+        health.record_success(NAME)
+        return tags
     except Exception as exc:  # pragma: no cover - inference failures
         logger.warning("WD14 inference failed: %s", exc, exc_info=True)
+        health.record_failure(NAME, exc)
         return {}
 
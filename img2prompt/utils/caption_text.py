@@ -0,0 +1,119 @@
+"""Caption text processing with patterns compiled once.
+
+- ``prune_objects``: drop "with/holding/at ... <object>" clauses for objects
+  the prompt does not mention (``text_filters.sync_caption_to_prompt``)
+- ``nounish_phrases``: short lower-case phrases of a caption
+  (``bucketize.ensure_50_70``)
+- ``rank_phrases``: CLIP Interrogator chunks ranked by length, word
+  uniqueness and keyword hits (``clip_interrogator._rank_phrases``)
+
+An object list is compiled once into a keyword matcher that finds every
+mentioned object in one pass; only those objects' clause patterns (compiled
+on first use) run, in list order, so the result is the same as trying each
+object in turn.  Each function has a ``*_batch`` form over many captions.
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from .keyword_matcher import KeywordMatcher
+
+_SPACES = re.compile(r"\s{2,}")
+_NOUNISH = re.compile(r"[a-z][a-z ]{2,40}")
+_CHUNK_SPLIT = re.compile(r"[,\n;/]")
+_PHRASE_CHARS = re.compile(r"[a-z0-9 \-]+")
+
+
+@lru_cache(maxsize=None)
+def _object_patterns(obj: str) -> Tuple[re.Pattern, Tuple[re.Pattern, ...]]:
+    o = re.escape(obj)
+    mention = re.compile(rf"\b{o}s?\b", re.I)
+    clauses = (
+        # with/holding/using/on/at/near/by/sitting at/standing at ... <obj>
+        re.compile(rf"\s(?:with|holding|using|on|at|near|by)\b[^,\.]*\b{o}s?\b", re.I),
+        re.compile(rf"\s(?:sitting|standing)\s+(?:at|near|by)\b[^,\.]*\b{o}s?\b", re.I),
+    )
+    return mention, clauses
+
+
+@lru_cache(maxsize=16)
+def _object_table(objects: Tuple[str, ...]) -> Tuple[KeywordMatcher, Dict[str, int]]:
+    order: Dict[str, int] = {}
+    for i, obj in enumerate(objects):
+        order.setdefault(obj.lower(), i)
+    return KeywordMatcher(order), order
+
+
+def prune_objects(caption: str, tokens: Iterable[str], objects: Sequence[str]) -> str:
+    """Remove clauses about ``objects`` that are not among ``tokens``."""
+    if not caption:
+        return caption
+    s = {t.lower().strip() for t in tokens}
+    text = " " + caption.strip()
+    matcher, order = _object_table(tuple(objects))
+    found = [o for o in matcher.findall(text.lower()) if o not in s]
+    for obj in sorted(found, key=order.__getitem__):
+        mention, clauses = _object_patterns(obj)
+        if mention.search(text):
+            for pat in clauses:
+                text = pat.sub("", text)
+    return _SPACES.sub(" ", text).strip(" ,.;")
+
+
+def prune_objects_batch(
+    captions: Sequence[str], token_lists: Sequence[Iterable[str]], objects: Sequence[str]
+) -> List[str]:
+    _object_table(tuple(objects))
+    return [prune_objects(c, t, objects) for c, t in zip(captions, token_lists)]
+
+
+def nounish_phrases(caption: str | None) -> List[str]:
+    """Runs of 3-41 lower-case letters/spaces with one to four words."""
+    return [
+        p.strip()
+        for p in _NOUNISH.findall((caption or "").lower())
+        if 1 <= len(p.split()) <= 4
+    ]
+
+
+def nounish_phrases_batch(captions: Iterable[str | None]) -> List[List[str]]:
+    return [nounish_phrases(c) for c in captions]
+
+
+def keep_phrase(c: str) -> bool:
+    """2-48 characters of ``a-z0-9``, space and hyphen only."""
+    return 2 <= len(c) <= 48 and _PHRASE_CHARS.fullmatch(c) is not None
+
+
+@lru_cache(maxsize=16)
+def _key_matcher(keys: Tuple[str, ...]) -> KeywordMatcher:
+    return KeywordMatcher(keys)
+
+
+def rank_phrases(raw: str, keys: Sequence[str], max_take: int = 20) -> List[str]:
+    """Distinct chunks of ``raw`` ranked by ``uniq * min(words, 6)``, x1.2 with a key.
+
+    Ties keep the order of first appearance.
+    """
+    matcher = _key_matcher(tuple(keys))
+    scores: Dict[str, float] = {}
+    for c in _CHUNK_SPLIT.split(raw):
+        c = c.strip().lower()
+        if c in scores or not keep_phrase(c):
+            continue
+        tokens = [t for t in c.split() if len(t) > 1]
+        if not tokens:
+            continue
+        uniq = len(set(tokens)) / len(tokens)
+        length = min(len(tokens), 6)
+        bonus = 1.2 if matcher.search(c) else 1.0
+        scores[c] = (uniq * length) * bonus
+    ranked = sorted(scores, key=scores.__getitem__, reverse=True)
+    return ranked[:max_take]
+
+
+def rank_phrases_batch(
+    raws: Iterable[str], keys: Sequence[str], max_take: int = 20
+) -> List[List[str]]:
+    return [rank_phrases(r, keys, max_take) for r in raws]
@@ -0,0 +1,43 @@
+"""Multi-keyword substring matching with one compiled regular expression.
+
+``KeywordMatcher(keywords)`` answers "does any keyword occur in this
+string?" with a single ``re`` alternation, so the scan runs in C however
+many keywords there are.  It replaces ``any(k in text for k in KEYWORDS)``
+loops (see ``img2prompt.eval.keyword_bench``).
+"""
+
+import re
+from typing import Dict, FrozenSet, Iterable, Set
+
+
+class KeywordMatcher:
+    """Compiled alternation over a fixed set of keywords."""
+
+    __slots__ = ("keywords", "_pattern", "_starts", "_inside")
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords: FrozenSet[str] = frozenset(k for k in keywords if k)
+        # 長い語を先に並べ、同じ位置では最長の語が当たるようにする
+        ordered = sorted(self.keywords, key=lambda k: (-len(k), k))
+        alt = "|".join(map(re.escape, ordered)) or "(?!)"
+        self._pattern = re.compile(alt)
+        # findall 用: 各位置で始まる最長の語を先読みで拾う
+        self._starts = re.compile(f"(?=({alt}))")
+        # 最長の語から、その中に現れる（重なる・短い）語を引く表
+        self._inside: Dict[str, FrozenSet[str]] = {
+            k: frozenset(o for o in self.keywords if o in k) for k in self.keywords
+        }
+
+    def __bool__(self) -> bool:
+        return bool(self.keywords)
+
+    def search(self, text: str) -> bool:
+        """True if any keyword is a substring of ``text``."""
+        return self._pattern.search(text) is not None
+
+    def findall(self, text: str) -> Set[str]:
+        """Every keyword that occurs in ``text`` (overlapping ones included)."""
+        found: Set[str] = set()
+        for longest in set(self._starts.findall(text)):
+            found |= self._inside[longest]
+        return found
@@ -0,0 +1,233 @@
+"""Declarative drop rules compiled into a trigger-indexed rule set.
+
+A rule is a dict::
+
+    {"any": ["smile"], "drop": ["closed mouth"]}
+    {"all": ["wide aperture", "narrow aperture"], "none": ["shallow depth"],
+     "drop": ["wide aperture"], "style": "photo"}
+    {"any": ["long hair", "short hair", "medium hair"], "min": 2,
+     "drop": ["long hair", "short hair", "medium hair"]}
+
+It fires when at least ``min`` (default 1) of ``any`` are present, all of
+``all`` are present and none of ``none`` is, and then removes ``drop``.
+``style`` limits a rule to one style.  Rules run in list order against the
+current token set.  Since rules only remove tokens, a rule none of whose
+``any``/``all`` terms is present cannot fire later, so ``RuleSet`` indexes
+rules by those trigger terms and only evaluates the ones a token list can
+reach.
+
+The same rules also work as guards: ``RuleSet.blocks`` tells whether a
+term may be added to a token set, i.e. whether any rule that would drop
+it fires on that set.
+
+A rule file is JSON with any of the keys ``normalize``, ``prefer_order``,
+``redundant_groups``, ``contra_fill``, ``contradictions``,
+``base_contradictions``, ``fill_conflicts`` and ``profiles`` (see
+``text_filters.apply_rule_file``).
+"""
+
+from dataclasses import dataclass
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Set
+
+from .vocab import Vocab
+
+RULE_KEYS = {"any", "all", "none", "min", "drop", "style"}
+FILE_KEYS = {
+    "normalize",
+    "prefer_order",
+    "redundant_groups",
+    "contra_fill",
+    "contradictions",
+    "base_contradictions",
+    "fill_conflicts",
+    "profiles",
+}
+# ルールのリストを持つキー
+RULE_LIST_KEYS = ("contradictions", "base_contradictions", "fill_conflicts")
+
+
+def _terms(rule: dict, key: str) -> List[str]:
+    return [t.strip().lower() for t in rule.get(key, [])]
+
+
+def _is_str_list(x) -> bool:
+    return isinstance(x, list) and all(isinstance(t, str) for t in x)
+
+
+def validate_rule(rule: dict) -> None:
+    if not isinstance(rule, dict):
+        raise ValueError(f"rule is not an object: {rule!r}")
+    unknown = set(rule) - RULE_KEYS
+    if unknown:
+        raise ValueError(f"unknown rule keys: {sorted(unknown)}")
+    for key in ("any", "all", "none", "drop"):
+        if key in rule and not _is_str_list(rule[key]):
+            raise ValueError(f"rule {key!r} must be a list of strings: {rule}")
+    if not isinstance(rule.get("min", 1), int) or isinstance(rule.get("min"), bool):
+        raise ValueError(f"rule 'min' must be an integer: {rule}")
+    if not isinstance(rule.get("style", ""), str):
+        raise ValueError(f"rule 'style' must be a string: {rule}")
+    if not rule.get("drop"):
+        raise ValueError(f"rule without 'drop': {rule}")
+    if not rule.get("any") and not rule.get("all"):
+        raise ValueError(f"rule without 'any' or 'all' trigger: {rule}")
+
+
+def validate_rule_data(data, where: str = "rule file") -> None:
+    """Check the shape of a whole rule file; raises ``ValueError``."""
+    if not isinstance(data, dict):
+        raise ValueError(f"{where}: expected a JSON object")
+    unknown = set(data) - FILE_KEYS
+    if unknown:
+        raise ValueError(f"{where}: unknown keys {sorted(unknown)}")
+
+    def mapping(key: str, ok) -> None:
+        d = data.get(key, {})
+        if not isinstance(d, dict) or not all(isinstance(k, str) and ok(v) for k, v in d.items()):
+            raise ValueError(f"{where}: {key!r} has the wrong shape: {d!r}")
+
+    mapping("normalize", lambda v: isinstance(v, str))
+    mapping("prefer_order", lambda v: isinstance(v, int) and not isinstance(v, bool))
+    mapping("contra_fill", _is_str_list)
+    mapping("profiles", lambda v: isinstance(v, dict))
+    for key in RULE_LIST_KEYS:
+        rules = data.get(key, [])
+        if not isinstance(rules, list):
+            raise ValueError(f"{where}: {key!r} must be a list of rules")
+        for r in rules:
+            validate_rule(r)
+    groups = data.get("redundant_groups", [])
+    if not isinstance(groups, list):
+        raise ValueError(f"{where}: 'redundant_groups' must be a list")
+    for g in groups:
+        if not isinstance(g, dict):
+            raise ValueError(f"{where}: redundant group is not an object: {g!r}")
+        if not g.get("terms") or not _is_str_list(g["terms"]):
+            raise ValueError(f"{where}: redundant group without 'terms': {g}")
+        if not isinstance(g.get("prefer", ""), str):
+            raise ValueError(f"{where}: redundant group 'prefer' must be a string: {g}")
+
+
+def rule_terms(rules: Iterable[dict]) -> Set[str]:
+    """Every term the rules mention (to intern them before compiling)."""
+    out: Set[str] = set()
+    for r in rules:
+        for key in ("any", "all", "none", "drop"):
+            out.update(_terms(r, key))
+    return out
+
+
+@dataclass(frozen=True)
+class _Compiled:
+    any: int
+    all: int
+    none: int
+    min: int
+    drop: int
+    style: Optional[str]
+
+    def fires(self, s: int) -> bool:
+        if self.any and (s & self.any).bit_count() < self.min:
+            return False
+        return (s & self.all) == self.all and not (s & self.none)
+
+
+def _index_bits(index: Dict[int, List[int]], mask: int, i: int) -> None:
+    while mask:
+        low = mask & -mask
+        index.setdefault(low, []).append(i)
+        mask ^= low
+
+
+class RuleSet:
+    """Rules compiled to bitmasks of ``vocab``, indexed by trigger and drop bit."""
+
+    def __init__(self, rules: Sequence[dict], vocab: Vocab):
+        self._rules: List[_Compiled] = []
+        self._index: Dict[int, List[int]] = {}
+        self._droppers: Dict[int, List[int]] = {}
+        for i, r in enumerate(rules):
+            validate_rule(r)
+            c = _Compiled(
+                any=vocab.mask(_terms(r, "any")),
+                all=vocab.mask(_terms(r, "all")),
+                none=vocab.mask(_terms(r, "none")),
+                min=int(r.get("min", 1)),
+                drop=vocab.mask(_terms(r, "drop")),
+                style=r.get("style"),
+            )
+            self._rules.append(c)
+            _index_bits(self._index, c.any | c.all, i)
+            _index_bits(self._droppers, c.drop, i)
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+    def candidates(self, s: int) -> List[int]:
+        """Indices (in rule order) of the rules a token mask ``s`` can trigger."""
+        found: Set[int] = set()
+        while s:
+            low = s & -s
+            found.update(self._index.get(low, ()))
+            s ^= low
+        return sorted(found)
+
+    def apply(self, s: int, style: Optional[str] = None, trace: Optional[list] = None) -> int:
+        """Run the reachable rules on mask ``s`` and return the surviving mask.
+
+        With a ``trace`` list, ``(rule index, dropped mask)`` is appended for
+        every rule that removed something.
+        """
+        for i in self.candidates(s):
+            r = self._rules[i]
+            if r.style is not None and r.style != style:
+                continue
+            if r.fires(s):
+                if trace is not None and s & r.drop:
+                    trace.append((i, s & r.drop))
+                s &= ~r.drop
+        return s
+
+    def blocks(self, s: int, m: int, style: Optional[str] = None) -> bool:
+        """True if a rule that drops a bit of ``m`` fires on mask ``s``.
+
+        Nothing is removed: each such rule is checked against ``s`` as is,
+        so mutually exclusive pairs (a drops b, b drops a) are fine here.
+        """
+        while m:
+            low = m & -m
+            for i in self._droppers.get(low, ()):
+                r = self._rules[i]
+                if (r.style is None or r.style == style) and r.fires(s):
+                    return True
+            m ^= low
+        return False
+
+
+def load_rule_file(path) -> dict:
+    """Read and check a JSON rule file."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    validate_rule_data(data, str(path))
+    return data
+
+
+class RuleFileWatcher:
+    """Remembers a rule file's mtime so callers can reload it when it changes."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._mtime: Optional[float] = None
+
+    def changed(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        return True
@@ -0,0 +1,166 @@
+"""Filter verdicts precomputed over a tagger's fixed vocabulary.
+
+WD14 and DeepDanbooru only ever answer with names from their own tag list
+(~10k entries), so whether a name is a placeholder and how
+``text_filters.classify`` judges it (as extracted and after ``SYNONYMS``)
+can be worked out once per model load instead of once per image.
+Extractors use ``keep`` as a boolean mask over their score columns and
+``install`` hands the ``classify`` verdicts to ``text_filters``, so
+per-image filtering no longer depends on how long the rule lists are.
+
+Building the table runs every rule (including the fuzzy artist match) on
+every name, so ``load_or_build`` can keep it in a JSON file keyed by
+``fingerprint()``: a hash of the vocabulary and of every rule table the
+verdicts depend on.  Extractors keep that file in ``cache_path(model)``,
+under the user cache directory rather than next to the (possibly
+read-only) model files.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from ..assemble import normalize
+from . import text_filters
+from .text_filters import TokenInfo
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+# 判定キャッシュの置き場所を上書きする環境変数
+CACHE_DIR_ENV = "IMG2PROMPT_CACHE_DIR"
+
+
+def cache_dir() -> Path:
+    """``$IMG2PROMPT_CACHE_DIR``, else ``$XDG_CACHE_HOME/img2prompt`` (``~/.cache``)."""
+    override = os.environ.get(CACHE_DIR_ENV)
+    if override:
+        return Path(override)
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "img2prompt"
+
+
+def cache_path(model: str) -> Path:
+    """Verdict cache file for the tagger ``model`` (e.g. ``"wd14_onnx"``)."""
+    return cache_dir() / f"{model}_tag_verdicts.json"
+
+
+def display_name(tag: str) -> str:
+    """Name as the extractors report it (``_`` -> space)."""
+    return tag.replace("_", " ")
+
+
+def fingerprint(names: Sequence[str]) -> str:
+    """Hash of ``names`` and of the rule tables the verdicts are derived from."""
+    tf = text_filters
+    tables = {
+        "format": FORMAT_VERSION,
+        "names": list(names),
+        "meta": sorted(tf.META_EXACT),
+        "safe": [sorted(tf.SAFE_EXACT), sorted(tf.SAFE_SUBSTR)],
+        "ban": [sorted(tf.BAN_EXACT), sorted(tf.BAN_SUBSTR), sorted(tf.BAN_PHRASES_SUBSTR)],
+        "artists": [sorted(tf.ARTIST_FULL), sorted(tf.ARTIST_FIRST), sorted(tf.ARTIST_LAST)],
+        "artist_ratios": [tf.ARTIST_FULL_RATIO, tf.ARTIST_PART_RATIO],
+        "framing": sorted(tf.FRAMING_SET),
+        "groups": [sorted(g) for g in tf.REDUNDANT_GROUPS],
+        "synonyms": sorted(normalize.SYNONYMS.items()),
+        "placeholders": list(normalize.PLACEHOLDER_PREFIXES),
+    }
+    blob = json.dumps(tables, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+
+class TagVerdicts:
+    """Per-column verdicts for one vocabulary (``names`` in model order).
+
+    - ``placeholder``: dropped by ``normalize.remove_placeholders``
+    - ``keep``: ``~placeholder``, the mask applied to score columns
+    - ``infos``: ``classify`` results by name, as extracted and after
+      ``SYNONYMS`` (the names ``classify`` is asked about per image)
+    """
+
+    def __init__(self, names: Sequence[str], key: str, infos: Dict[str, TokenInfo], version: int):
+        self.names: List[str] = list(names)
+        self.key = key
+        self.infos = infos
+        self.version = version
+        shown = [display_name(n) for n in self.names]
+        self.placeholder = np.asarray(
+            [n.startswith(normalize.PLACEHOLDER_PREFIXES) for n in shown], dtype=bool
+        )
+        self.keep = ~self.placeholder
+
+    @property
+    def current(self) -> bool:
+        """False once ``text_filters.refresh_rules()`` ran after the build."""
+        return self.version == text_filters.RULES_VERSION
+
+    def install(self) -> int:
+        """Let ``text_filters.classify`` answer from this table; returns its size.
+
+        Stale verdicts (rules refreshed since the build) are not installed.
+        """
+        if not self.current:
+            return 0
+        return text_filters.install_vocab_verdicts(self.infos)
+
+
+def _keys(names: Sequence[str]) -> List[str]:
+    # classify は抽出名（cascade 判定）と SYNONYMS 適用後の名前（merge 後）で呼ばれる
+    out = []
+    for n in names:
+        shown = display_name(n)
+        out.append(shown.strip())
+        out.append(normalize.SYNONYMS.get(shown, shown).strip())
+    return list(dict.fromkeys(out))
+
+
+def build(names: Sequence[str]) -> TagVerdicts:
+    """Run the rules on every name of ``names``."""
+    infos = {k: text_filters.classify(k) for k in _keys(names)}
+    return TagVerdicts(names, fingerprint(names), infos, text_filters.RULES_VERSION)
+
+
+def _read(path: Path, key: str, names: Sequence[str]) -> Optional[TagVerdicts]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("key") != key:
+        return None
+    infos = {k: TokenInfo(*v) for k, v in data["infos"].items()}
+    return TagVerdicts(names, key, infos, text_filters.RULES_VERSION)
+
+
+def load_or_build(names: Sequence[str], path=None) -> TagVerdicts:
+    """``build(names)``, reusing the JSON cache at ``path`` when its key still matches."""
+    key = fingerprint(names)
+    if path is not None:
+        path = Path(path)
+        cached = _read(path, key, names)
+        if cached is not None:
+            return cached
+    v = build(names)
+    if path is not None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # 同じキャッシュを書く他プロセスと一時ファイルがぶつからないよう一意名にする
+            fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump({"key": key, "infos": {k: list(i) for k, i in v.infos.items()}}, f)
+                os.replace(tmp, path)
+            except BaseException:
+                Path(tmp).unlink(missing_ok=True)
+                raise
+        except OSError as exc:  # pragma: no cover - unwritable cache dir
+            logger.warning("Could not write tag verdict cache %s: %s", path, exc)
+    return v
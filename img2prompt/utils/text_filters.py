@@ -1,8 +1,21 @@
 import re, unicodedata
-import difflib
+import copy
 import random
 import hashlib
-from typing import Iterable, Sequence
+import logging
+import multiprocessing as mp
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Iterable, NamedTuple, Sequence
+
+from . import caption_text
+from .artist_index import ArtistIndex, load_names
+from .keyword_matcher import KeywordMatcher
+from .rule_engine import RuleFileWatcher, RuleSet, load_rule_file, rule_terms, validate_rule_data
+from .vocab import Vocab
+
+logger = logging.getLogger(__name__)
 
 NUMERIC_PAT = re.compile(r"^\d+$")
 
@@ -44,40 +57,32 @@ ARTIST_FIRST = {
     "harumi",
 }
 
-_DEFUSE = {a.replace(" ", "") for a in ARTIST_FULL}
-
-def _similar(a: str, b: str) -> float:
-    return difflib.SequenceMatcher(a=a, b=b).ratio()
+# ARTIST_FULL は 0.84、姓名の片側は 0.90 以上の類似度で人名とみなす
+# （判定は refresh_rules() で作る ArtistIndex が行う）
+ARTIST_FULL_RATIO = 0.84
+ARTIST_PART_RATIO = 0.90
+# 名簿由来でも単体では消さない一般語
+ARTIST_PART_WHITELIST = {"maya","max","arnold","blender","unity","unreal"}
 
 def _looks_like_artist(raw: str) -> bool:
-    s = _nfkc_lower(raw)              # 既存の正規化: NFKC + lower + trim を想定
-    nos = s.replace(" ", "")
+    # 完全一致 → 近似一致（1〜2文字崩れ）→ 姓名の片側一致 + もう片側が高類似
+    # → 単語単体でも既知の名簿にあれば弾く
+    return _ARTISTS.match(_nfkc_lower(raw))
 
-    # 完全一致
-    if s in ARTIST_FULL or nos in _DEFUSE:
-        return True
+def add_artist_names(names: Iterable[str]) -> int:
+    """Add full artist names to ``ARTIST_FULL`` and rebuild the index.
 
-    # 近似一致（1〜2文字崩れを検知）
-    for full in ARTIST_FULL:
-        if _similar(nos, full.replace(" ", "")) >= 0.84:
-            return True
-
-    # 姓名の片側一致 + もう片側が高類似
-    parts = s.split()
-    if len(parts) == 2 and (ARTIST_FIRST or ARTIST_LAST):
-        f, l = parts
-        if (l in ARTIST_LAST and ARTIST_FIRST and
-            max(_similar(f, x) for x in ARTIST_FIRST) >= 0.90):
-            return True
-        if (f in ARTIST_FIRST and ARTIST_LAST and
-            max(_similar(l, x) for x in ARTIST_LAST) >= 0.90):
-            return True
-
-    # 追加: 単語単体でも既知の名簿にあれば弾く
-    if (s in ARTIST_FIRST) or (s in ARTIST_LAST):
-        return True
+    Returns the number of new names.
+    """
+    new = {_nfkc_lower(n) for n in names} - ARTIST_FULL - {""}
+    if new:
+        ARTIST_FULL.update(new)
+        refresh_rules()
+    return len(new)
 
-    return False
+def load_artist_names(path) -> int:
+    """Add the names in ``path`` (text file, or WD14 ``selected_tags.csv``)."""
+    return add_artist_names(load_names(path))
 
 # --- 2) 写真語ホワイトリスト（先に通す） ---
 SAFE_SUBSTR = {
@@ -123,14 +128,14 @@ def clean_tokens(tokens):
     for raw in tokens:
         if not raw:
             continue
-        t_raw = raw.strip()
-        t = _nfkc_lower(t_raw)
+        info = classify(raw.strip())
+        t = info.norm
 
-        if is_bad_token(t_raw):
+        if info.bad:
             continue
 
         # 背景は1つだけ
-        if "background" in t:
+        if info.background:
             if bg_kept:
                 continue
             bg_kept = True
@@ -151,24 +156,21 @@ def purge_artist_fragments(tokens: list[str],
     既知の FIRST/LAST 名簿の単語を、単体出現していたら削除する。
     """
     blocked_fullnames = blocked_fullnames or set()
-    first_names = first_names or (ARTIST_FIRST if 'ARTIST_FIRST' in globals() else set())
-    last_names  = last_names  or (ARTIST_LAST  if 'ARTIST_LAST'  in globals() else set())
+
+    # 既知の名簿（refresh_rules() で前計算済み）も対象に
+    if not first_names and not last_names:
+        parts = set(_ARTIST_PARTS)
+    else:
+        names = (first_names or ARTIST_FIRST) | (last_names or ARTIST_LAST)
+        parts = {_nfkc_lower(x).strip() for x in names} - ARTIST_PART_WHITELIST
 
     # 複合名の構成要素（空白区切り）を抽出
-    parts = set()
     for full in blocked_fullnames:
         for p in full.split():
             p = _nfkc_lower(p).strip()
-            if p:
+            if p and p not in ARTIST_PART_WHITELIST:
                 parts.add(p)
 
-    # 既知の名簿も対象に
-    parts |= { _nfkc_lower(x).strip() for x in first_names | last_names }
-
-    # 軽いホワイトリスト（誤爆を避けたい一般語）
-    WHITELIST = {"maya","max","arnold","blender","unity","unreal"}
-    parts -= WHITELIST
-
     # トークンをパージ
     out = []
     for t in tokens:
@@ -204,12 +206,13 @@ BG_GROUPS = [
 
 
 def unify_background(tokens: list[str]) -> list[str]:
-    keep = set(t.lower().strip() for t in tokens)
-    for group in BG_GROUPS:
-        if keep & group:
-            keep -= group
-            keep.add("clean background")
-    return [t for t in tokens if t.lower().strip() in keep]
+    m = _mask(tokens)
+    drop = 0
+    for g in _M["bg_groups"]:
+        if m & g:
+            drop |= g
+    drop &= ~_b("clean background")
+    return [t for t in tokens if not _token_bit(t) & drop]
 
 # 画角ベースで下半身系タグを除去
 UPPER_BODY_CUES = {
@@ -236,68 +239,60 @@ LOWER_GARMENTS = {
 
 
 def drop_invisible_clothes(tokens: list[str]) -> list[str]:
-    s = {t.lower().strip() for t in tokens}
     # 上半身キューが1つでもあれば下半身タグを落とす
-    if s & UPPER_BODY_CUES:
-        return [t for t in tokens if t.lower().strip() not in LOWER_GARMENTS]
+    if _mask(tokens) & _M["upper"]:
+        lower = _M["lower"]
+        return [t for t in tokens if not _token_bit(t) & lower]
     return tokens
 
 
-def drop_contradictions(tags: list[str]) -> list[str]:
-    s = set(t.strip().lower() for t in tags)
-
-    # 髪（既存）
-    hair = {"long hair", "short hair", "very short hair", "medium hair"}
-    if len(s & hair) >= 2:
-        s -= hair
-
-    # 目まわり
-    eye_pos = {"looking at camera", "eye contact", "open eyes"}
-    if (s & eye_pos) and "closed eyes" in s:
-        s.remove("closed eyes")
-
-    # 口まわり
-    if "smile" in s and "closed mouth" in s:
-        s.remove("closed mouth")
-
-    # フレーミング
-    if "tight framing" in s and "loose framing" in s:
-        hint_tight = {"bust shot", "upper body", "head-and-shoulders framing"}
-        if s & hint_tight:
-            s.discard("loose framing")
-        else:
-            s.discard("tight framing")
-    # 上半身キューがあるなら loose framing は落とす
-    if "loose framing" in s and (s & UPPER_BODY_CUES):
-        s.discard("loose framing")
+HAIR_LENGTHS = {"long hair", "short hair", "very short hair", "medium hair"}
+EYE_CONTACT = {"looking at camera", "eye contact", "open eyes"}
+TIGHT_FRAMING_HINTS = {"bust shot", "upper body", "head-and-shoulders framing"}
 
-    # 構図
-    if "rule of thirds" in s and "centered composition" in s:
-        # 迷ったら映える「rule of thirds」を優先
-        s.discard("centered composition")
-    # balanced と centered が同居したら centered を落とす
-    if "balanced composition" in s and "centered composition" in s:
-        s.discard("centered composition")
-
-    # フォーカス
-    if "sharp focus" in s and "soft focus" in s:
-        s.discard("soft focus")
-
-    # 絞り
-    if "wide aperture" in s and "narrow aperture" in s:
-        if "shallow depth" in s:
-            s.discard("narrow aperture")
-        else:
-            s.discard("wide aperture")
 
-    return [t for t in tags if t.strip().lower() in s]
+# drop_contradictions のルール（rule_engine の形式、上から順に評価）
+BASE_CONTRADICTION_RULES = [
+    # 髪
+    {"any": sorted(HAIR_LENGTHS), "min": 2, "drop": sorted(HAIR_LENGTHS)},
+    # 目まわり・口まわり
+    {"any": sorted(EYE_CONTACT), "drop": ["closed eyes"]},
+    {"any": ["smile"], "drop": ["closed mouth"]},
+    # フレーミング（両方あれば tight のヒントで決める、上半身キューがあれば loose は落とす）
+    {
+        "all": ["tight framing", "loose framing"],
+        "any": sorted(TIGHT_FRAMING_HINTS),
+        "drop": ["loose framing"],
+    },
+    {
+        "all": ["tight framing", "loose framing"],
+        "none": sorted(TIGHT_FRAMING_HINTS),
+        "drop": ["tight framing"],
+    },
+    {"any": sorted(UPPER_BODY_CUES), "drop": ["loose framing"]},
+    # 構図（迷ったら映える「rule of thirds」を優先、balanced と同居しても centered を落とす）
+    {"any": ["rule of thirds", "balanced composition"], "drop": ["centered composition"]},
+    # フォーカス・絞り
+    {"any": ["sharp focus"], "drop": ["soft focus"]},
+    {"all": ["wide aperture", "narrow aperture", "shallow depth"], "drop": ["narrow aperture"]},
+    {
+        "all": ["wide aperture", "narrow aperture"],
+        "none": ["shallow depth"],
+        "drop": ["wide aperture"],
+    },
+]
+
+
+def drop_contradictions(tags: list[str]) -> list[str]:
+    return _keep(tags, _M["base_rules"].apply(_mask(tags)))
 
 
 def adjust_framing_for_cues(tokens: list[str]) -> list[str]:
-    s = {t.lower().strip() for t in tokens}
-    if s & UPPER_BODY_CUES and "loose framing" in s:
+    s = _mask(tokens)
+    loose = _b("loose framing")
+    if s & _M["upper"] and s & loose:
         return [
-            "tight framing" if t.lower().strip() == "loose framing" else t
+            "tight framing" if _token_bit(t) == loose else t
             for t in tokens
         ]
     return tokens
@@ -342,69 +337,59 @@ PREFER_ORDER.update(
     }
 )
 
-# すべてのグループを索引化
-_ALL_GROUPS = [set(g) for g in REDUNDANT_GROUPS]
-_TERM2GID = {}
-for gid, group in enumerate(_ALL_GROUPS):
-    for term in group:
-        _TERM2GID[term.lower()] = gid
+# すべてのグループを索引化（refresh_rules() で作り直す）
+_TERM2GID: dict[str, int] = {}
 
 def _would_be_group_dup(term: str, current: list[str]) -> bool:
     """term を入れると同義グループが重複するか？（代表1語ルール）"""
-    gid = _TERM2GID.get(term.lower())
-    if gid is None:
-        return False
-    cur = {t.lower() for t in current}
-    return any(x in cur for x in _ALL_GROUPS[gid])
+    return _group_dup(term.strip().lower(), _mask(current))
 
 
-def _would_conflict(term: str, current: list[str]) -> bool:
-    """候補 term を入れると矛盾や衝突が起きるなら True"""
-    t = term.strip().lower()
-    cur = {c.strip().lower() for c in current}
+def _group_dup(t: str, cur: int) -> bool:
+    # cur は _mask() 済みのトークン集合（補充ループで使い回す）
+    return bool(_M["term_group"].get(t, 0) & cur)
 
-    # 構図
-    if t == "centered composition" and "balanced composition" in cur:
-        return True
-    if t == "balanced composition" and "centered composition" in cur:
-        return True
 
+# 補充候補を入れてはいけない条件（rule_engine の形式、drop の語が候補）。
+# 適用はせず RuleSet.blocks で判定するだけなので、相互に落とし合うルールも書ける。
+FILL_CONFLICT_RULES = [
+    # 構図
+    {"any": ["balanced composition"], "drop": ["centered composition"]},
+    {"any": ["centered composition"], "drop": ["balanced composition"]},
     # フレーミング（上半身キューがあるなら loose は避ける）
-    if (t == "loose framing") and (cur & UPPER_BODY_CUES):
-        return True
-    if (t == "tight framing") and ("loose framing" in cur):
-        return True
-
+    {"any": sorted(UPPER_BODY_CUES), "drop": ["loose framing"]},
+    {"any": ["loose framing"], "drop": ["tight framing"]},
     # フォーカス／絞り
-    if t == "soft focus" and "sharp focus" in cur:
-        return True
-    if t == "sharp focus" and "soft focus" in cur:
-        return True
-    if t == "narrow aperture" and "shallow depth" in cur:
-        return True
-    if t == "wide aperture" and "shallow depth" not in cur and "depth of field" in cur:
-        return False
-
+    {"any": ["sharp focus"], "drop": ["soft focus"]},
+    {"any": ["soft focus"], "drop": ["sharp focus"]},
+    {"any": ["shallow depth"], "drop": ["narrow aperture"]},
     # 目の状態
-    if t == "closed eyes" and ({"looking at camera", "eye contact", "open eyes"} & cur):
-        return True
+    {"any": sorted(EYE_CONTACT), "drop": ["closed eyes"]},
+]
 
-    return False
+
+def _would_conflict(term: str, current: list[str]) -> bool:
+    """候補 term を入れると矛盾や衝突が起きるなら True"""
+    return _conflicts(term.strip().lower(), _mask(current))
+
+
+def _conflicts(t: str, cur: int) -> bool:
+    # cur は _mask() 済みのトークン集合
+    return _M["fill_conflicts"].blocks(cur, _token_bit(t))
 
 
 def compress_redundant(tokens: list[str]) -> list[str]:
     s = [t.strip() for t in tokens]
-    keep = set(t.lower() for t in s)
+    keep = _mask(s)
 
-    for group in REDUNDANT_GROUPS:
-        inter = keep & {g.lower() for g in group}
-        if len(inter) >= 2:
-            ranked = sorted(inter, key=lambda x: PREFER_ORDER.get(x, 999))
-            winner = ranked[0]
-            keep -= inter
-            keep.add(winner)
+    # 各グループで PREFER_ORDER が最小の語（同順位は辞書順）だけを残す
+    for group, ranked in _M["groups"]:
+        inter = keep & group
+        if inter.bit_count() >= 2:
+            winner = next(b for b in ranked if b & inter)
+            keep &= ~(inter & ~winner)
 
-    return [t for t in s if t.lower() in keep]
+    return _keep(s, keep)
 
 
 CAPTION_OBJECTS = [
@@ -430,34 +415,22 @@ CAPTION_OBJECTS = [
 
 
 def sync_caption_to_prompt(caption: str, tokens: list[str]) -> str:
-    if not caption:
-        return caption
-    s = {t.lower().strip() for t in tokens}
-    text = " " + caption.strip()
-
-    for obj in CAPTION_OBJECTS:
-        if obj not in s and re.search(rf"\b{obj}s?\b", text, flags=re.I):
-            # with/holding/using/on/at/near/by/sitting at/standing at ... <obj>
-            patterns = [
-                rf"\s(?:with|holding|using|on|at|near|by)\b[^,\.]*\b{obj}s?\b",
-                rf"\s(?:sitting|standing)\s+(?:at|near|by)\b[^,\.]*\b{obj}s?\b",
-            ]
-            for pat in patterns:
-                text = re.sub(pat, "", text, flags=re.I)
-
-    text = re.sub(r"\s{2,}", " ", text).strip(" ,.;")
-    return text
+    # CAPTION_OBJECTS のうちプロンプトに無い物体への言及（with/holding ... <obj>）を削る
+    return caption_text.prune_objects(caption, tokens, CAPTION_OBJECTS)
 
 
 def is_bad_token(raw: str) -> bool:
     """補完時にも再利用できる禁止語判定。まず“安全語は常に許可”。"""
-    t = _nfkc_lower(raw or "")
+    return classify(raw or "").bad
+
+
+def _bad_token_rule(t: str, raw: str) -> bool:
     # ただしメタ語は必ず弾く
     if t in META_EXACT:
         return True
 
     # ✅ 先にホワイトリスト優先
-    if (t in SAFE_EXACT) or any(k in t for k in SAFE_SUBSTR):
+    if (t in SAFE_EXACT) or _MATCH["safe"].search(t):
         return False
 
     # ❌ 通常のNG判定
@@ -469,9 +442,7 @@ def is_bad_token(raw: str) -> bool:
         return True
     if t in BAN_EXACT:
         return True
-    if any(p in t for p in BAN_PHRASES_SUBSTR):
-        return True
-    if any(b in t for b in BAN_SUBSTR):
+    if _MATCH["ban"].search(t):
         return True
     return False
 
@@ -485,10 +456,15 @@ NORMALIZE_MAP = {
 }
 
 
+def _norm_key(t: str) -> str:
+    # NORMALIZE_MAP のキーと照合側を同じ形にそろえる
+    return t.strip().lower()
+
+
 def normalize_terms(tags: list[str]) -> list[str]:
     out, seen = [], set()
     for t in tags:
-        t2 = NORMALIZE_MAP.get(t, t)
+        t2 = NORMALIZE_MAP.get(_norm_key(t), t)
         if t2 not in seen:
             seen.add(t2)
             out.append(t2)
@@ -705,6 +681,7 @@ def finalize_prompt_safe(
         pool = SAFE_FILL[:]
         rnd.shuffle(pool)
         seen = set(out)
+        seen_mask, rule_mask = _exact_mask(out), _mask(out)
         bg_present = any("background" in t or "backdrop" in t for t in out)
         for w in pool:
             if len(out) >= min_tokens:
@@ -715,14 +692,17 @@ def finalize_prompt_safe(
                 if bg_present:
                     continue
                 w = "clean background"
-            if any(c in seen for c in CONTRA_FILL.get(w, set())):
+            if _M["contra"].get(w, 0) & seen_mask:
                 continue
-            if _would_be_group_dup(w, out):
+            wl = w.strip().lower()
+            if _group_dup(wl, rule_mask):
                 continue
-            if _would_conflict(w, out):
+            if _conflicts(wl, rule_mask):
                 continue
             out.append(w)
             seen.add(w)
+            seen_mask |= _RULES.bit(w)
+            rule_mask |= _token_bit(w)
             if "background" in w or "backdrop" in w:
                 bg_present = True
 
@@ -743,9 +723,12 @@ def finalize_pipeline(
     style: str = "auto",
     profile: str = "auto",
     blocked_names: set[str] | None = None,
+    trace: list | None = None,
+    fill: str = "chain",
 ):
-    tokens = normalize_terms(tokens)
-    tokens = dedupe_background(tokens)
+    reload_rules_if_changed()
+    tokens = _stage(trace, "normalize_terms", normalize_terms, tokens)
+    tokens = _stage(trace, "dedupe_background", dedupe_background, tokens)
     st, pf, tokens, caption, flags = run_pipeline(
         tokens=tokens,
         caption=caption,
@@ -754,10 +737,81 @@ def finalize_pipeline(
         style=style,
         profile=profile,
         blocked_names=blocked_names,
+        trace=trace,
+        fill=fill,
     )
     return st, pf, tokens, caption, flags
 
 
+BATCH_KEYS = ("tokens", "caption", "wd14_tags", "ci_picks")
+
+
+def _batch_record(item) -> tuple:
+    if isinstance(item, dict):
+        return tuple(item.get(k) for k in BATCH_KEYS)
+    rec = tuple(item)
+    return rec + (None,) * (len(BATCH_KEYS) - len(rec))
+
+
+def _finalize_group(st: str, pf: str, records, blocked_names, instrument: bool = False,
+                    fill: str = "chain"):
+    if fill == "constrained":
+        _fill_plan(st, pf, RULES_VERSION)
+    out = []
+    for tokens, caption, _wd14, ci_picks in records:
+        trace = [] if instrument else None
+        tokens = _stage(trace, "normalize_terms", normalize_terms, tokens or [])
+        tokens = _stage(trace, "dedupe_background", dedupe_background, tokens)
+        out.append(_run_routed(tokens, caption, ci_picks, st, pf, blocked_names, trace, fill))
+    return out
+
+
+def finalize_pipeline_batch(
+    items: Iterable,
+    style: str = "auto",
+    profile: str = "auto",
+    blocked_names: set[str] | None = None,
+    processes: int | None = None,
+    instrument: bool = False,
+    fill: str = "chain",
+) -> list[tuple]:
+    """``finalize_pipeline`` over many records, in input order.
+
+    Each item is a ``(tokens, caption, wd14_tags, ci_picks)`` tuple (trailing
+    fields may be omitted) or a dict with those keys.  Rules are reloaded
+    once, items are routed to a style/profile and processed per group, so
+    the group's fill plan (``fill="constrained"``) is built once and shared.  ``processes > 1`` runs
+    the groups in forked worker processes (they inherit the loaded rules and
+    artist names); where ``fork`` is unavailable the batch runs in-process.
+    Results are identical to calling ``finalize_pipeline`` per item.
+
+    ``instrument=True`` traces every item (``flags["stages"]``, see
+    ``run_pipeline``); pass those to ``summarize_traces`` for batch totals.
+    """
+    reload_rules_if_changed()
+    records = [_batch_record(it) for it in items]
+    groups: dict[tuple[str, str], list[int]] = {}
+    for i, (_tok, caption, wd14_tags, _ci) in enumerate(records):
+        groups.setdefault(_route(caption, wd14_tags, style, profile), []).append(i)
+
+    jobs = [
+        (st, pf, [records[i] for i in idx], blocked_names, instrument, fill)
+        for (st, pf), idx in groups.items()
+    ]
+    if processes and processes > 1 and len(jobs) > 1 and "fork" in mp.get_all_start_methods():
+        ctx = mp.get_context("fork")
+        with ProcessPoolExecutor(max_workers=min(processes, len(jobs)), mp_context=ctx) as ex:
+            outs = list(ex.map(_finalize_group, *zip(*jobs)))
+    else:
+        outs = [_finalize_group(*job) for job in jobs]
+
+    results: list = [None] * len(records)
+    for idx, out in zip(groups.values(), outs):
+        for i, res in zip(idx, out):
+            results[i] = res
+    return results
+
+
 # =========================
 # Style / Profile Router
 # =========================
@@ -787,40 +841,40 @@ def choose_style(wd14_tags: Iterable[str], caption: str, prefer: str = "auto") -
         return st
     s = {t.lower().strip() for t in (wd14_tags or [])}
     cap = (caption or "").lower()
-    if (s & ANIME_HINTS) or any(k in cap for k in ANIME_HINTS):
+    if (s & _MATCH["anime"].keywords) or _MATCH["anime"].search(cap):
         return "anime"
     return "photo"
 
 
+MULTI_CUES = [
+    "2girls",
+    "2boys",
+    "3girls",
+    "3boys",
+    "group",
+    "crowd",
+    "several people",
+    "a group of",
+    "multiple people",
+]
+FULLBODY_CUES = [
+    "full body",
+    "full-body",
+    "full length",
+    "full-length",
+    "head to toe",
+    "head-to-toe",
+    "standing full length",
+]
+# select_profile の既定（single_upper）を裏付けるタグ
+SINGLE_CUES = ["solo", "1girl", "1boy", "upper body", "portrait", "cowboy shot", "close-up"]
+
+
 def select_profile(wd14_tags: Iterable[str], caption: str) -> str:
     s = {t.lower().strip() for t in (wd14_tags or [])}
     cap = (caption or "").lower()
-    multi = any(
-        k in s or k in cap
-        for k in [
-            "2girls",
-            "2boys",
-            "3girls",
-            "3boys",
-            "group",
-            "crowd",
-            "several people",
-            "a group of",
-            "multiple people",
-        ]
-    )
-    full = any(
-        k in s or k in cap
-        for k in [
-            "full body",
-            "full-body",
-            "full length",
-            "full-length",
-            "head to toe",
-            "head-to-toe",
-            "standing full length",
-        ]
-    )
+    multi = bool(s & _MATCH["multi"].keywords) or _MATCH["multi"].search(cap)
+    full = bool(s & _MATCH["full"].keywords) or _MATCH["full"].search(cap)
     if not multi and not full:
         return "single_upper"
     if not multi and full:
@@ -830,6 +884,198 @@ def select_profile(wd14_tags: Iterable[str], caption: str) -> str:
     return "group_fullbody"
 
 
+# --- トークン分類キャッシュ -------------------------------------------------
+CLASSIFY_CACHE_SIZE = 65536
+
+
+class TokenInfo(NamedTuple):
+    norm: str  # _nfkc_lower 済み
+    bad: bool  # is_bad_token
+    safe: bool  # SAFE_EXACT / SAFE_SUBSTR
+    background: bool
+    framing: bool  # FRAMING_SET
+    group: int | None  # REDUNDANT_GROUPS の番号
+
+
+# タガー語彙について前計算済みの判定（utils.tag_verdicts が登録、refresh_rules() で破棄）
+_VOCAB_INFO: dict[str, TokenInfo] = {}
+
+
+def install_vocab_verdicts(infos: dict[str, TokenInfo]) -> int:
+    """Register precomputed ``classify`` results; returns the table size.
+
+    They must come from the current rules: ``refresh_rules()`` drops them
+    and ``classify`` computes such names itself again.
+    """
+    _VOCAB_INFO.update(infos)
+    return len(_VOCAB_INFO)
+
+
+@lru_cache(maxsize=CLASSIFY_CACHE_SIZE)
+def classify(raw: str) -> TokenInfo:
+    """Normalized form and rule verdicts for ``raw``, cached until ``refresh_rules()``."""
+    info = _VOCAB_INFO.get(raw)
+    if info is not None:
+        return info
+    t = _nfkc_lower(raw)
+    return TokenInfo(
+        norm=t,
+        bad=_bad_token_rule(t, raw),
+        safe=t in SAFE_EXACT or _MATCH["safe"].search(t),
+        background="background" in t,
+        framing=t in FRAMING_SET,
+        group=_TERM2GID.get(t),
+    )
+
+
+def classify_stats() -> dict:
+    """Hit/miss counters of the ``classify`` cache."""
+    info = classify.cache_info()
+    calls = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "maxsize": info.maxsize,
+        "hit_rate": info.hits / calls if calls else 0.0,
+    }
+
+
+# --- ルール語彙のビットマスク ---------------------------------------------
+# ルール表に出てくる語だけを番号付けし、各グループを int のビット集合にする。
+# トークン列は _mask() で1つの int になり、ルール判定はビット AND で済む。
+_RULES = Vocab()
+_M: dict = {}
+
+
+def _b(term: str) -> int:
+    return _RULES.bit(term)
+
+
+@lru_cache(maxsize=CLASSIFY_CACHE_SIZE)
+def _token_bit(t: str) -> int:
+    return _RULES.bit(t.strip().lower())
+
+
+def _mask(tokens: Iterable[str]) -> int:
+    m = 0
+    for t in tokens:
+        m |= _token_bit(t)
+    return m
+
+
+def _exact_mask(tokens: Iterable[str]) -> int:
+    # CONTRA_FILL は正規化せず完全一致で比べる
+    m = 0
+    for t in tokens:
+        m |= _RULES.bit(t)
+    return m
+
+
+def _keep(tokens: list[str], mask: int) -> list[str]:
+    """Tokens that are not rule terms, or whose bit survived in ``mask``."""
+    out = []
+    for t in tokens:
+        bit = _token_bit(t)
+        if not bit or bit & mask:
+            out.append(t)
+    return out
+
+
+def _compile_masks() -> None:
+    global _RULES
+    groups = [{g.lower() for g in grp} for grp in REDUNDANT_GROUPS]
+    _TERM2GID.clear()
+    _TERM2GID.update({t: gid for gid, g in enumerate(groups) for t in g})
+    tables = [
+        *groups,
+        *BG_GROUPS,
+        STYLE_BG_GROUP,
+        UPPER_BODY_CUES,
+        LOWER_GARMENTS,
+        HAIR_LENGTHS,
+        EYE_CONTACT_STYLE,
+        TIGHT_FRAMING_HINTS,
+        ANIME_PHOTO_TERMS,
+        *([w, *cs] for w, cs in CONTRA_FILL.items()),
+        _RULE_LITERALS,
+        rule_terms(STYLE_CONTRADICTION_RULES),
+        rule_terms(BASE_CONTRADICTION_RULES),
+        rule_terms(FILL_CONFLICT_RULES),
+    ]
+    _RULES = Vocab(sorted(set().union(*map(set, tables))))
+    mask = _RULES.mask
+    ranked = [
+        sorted(g, key=lambda x: (PREFER_ORDER.get(x, 999), x)) for g in groups
+    ]
+    _M.clear()
+    _M.update(
+        groups=[(mask(g), [_b(x) for x in r]) for g, r in zip(groups, ranked)],
+        term_group={t: mask(g) for g in groups for t in g},
+        bg_groups=[mask(g) for g in BG_GROUPS],
+        style_bg=mask(STYLE_BG_GROUP),
+        upper=mask(UPPER_BODY_CUES),
+        lower=mask(LOWER_GARMENTS),
+        hair=mask(HAIR_LENGTHS),
+        eye=mask(EYE_CONTACT),
+        eye_style=mask(EYE_CONTACT_STYLE),
+        tight_hint=mask(TIGHT_FRAMING_HINTS),
+        anime_bans=mask(ANIME_PHOTO_TERMS),
+        contra={w: mask(cs) for w, cs in CONTRA_FILL.items()},
+        style_rules=RuleSet(STYLE_CONTRADICTION_RULES, _RULES),
+        base_rules=RuleSet(BASE_CONTRADICTION_RULES, _RULES),
+        fill_conflicts=RuleSet(FILL_CONFLICT_RULES, _RULES),
+    )
+    _token_bit.cache_clear()
+
+
+# ルール表の外でルール関数が個別に参照する語
+_RULE_LITERALS = {"clean background", "clean backdrop"}
+
+
+# --- キーワード照合の事前コンパイル ---------------------------------------
+RULES_VERSION = 0
+_MATCH: dict[str, KeywordMatcher] = {}
+_ARTISTS: ArtistIndex
+_ARTIST_PARTS: frozenset = frozenset()
+
+
+def refresh_rules() -> int:
+    """Recompile the rule tables after they were edited; returns the new version.
+
+    ``SAFE_SUBSTR``, ``BAN_SUBSTR``/``BAN_PHRASES_SUBSTR``, ``ANIME_HINTS``
+    and the profile cue lists are matched through automata built here, the
+    ``ARTIST_*`` lists through an ``ArtistIndex`` and the rule groups
+    (``REDUNDANT_GROUPS``, ``BG_GROUPS``, ``UPPER_BODY_CUES``,
+    ``LOWER_GARMENTS``, ``CONTRA_FILL``, ``STYLE_CONTRADICTION_RULES``, ...)
+    through bitmasks, so in-place edits to them take effect only after this
+    call.
+    """
+    global RULES_VERSION, _ARTISTS, _ARTIST_PARTS
+    _ARTISTS = ArtistIndex(
+        ARTIST_FULL,
+        ARTIST_FIRST,
+        ARTIST_LAST,
+        full_ratio=ARTIST_FULL_RATIO,
+        part_ratio=ARTIST_PART_RATIO,
+    )
+    _ARTIST_PARTS = frozenset(
+        {_nfkc_lower(x).strip() for x in ARTIST_FIRST | ARTIST_LAST} - ARTIST_PART_WHITELIST
+    )
+    _MATCH.update(
+        safe=KeywordMatcher(SAFE_SUBSTR),
+        ban=KeywordMatcher(BAN_SUBSTR | BAN_PHRASES_SUBSTR),
+        anime=KeywordMatcher(ANIME_HINTS),
+        multi=KeywordMatcher(MULTI_CUES),
+        full=KeywordMatcher(FULLBODY_CUES),
+    )
+    _compile_masks()
+    _VOCAB_INFO.clear()
+    classify.cache_clear()
+    RULES_VERSION += 1
+    return RULES_VERSION
+
+
 PROFILES = {
     "single_upper": {
         "allow_lower_garments": False,
@@ -862,79 +1108,73 @@ PROFILES = {
 }
 
 
+STYLE_BG_GROUP = {
+    "clean background",
+    "simple background",
+    "uncluttered background",
+    "plain background",
+    "soft backdrop",
+    "simple backdrop",
+    "clean backdrop",
+}
+EYE_CONTACT_STYLE = EYE_CONTACT | {"facing viewer"}
+ANIME_PHOTO_TERMS = {
+    "bokeh",
+    "depth of field",
+    "wide aperture",
+    "narrow aperture",
+    "photographic realism",
+}
+
+
 def unify_background_style(tokens: list[str], style: str, enable: bool) -> list[str]:
     if not enable:
         return tokens
     tgt = "clean backdrop" if style == "anime" else "clean background"
-    groups = [
-        {
-            "clean background",
-            "simple background",
-            "uncluttered background",
-            "plain background",
-            "soft backdrop",
-            "simple backdrop",
-            "clean backdrop",
-        },
-    ]
-    keep = set(t.lower().strip() for t in tokens)
-    for g in groups:
-        if keep & g:
-            keep -= g
-            keep.add(tgt)
-    return [t for t in tokens if t.lower().strip() in keep]
-
-
-def drop_contradictions_style(tags: list[str], style: str = "photo") -> list[str]:
-    s = set(t.strip().lower() for t in tags)
-
-    hair = {"long hair", "short hair", "very short hair", "medium hair"}
-    if len(s & hair) >= 2:
-        s -= hair
-
-    eye_pos = {"looking at camera", "eye contact", "open eyes", "facing viewer"}
-    if (s & eye_pos) and "closed eyes" in s:
-        s.remove("closed eyes")
-
-    if "smile" in s and "closed mouth" in s:
-        s.remove("closed mouth")
+    group = _M["style_bg"]
+    if not _mask(tokens) & group:
+        return list(tokens)
+    drop = group & ~_b(tgt)
+    return [t for t in tokens if not _token_bit(t) & drop]
+
+
+# drop_contradictions_style のルール（rule_engine の形式、上から順に評価）
+STYLE_CONTRADICTION_RULES = [
+    {"any": sorted(HAIR_LENGTHS), "min": 2, "drop": sorted(HAIR_LENGTHS)},
+    {"any": sorted(EYE_CONTACT_STYLE), "drop": ["closed eyes"]},
+    {"any": ["smile"], "drop": ["closed mouth"]},
+    {"any": ["tight framing", *sorted(UPPER_BODY_CUES)], "drop": ["loose framing"]},
+    {"any": ["rule of thirds", "balanced composition"], "drop": ["centered composition"]},
+    {"any": ["sharp focus"], "drop": ["soft focus"], "style": "photo"},
+    {
+        "all": ["wide aperture", "narrow aperture", "shallow depth"],
+        "drop": ["narrow aperture"],
+        "style": "photo",
+    },
+    {
+        "all": ["wide aperture", "narrow aperture"],
+        "none": ["shallow depth"],
+        "drop": ["wide aperture"],
+        "style": "photo",
+    },
+    {"any": ["cel shading"], "drop": ["painterly shading"], "style": "anime"},
+    {"any": ["flat shading"], "drop": ["realistic texture"], "style": "anime"},
+    {"any": ["thick outline"], "drop": ["no outline"], "style": "anime"},
+    {"any": sorted(ANIME_PHOTO_TERMS), "drop": sorted(ANIME_PHOTO_TERMS), "style": "anime"},
+]
 
-    if "tight framing" in s and "loose framing" in s:
-        s.discard("loose framing")
-    if "rule of thirds" in s and "centered composition" in s:
-        s.discard("centered composition")
-    if "balanced composition" in s and "centered composition" in s:
-        s.discard("centered composition")
-    if "loose framing" in s and (s & UPPER_BODY_CUES):
-        s.discard("loose framing")
 
-    if style == "photo":
-        if "sharp focus" in s and "soft focus" in s:
-            s.discard("soft focus")
-        if "wide aperture" in s and "narrow aperture" in s:
-            if "shallow depth" in s:
-                s.discard("narrow aperture")
-            else:
-                s.discard("wide aperture")
-
-    if style == "anime":
-        if "cel shading" in s and "painterly shading" in s:
-            s.discard("painterly shading")
-        if "flat shading" in s and "realistic texture" in s:
-            s.discard("realistic texture")
-        if "thick outline" in s and "no outline" in s:
-            s.discard("no outline")
-        for ban in (
-            "bokeh",
-            "depth of field",
-            "wide aperture",
-            "narrow aperture",
-            "photographic realism",
-        ):
-            if ban in s:
-                s.discard(ban)
-
-    return [t for t in tags if t.strip().lower() in s]
+def drop_contradictions_style(
+    tags: list[str], style: str = "photo", rule_drops: dict | None = None
+) -> list[str]:
+    # rule_drops: {STYLE_CONTRADICTION_RULES の番号: 落とした語} を記録する
+    if rule_drops is None:
+        return _keep(tags, _M["style_rules"].apply(_mask(tags), style))
+    fired: list = []
+    s = _M["style_rules"].apply(_mask(tags), style, trace=fired)
+    for i, m in fired:
+        rule_drops.setdefault(str(i), []).extend(t for t in tags if _token_bit(t) & m)
+    return _keep(tags, s)
 
 
 FRAMING_ORDER = [
@@ -947,6 +1187,7 @@ FRAMING_ORDER = [
     "full-length framing",
 ]
 FRAMING_SET = {t.lower() for t in FRAMING_ORDER}
+FRAMING_RANK = {t: i for i, t in enumerate(FRAMING_ORDER)}
 
 
 def compress_framing(tokens: list[str], k: int = 2) -> list[str]:
@@ -958,7 +1199,7 @@ def compress_framing(tokens: list[str], k: int = 2) -> list[str]:
             seen.add(tl)
         else:
             others.append(t)
-    keep = sorted(keep, key=lambda x: FRAMING_ORDER.index(x))[:k]
+    keep = sorted(keep, key=FRAMING_RANK.__getitem__)[:k]
     return [t for t in others] + keep
 
 
@@ -982,25 +1223,31 @@ def finalize_prompt_safe_ext(
         rnd = random.Random(_seed_from_context(context or out))
         rnd.shuffle(pool)
         cur = set(out)
+        cur_mask = _exact_mask(out)
         for w in pool:
             if len(out) >= min_tokens:
                 break
             if w in cur:
                 continue
-            if any(c in cur for c in CONTRA_FILL.get(w, set())):
+            if _M["contra"].get(w, 0) & cur_mask:
                 continue
             out.append(w)
             cur.add(w)
+            cur_mask |= _RULES.bit(w)
     out = compress_redundant(out)
     if len(out) < min_tokens and pool:
+        cur = set(out)
+        out_mask = _exact_mask(out)
         for w in pool:
             if len(out) >= min_tokens:
                 break
-            if w in out:
+            if w in cur:
                 continue
-            if any(c in out for c in CONTRA_FILL.get(w, set())):
+            if _M["contra"].get(w, 0) & out_mask:
                 continue
             out.append(w)
+            cur.add(w)
+            out_mask |= _RULES.bit(w)
     return out[:max_tokens]
 
 
@@ -1026,6 +1273,249 @@ def _choose_safe_pool(style: str, profile: str) -> list[str]:
     return SAFE_FILL
 
 
+# --- 段ごとの計測（run_pipeline の trace） ----------------------------------
+def _stage_record(name: str, before: list[str], after: list[str], t0: int) -> dict:
+    had, kept = set(before), set(after)
+    return {
+        "stage": name,
+        "in": len(before),
+        "out": len(after),
+        "dropped": [t for t in before if t not in kept],
+        "added": [t for t in after if t not in had],
+        "us": (time.perf_counter_ns() - t0) // 1000,
+    }
+
+
+def _stage(trace: list | None, name: str, fn, tokens: list[str], *args, **kwargs) -> list[str]:
+    """``fn(tokens, ...)``; with a ``trace`` list the stage is recorded in it."""
+    if trace is None:
+        return fn(tokens, *args, **kwargs)
+    t0 = time.perf_counter_ns()
+    out = fn(tokens, *args, **kwargs)
+    trace.append(_stage_record(name, tokens, out, t0))
+    return out
+
+
+TRACE_COUNTERS = ("in", "out", "us", "draws", "taken", "rechecks")
+
+
+def summarize_traces(traces: Iterable[list]) -> dict:
+    """Per-stage totals over the ``trace`` lists of many pipeline runs.
+
+    Each stage gets ``calls``, summed ``in``/``out``/``us`` (and fill
+    ``draws``/``taken``/``rechecks``), ``dropped``/``added`` token counts,
+    the most dropped tokens and, for contradiction stages, the tokens
+    removed per rule.
+    """
+    out: dict = {}
+    for trace in traces:
+        for rec in trace or ():
+            agg = out.setdefault(
+                rec["stage"], {"calls": 0, "dropped": 0, "added": 0, "top_dropped": {}}
+            )
+            agg["calls"] += 1
+            for k in TRACE_COUNTERS:
+                if k in rec:
+                    agg[k] = agg.get(k, 0) + rec[k]
+            agg["dropped"] += len(rec["dropped"])
+            agg["added"] += len(rec["added"])
+            for t in rec["dropped"]:
+                agg["top_dropped"][t] = agg["top_dropped"].get(t, 0) + 1
+            for rule, toks in rec.get("rules", {}).items():
+                agg.setdefault("rules", {})
+                agg["rules"][rule] = agg["rules"].get(rule, 0) + len(toks)
+    for agg in out.values():
+        top = sorted(agg["top_dropped"].items(), key=lambda kv: (-kv[1], kv[0]))
+        agg["top_dropped"] = dict(top[:10])
+    return out
+
+
+FILL_MODES = ("chain", "constrained")
+
+
+def fill_chain(
+    tokens: list[str],
+    style: str,
+    profile: str,
+    ci_picks: Sequence[str] | None = None,
+    min_tokens: int = 55,
+    max_tokens: int = 65,
+    trace: list | None = None,
+) -> list[str]:
+    """Top ``tokens`` up with the ``finalize_prompt_safe_ext`` retry chain.
+
+    Fill from the style/profile pool, re-run the contradiction, redundancy
+    and background rules, and fill again (up to three times) while they
+    leave fewer than ``min_tokens``.  Each fill is seeded from ``ci_picks``
+    or, without them, from the tokens it starts with.  This is
+    ``run_pipeline``'s default fill; the result can still hold a
+    redundancy-group duplicate or a second background (``fill_constrained``
+    cannot).  With a ``trace`` list every step is recorded as a stage.
+    """
+    unify_bg = bool(PROFILES[profile]["unify_background"])
+    pool = _choose_safe_pool(style, profile)
+
+    def fill(t, name):
+        return _stage(trace, name, finalize_prompt_safe_ext, t, min_tokens=min_tokens,
+                      max_tokens=max_tokens, context=ci_picks or t, safe_pool=pool)
+
+    def unify(t, name):
+        return _stage(trace, name, unify_background_style, t, style, enable=unify_bg)
+
+    t = fill(tokens, "fill/safe_ext")
+    rules = {} if trace is not None else None
+    t = _stage(trace, "fill/drop_contradictions_style", drop_contradictions_style, t,
+               style=style, rule_drops=rules)
+    if trace is not None:
+        trace[-1]["rules"] = rules
+    t = _stage(trace, "fill/compress_redundant", compress_redundant, t)
+    t = unify(t, "fill/unify_background_style")
+    if len(t) < min_tokens:
+        t = unify(fill(t, "fill/retry1/safe_ext"), "fill/retry1/unify_background_style")
+        if len(t) < min_tokens:
+            t = fill(t, "fill/retry2/safe_ext")
+    t = _stage(trace, "fill/dedupe_background", dedupe_background, t)
+    if len(t) < min_tokens:
+        t = fill(t, "fill/retry3/safe_ext")
+        t = unify(t, "fill/retry3/unify_background_style")
+        t = _stage(trace, "fill/retry3/dedupe_background", dedupe_background, t)
+    return t
+
+
+def _post_fill_rules(
+    tokens: list[str], style: str, unify_bg: bool, trace: list | None = None
+) -> list[str]:
+    """The rules a filled prompt must survive (formerly re-run after every fill)."""
+    if trace is None:
+        t = drop_contradictions_style(tokens, style=style)
+        t = compress_redundant(t)
+        t = unify_background_style(t, style, enable=unify_bg)
+        return dedupe_background(t)
+    rules: dict = {}
+    t = _stage(trace, "fill/drop_contradictions_style", drop_contradictions_style, tokens,
+               style=style, rule_drops=rules)
+    trace[-1]["rules"] = rules
+    t = _stage(trace, "fill/compress_redundant", compress_redundant, t)
+    t = _stage(trace, "fill/unify_background_style", unify_background_style, t, style,
+               enable=unify_bg)
+    return _stage(trace, "fill/dedupe_background", dedupe_background, t)
+
+
+# _fill_plan の各語の扱い
+_FILL_PLAIN, _FILL_TOUCH, _FILL_NEVER = range(3)
+
+
+@lru_cache(maxsize=64)
+def _fill_plan(style: str, profile: str, version: int):
+    """Pool of ``style``/``profile`` with per-entry constraints, per rules version.
+
+    Each entry is ``(word, contra_mask, touch_mask, beaten_mask, bg, kind)``.
+    ``_FILL_PLAIN`` words touch no rule and are appended as is.  A
+    ``_FILL_TOUCH`` word only needs the post-fill rules re-run when the
+    prompt already holds a term of ``touch_mask`` (terms sharing a
+    redundancy group, a contradiction rule or the unified background group
+    with it); otherwise it is rejected when the prompt holds a preferred
+    group mate from ``beaten_mask`` or, for ``bg`` words, another
+    background (``dedupe_background`` keeps the first), and appended if
+    not.  ``_FILL_NEVER`` words are removed by the rules on their own.
+    The order is the pool's, so shuffling the plan draws the same words
+    as shuffling the pool.
+    """
+    unify_bg = bool(PROFILES[profile]["unify_background"])
+    rules = [r for r in STYLE_CONTRADICTION_RULES if r.get("style") in (None, style)]
+    plan = []
+    for w in _choose_safe_pool(style, profile):
+        bit = _token_bit(w)
+        bg = "background" in w
+        if not bit and not bg:
+            plan.append((w, _M["contra"].get(w, 0), 0, 0, False, _FILL_PLAIN))
+            continue
+        kind = _FILL_TOUCH if _post_fill_rules([w], style, unify_bg) == [w] else _FILL_NEVER
+        key = w.strip().lower()
+        touch = beaten = _M["term_group"].get(key, 0)
+        for r in rules:
+            terms = rule_terms([r])
+            if key in terms:
+                touch |= _RULES.mask(terms)
+                beaten = 0
+        if unify_bg and bit & _M["style_bg"]:
+            touch |= _M["style_bg"]
+            beaten = 0
+        if beaten:
+            ranked = next(r for g, r in _M["groups"] if g & bit)
+            beaten = sum(ranked[: ranked.index(bit)])
+        plan.append((w, _M["contra"].get(w, 0), touch | bit, beaten, bg, kind))
+    return tuple(plan)
+
+
+def fill_constrained(
+    tokens: list[str],
+    style: str,
+    profile: str,
+    min_tokens: int = 55,
+    max_tokens: int = 65,
+    context: Sequence[str] | None = None,
+    trace: list | None = None,
+) -> list[str]:
+    """Top ``tokens`` up from the style/profile SAFE_FILL pool in one pass.
+
+    Opt-in alternative to ``fill_chain`` (``fill="constrained"``): the pool
+    is shuffled once (same seed as the chain's first fill) and a word is
+    only taken if it does not conflict via ``CONTRA_FILL`` and survives the
+    post-fill rules (contradictions, redundancy, background
+    unification/dedupe), so nothing taken is removed afterwards.  The
+    result always satisfies those rules, so it differs from the chain's
+    whenever the chain needs a retry or leaves a rule violation behind.
+
+    With a ``trace`` list the preparation steps and the draw (``draws``:
+    pool words looked at, ``taken``, ``rechecks``: full rule re-runs) are
+    recorded as stages (see ``run_pipeline``).
+    """
+    unify_bg = bool(PROFILES[profile]["unify_background"])
+    t0 = time.perf_counter_ns() if trace is not None else 0
+    cur = compress_redundant(tokens)[:max_tokens]
+    if trace is not None:
+        trace.append(_stage_record("fill/trim", tokens, cur, t0))
+    cur = _post_fill_rules(cur, style, unify_bg, trace)
+    if len(cur) >= min_tokens:
+        return cur
+    t0 = time.perf_counter_ns() if trace is not None else 0
+    before = cur[:] if trace is not None else cur
+    draws = rechecks = 0
+    plan = list(_fill_plan(style, profile, RULES_VERSION))
+    random.Random(_seed_from_context(context or tokens)).shuffle(plan)
+    seen, seen_mask, rule_mask = set(cur), _exact_mask(cur), _mask(cur)
+    has_bg = any("background" in t for t in cur)
+    for w, contra, touch, beaten, bg, kind in plan:
+        if len(cur) >= min_tokens:
+            break
+        draws += 1
+        if kind == _FILL_NEVER or w in seen or contra & seen_mask or beaten & rule_mask:
+            continue
+        if touch & rule_mask:
+            rechecks += 1
+            new = _post_fill_rules(cur + [w], style, unify_bg)
+            if w not in new:
+                continue
+            cur, seen = new, set(new)
+            seen_mask, rule_mask = _exact_mask(new), _mask(new)
+            has_bg = any("background" in t for t in cur)
+            continue
+        if bg and has_bg:
+            continue
+        cur.append(w)
+        seen.add(w)
+        seen_mask |= _RULES.bit(w)
+        rule_mask |= _token_bit(w)
+        has_bg = has_bg or bg
+    cur = cur[:max_tokens]
+    if trace is not None:
+        rec = _stage_record("fill/draw", before, cur, t0)
+        rec.update(draws=draws, taken=len(rec["added"]), rechecks=rechecks)
+        trace.append(rec)
+    return cur
+
+
 def run_pipeline(
     tokens: list[str],
     caption: str | None,
@@ -1034,60 +1524,66 @@ def run_pipeline(
     style: str = "auto",
     profile: str = "auto",
     blocked_names: set[str] | None = None,
+    trace: list | None = None,
+    fill: str = "chain",
 ):
+    """Route to a style/profile, apply the rules, fill and sync the caption.
+
+    ``fill`` picks how the prompt is topped up to 55 tokens: ``"chain"``
+    (``fill_chain``, the default) or ``"constrained"`` (``fill_constrained``).
+
+    With a ``trace`` list every stage appends a record to it (and the list
+    is returned as ``flags["stages"]``): ``stage``, token counts
+    ``in``/``out``, the ``dropped``/``added`` tokens and elapsed ``us``;
+    contradiction stages add the tokens each rule removed (``rules``, keyed
+    by ``STYLE_CONTRADICTION_RULES`` index) and the constrained fill draw
+    adds ``draws``/``taken``/``rechecks``.  ``summarize_traces`` aggregates
+    the records of many runs.
+    """
+    reload_rules_if_changed()
+    st, pf = _route(caption, wd14_tags, style, profile)
+    return _run_routed(tokens, caption, ci_picks, st, pf, blocked_names, trace, fill)
+
+
+def _route(caption, wd14_tags, style: str, profile: str) -> tuple[str, str]:
     st = choose_style(wd14_tags or [], caption or "", prefer=style)
     pf = profile if profile in PROFILES else select_profile(wd14_tags or [], caption or "")
+    return st, pf
+
+
+def _run_routed(tokens, caption, ci_picks, st: str, pf: str, blocked_names, trace=None,
+                fill: str = "chain"):
+    if fill not in FILL_MODES:
+        raise ValueError(f"unknown fill mode: {fill}")
     cfg = PROFILES[pf]
-    pool = _choose_safe_pool(st, pf)
 
     t = tokens[:]
 
-    t = unify_background_style(t, st, enable=bool(cfg["unify_background"]))
+    t = _stage(trace, "unify_background_style", unify_background_style, t, st,
+               enable=bool(cfg["unify_background"]))
     if st == "photo" and not cfg["allow_lower_garments"]:
-        t = drop_invisible_clothes(t)
-    t = drop_contradictions_style(t, style=st)
-    t = purge_artist_fragments(t, blocked_fullnames=blocked_names)
-    t = compress_framing(t, k=int(cfg["framing_k"]))
-
-    t = finalize_prompt_safe_ext(
-        t,
-        min_tokens=55,
-        max_tokens=65,
-        context=ci_picks or t,
-        safe_pool=pool,
-    )
-
-    t = drop_contradictions_style(t, style=st)
-    t = compress_redundant(t)
-    t = unify_background_style(t, st, enable=bool(cfg["unify_background"]))
-    if len(t) < 55:
-        t = finalize_prompt_safe_ext(
-            t,
-            min_tokens=55,
-            max_tokens=65,
-            context=ci_picks or t,
-            safe_pool=pool,
-        )
-        t = unify_background_style(t, st, enable=bool(cfg["unify_background"]))
-        if len(t) < 55:
-            t = finalize_prompt_safe_ext(
-                t,
-                min_tokens=55,
-                max_tokens=65,
-                context=ci_picks or t,
-                safe_pool=pool,
-            )
-    t = dedupe_background(t)
-    if len(t) < 55:
-        t = finalize_prompt_safe_ext(
+        t = _stage(trace, "drop_invisible_clothes", drop_invisible_clothes, t)
+    rules = {} if trace is not None else None
+    t = _stage(trace, "drop_contradictions_style", drop_contradictions_style, t, style=st,
+               rule_drops=rules)
+    if trace is not None:
+        trace[-1]["rules"] = rules
+    t = _stage(trace, "purge_artist_fragments", purge_artist_fragments, t,
+               blocked_fullnames=blocked_names)
+    t = _stage(trace, "compress_framing", compress_framing, t, k=int(cfg["framing_k"]))
+
+    if fill == "constrained":
+        t = fill_constrained(
             t,
+            st,
+            pf,
             min_tokens=55,
             max_tokens=65,
             context=ci_picks or t,
-            safe_pool=pool,
+            trace=trace,
         )
-        t = unify_background_style(t, st, enable=bool(cfg["unify_background"]))
-        t = dedupe_background(t)
+    else:
+        t = fill_chain(t, st, pf, ci_picks, min_tokens=55, max_tokens=65, trace=trace)
 
     try:
         new_cap = sync_caption_to_prompt(caption or "", t)
@@ -1102,6 +1598,133 @@ def run_pipeline(
         "framing_k": int(cfg["framing_k"]),
         "hair": cfg["hair_rules"],
     }
+    if trace is not None:
+        flags["stages"] = trace
 
     return st, pf, t, new_cap, flags
 
+
+# --- ルールファイル（JSON）と自動再読み込み -----------------------------------
+_RULE_WATCHER: RuleFileWatcher | None = None
+_RULE_DEFAULTS: dict = {}
+
+
+def _rule_tables() -> dict:
+    """The editable rule tables by rule-file key (the live objects)."""
+    return {
+        "normalize": NORMALIZE_MAP,
+        "prefer_order": PREFER_ORDER,
+        "redundant_groups": REDUNDANT_GROUPS,
+        "contra_fill": CONTRA_FILL,
+        "contradictions": STYLE_CONTRADICTION_RULES,
+        "base_contradictions": BASE_CONTRADICTION_RULES,
+        "fill_conflicts": FILL_CONFLICT_RULES,
+        "profiles": PROFILES,
+    }
+
+
+def _set_rule_tables(d: dict) -> None:
+    # 各表はモジュール外からも参照されるので、差し替えずに中身を入れ替える
+    for key, table in _rule_tables().items():
+        if isinstance(table, dict):
+            table.clear()
+            table.update(d[key])
+        else:
+            table[:] = d[key]
+
+
+def _restore_rule_defaults() -> None:
+    _set_rule_tables(copy.deepcopy(_RULE_DEFAULTS))
+
+
+def _build_rule_tables(data: dict) -> dict:
+    """Built-in tables plus ``data``, as new objects; raises ``ValueError``."""
+    validate_rule_data(data)
+    template = _RULE_DEFAULTS["profiles"]["single_upper"]
+    for name, cfg in data.get("profiles", {}).items():
+        if name not in _RULE_DEFAULTS["profiles"] and set(cfg) != set(template):
+            raise ValueError(f"new profile {name!r} must define {sorted(template)}")
+        for key, value in cfg.items():
+            if key not in template or type(value) is not type(template[key]):
+                raise ValueError(f"profile {name!r}: bad {key!r} value {value!r}")
+    d = copy.deepcopy(_RULE_DEFAULTS)
+    d["normalize"].update(
+        {_norm_key(k): v.lower() for k, v in data.get("normalize", {}).items()}
+    )
+    d["prefer_order"].update({k.lower(): v for k, v in data.get("prefer_order", {}).items()})
+    for g in data.get("redundant_groups", []):
+        d["redundant_groups"].append({t.lower() for t in g["terms"]})
+        if g.get("prefer"):
+            d["prefer_order"][g["prefer"].lower()] = 0
+    for w, cs in data.get("contra_fill", {}).items():
+        d["contra_fill"].setdefault(w.lower(), set()).update(c.lower() for c in cs)
+    d["contradictions"].extend(data.get("contradictions", []))
+    d["base_contradictions"].extend(data.get("base_contradictions", []))
+    d["fill_conflicts"].extend(data.get("fill_conflicts", []))
+    for name, cfg in data.get("profiles", {}).items():
+        d["profiles"].setdefault(name, {}).update(cfg)
+    return d
+
+
+def apply_rule_file(data: dict) -> int:
+    """Reset the rule tables to the built-in ones, add ``data`` and recompile.
+
+    ``data`` is a loaded rule file (``rule_engine.load_rule_file``):
+
+    - ``normalize``: extra ``NORMALIZE_MAP`` entries
+    - ``prefer_order``: extra ``PREFER_ORDER`` ranks
+    - ``redundant_groups``: ``[{"terms": [...], "prefer": term?}]``
+    - ``contra_fill``: ``{term: [conflicting fill terms]}``
+    - ``contradictions``: rules appended to ``STYLE_CONTRADICTION_RULES``
+    - ``base_contradictions``: rules appended to ``BASE_CONTRADICTION_RULES``
+      (``drop_contradictions``)
+    - ``fill_conflicts``: rules appended to ``FILL_CONFLICT_RULES``; a fill
+      term is skipped when a rule dropping it fires on the current tokens
+    - ``profiles``: ``{name: {key: value}}`` merged into ``PROFILES``
+
+    The whole file is checked and built first, so a bad file raises
+    ``ValueError`` and leaves the current rules untouched.  Returns the new
+    rules version.
+    """
+    tables = _build_rule_tables(data)
+    previous = copy.deepcopy(_rule_tables())
+    _set_rule_tables(tables)
+    try:
+        return refresh_rules()
+    except Exception:
+        _set_rule_tables(previous)
+        refresh_rules()
+        raise
+
+
+def use_rule_file(path) -> None:
+    """Load rules from ``path`` now and reload them whenever the file changes.
+
+    ``path=None`` goes back to the built-in rules.
+    """
+    global _RULE_WATCHER
+    if path is None:
+        _RULE_WATCHER = None
+        _restore_rule_defaults()
+        refresh_rules()
+        return
+    watcher = RuleFileWatcher(path)
+    watcher.changed()
+    apply_rule_file(load_rule_file(path))
+    _RULE_WATCHER = watcher
+
+
+def reload_rules_if_changed() -> bool:
+    """Re-apply the rule file if its mtime changed; a broken file keeps the old rules."""
+    if _RULE_WATCHER is None or not _RULE_WATCHER.changed():
+        return False
+    try:
+        apply_rule_file(load_rule_file(_RULE_WATCHER.path))
+    except Exception as exc:  # 壊れたファイルでは直前のルールのまま続ける
+        logger.warning("Rule file %s not reloaded: %s", _RULE_WATCHER.path, exc)
+        return False
+    return True
+
+
+_RULE_DEFAULTS.update(copy.deepcopy(_rule_tables()))
+refresh_rules()
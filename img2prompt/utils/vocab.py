@@ -0,0 +1,57 @@
+"""Interned term vocabulary.
+
+Each term gets a small integer id in insertion order and the bit
+``1 << id``, so a set of terms is a Python ``int`` and a rule check is a
+bitwise AND.
+"""
+
+from typing import Dict, Iterable, List, Optional
+
+
+class Vocab:
+    """Term <-> id table with bitmask helpers."""
+
+    __slots__ = ("_ids", "terms")
+
+    def __init__(self, terms: Iterable[str] = ()):
+        self._ids: Dict[str, int] = {}
+        self.terms: List[str] = []
+        for t in terms:
+            self.intern(t)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __contains__(self, term: str) -> bool:
+        return term in self._ids
+
+    def intern(self, term: str) -> int:
+        """Id of ``term``, adding it if new."""
+        i = self._ids.get(term)
+        if i is None:
+            i = self._ids[term] = len(self.terms)
+            self.terms.append(term)
+        return i
+
+    def id(self, term: str) -> Optional[int]:
+        return self._ids.get(term)
+
+    def bit(self, term: str) -> int:
+        """``1 << id`` for a known term, ``0`` otherwise."""
+        i = self._ids.get(term)
+        return 0 if i is None else 1 << i
+
+    def mask(self, terms: Iterable[str]) -> int:
+        m = 0
+        for t in terms:
+            m |= self.bit(t)
+        return m
+
+    def terms_of(self, mask: int) -> List[str]:
+        """Terms whose bits are set in ``mask``, in id order."""
+        out = []
+        while mask:
+            low = mask & -mask
+            out.append(self.terms[low.bit_length() - 1])
+            mask ^= low
+        return out
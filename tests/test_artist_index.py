@@ -0,0 +1,83 @@
+import difflib
+import random
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+from img2prompt.utils import text_filters
+from img2prompt.utils.artist_index import ArtistIndex, RatioIndex, load_names, ratio
+
+
+def _linear_scan(s, full, first, last):
+    """The difflib scan ``_looks_like_artist`` used before the index."""
+    sim = lambda a, b: difflib.SequenceMatcher(a=a, b=b).ratio()
+    nos = s.replace(" ", "")
+    if s in full or nos in {a.replace(" ", "") for a in full}:
+        return True
+    if any(sim(nos, f.replace(" ", "")) >= 0.84 for f in full):
+        return True
+    parts = s.split()
+    if len(parts) == 2 and (first or last):
+        f, l = parts
+        if l in last and first and max(sim(f, x) for x in first) >= 0.90:
+            return True
+        if f in first and last and max(sim(l, x) for x in last) >= 0.90:
+            return True
+    return s in first or s in last
+
+
+def test_index_matches_linear_scan():
+    rng = random.Random(0)
+    full, first, last = text_filters.ARTIST_FULL, text_filters.ARTIST_FIRST, text_filters.ARTIST_LAST
+    index = ArtistIndex(full, first, last)
+    probes = ["soft lighting", "makoto shinkai", "makoto shinkaj", "rei hiro", "ayami kojma"]
+    for name in sorted(full):
+        for _ in range(20):
+            chars = list(name)
+            for _ in range(rng.randint(0, 3)):
+                op = rng.randrange(3)
+                i = rng.randrange(len(chars) + (op == 1))
+                if op == 0 and chars:
+                    del chars[min(i, len(chars) - 1)]
+                elif op == 1:
+                    chars.insert(i, rng.choice("aeiouknrst "))
+                elif chars:
+                    chars[min(i, len(chars) - 1)] = rng.choice("aeiouknrst")
+            probes.append("".join(chars).strip())
+    for p in probes:
+        assert index.match(p) == _linear_scan(p, full, first, last), p
+
+
+def test_ratio_index_prefilter_is_an_upper_bound_and_names_load(tmp_path):
+    rng = random.Random(1)
+    words = ["".join(rng.choice("abcde ") for _ in range(rng.randint(1, 10))) for _ in range(300)]
+    index = RatioIndex(words)
+    for q in words[:50]:
+        cands = set(index.candidates(q, 0.8))
+        assert {w for w in index.words if ratio(q, w) >= 0.8} <= cands
+        assert len(cands) < len(index.words)
+
+    csv_path = tmp_path / "selected_tags.csv"
+    csv_path.write_text(
+        "tag_id,name,category,count\n1,hatsune_miku,4,10\n2,some_painter,1,5\n3,smile,0,9\n",
+        encoding="utf-8",
+    )
+    assert load_names(csv_path) == ["some painter"]
+    txt_path = tmp_path / "artists.txt"
+    txt_path.write_text("# comment\nother_painter\n\n", encoding="utf-8")
+    assert load_names(txt_path) == ["other painter"]
+
+
+def test_load_artist_names_extends_filter(tmp_path):
+    path = tmp_path / "artists.txt"
+    path.write_text("Quentin Brushwork\n", encoding="utf-8")
+    assert not text_filters.is_bad_token("quentin brushwork")
+    try:
+        assert text_filters.load_artist_names(path) == 1
+        assert text_filters.is_bad_token("Quentin Brushwork")
+        assert text_filters.is_bad_token("quentin brushwerk")
+    finally:
+        text_filters.ARTIST_FULL.discard("quentin brushwork")
+        text_filters.refresh_rules()
@@ -0,0 +1,147 @@
+import sys
+from pathlib import Path
+
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+from img2prompt.extract import blip
+
+
+class _FakeProcessor:
+    def __call__(self, images, return_tensors="pt"):
+        return {"pixel_values": [im.size for im in images]}
+
+    def batch_decode(self, out, skip_special_tokens=True):
+        return [f"caption {w}" for w in out]
+
+
+class _FakeModel:
+    def __init__(self):
+        self.calls = []
+
+    def generate(self, pixel_values, max_new_tokens, num_beams):
+        self.calls.append(len(pixel_values))
+        if (13, 13) in pixel_values and len(pixel_values) > 1:
+            raise RuntimeError("bad batch")
+        if (13, 13) in pixel_values:
+            raise RuntimeError("bad image")
+        return [w for w, _ in pixel_values]
+
+
+def test_generate_captions_batches_and_falls_back(monkeypatch):
+    model = _FakeModel()
+    monkeypatch.setattr(blip.captioner, "get", lambda: (_FakeProcessor(), model))
+    images = [Image.new("RGB", (w, w)) for w in (10, 11, 12, 13, 14)]
+
+    out = blip.generate_captions(images + ["/nonexistent.jpg"], batch_size=2)
+
+    assert out == [
+        "caption 10",
+        "caption 11",
+        "caption 12",
+        "an image",
+        "caption 14",
+        "an image",
+    ]
+    # 2 + (2 -> 1 + 1 retry) + 1
+    assert model.calls == [2, 2, 1, 1, 1]
+
+
+def test_generate_caption_without_model(monkeypatch):
+    monkeypatch.setattr(blip.captioner, "get", lambda: (None, None))
+    assert blip.generate_caption(Path("missing.jpg")) == "an image"
+
+
+def test_configure_backend_drops_loaded_model(monkeypatch):
+    from img2prompt.eval.caption_bench import caption_similarity
+
+    monkeypatch.setattr(blip.captioner, "_processor", object())
+    monkeypatch.setattr(blip.captioner, "_model", object())
+    monkeypatch.setattr(blip.captioner, "_backend", "torch")
+    blip.captioner.configure("int8")
+    assert blip.captioner._model is None
+    assert caption_similarity("A cat on a table", "a cat on a table") == 1.0
+
+
+def test_florence2_backend_is_pluggable(monkeypatch):
+    from img2prompt.extract import caption_backends, florence2
+
+    assert caption_backends.get_backend("florence2") is florence2
+    assert caption_backends.get_backend("blip") is blip
+
+    monkeypatch.setattr(florence2, "load", lambda: True)
+    monkeypatch.setattr(
+        florence2, "_generate", lambda ims, nb, mx: [f"a detailed caption {i}" for i in range(len(ims))]
+    )
+    images = [Image.new("RGB", (8, 8)) for _ in range(3)]
+    out = florence2.generate_captions(images, batch_size=2)
+    assert out == ["a detailed caption 0", "a detailed caption 1", "a detailed caption 0"]
+
+
+def test_shared_model_keeps_its_device_and_dtype(monkeypatch):
+    import torch
+    from types import SimpleNamespace
+    from transformers import BatchFeature
+
+    from img2prompt.extract import clip_interrogator
+
+    class _Model:
+        device = torch.device("cpu")
+        dtype = torch.float32
+
+    class _Config:
+        device = "cuda"
+        caption_offload = False
+        caption_max_length = 32
+
+    model = _Model()
+    monkeypatch.setattr(blip.captioner, "get", lambda: (object(), model))
+    config = _Config()
+    assert blip.captioner.attach(config)
+    # CLIP はそのまま CI の device（cuda）で動く
+    assert config.device == "cuda"
+    assert config.caption_model is model
+
+    half = BatchFeature({"pixel_values": torch.zeros(1, 3, 4, 4, dtype=torch.float16)})
+    assert blip._to_model(half, model)["pixel_values"].dtype == torch.float32
+
+    def own_caption(image):
+        raise AssertionError("CI must not caption with the shared model itself")
+
+    calls = []
+    ci = SimpleNamespace(config=config, generate_caption=own_caption)
+    monkeypatch.setattr(clip_interrogator, "_ci", ci)
+    monkeypatch.setattr(clip_interrogator, "_ci_shared", True)
+    monkeypatch.setattr(
+        blip, "generate_captions", lambda images, **kw: calls.append(kw) or ["a shared caption"]
+    )
+    assert clip_interrogator._caption(object()) == "a shared caption"
+    assert calls == [{"batch_size": 1, "max_new_tokens": 32}]
+
+
+def test_backend_switch_reaches_clip_interrogator(monkeypatch):
+    from types import SimpleNamespace
+
+    from img2prompt.extract import clip_interrogator
+
+    old, new = SimpleNamespace(device=None), SimpleNamespace(device=None)
+    config = SimpleNamespace(device="cpu", caption_model=old, caption_processor="p0")
+    ci = SimpleNamespace(
+        config=config, caption_model=old, caption_processor="p0", caption_offloaded=True
+    )
+    monkeypatch.setattr(clip_interrogator, "_ci", ci)
+    monkeypatch.setattr(clip_interrogator, "_ci_shared", False)
+    monkeypatch.setattr(clip_interrogator, "_ci_profile", None)
+    monkeypatch.setattr(clip_interrogator, "_ci_caption_version", blip.captioner.MODEL_VERSION)
+    monkeypatch.setattr(blip.captioner, "_backend", "torch")
+    monkeypatch.setattr(blip.captioner, "get", lambda: ("p1", new))
+
+    clip_interrogator._load(None)
+    assert ci.caption_model is old
+    blip.captioner.configure("int8")
+    clip_interrogator._load(None)
+    assert clip_interrogator._ci is ci
+    assert (ci.caption_model, ci.caption_processor) == (new, "p1")
+    assert ci.caption_offloaded is False and clip_interrogator._ci_shared
@@ -55,3 +55,53 @@ def test_is_bad_token_meta_exact_and_finalize():
     out = finalize_prompt_safe(base.copy(), min_tokens=5, max_tokens=10)
     assert len(out) >= 5
     assert all(t in SAFE_FILL or t == "portrait" for t in out)
+
+
+def _legacy_bucketize(tags):
+    """``bucketize`` before the seed index (list lookups and ``pop(0)``)."""
+    buckets = {k: [] for k in bucketize.BUCKET_ORDER}
+    buckets["extra"] = []
+    used = set()
+    sorted_tags = sorted(tags.items(), key=lambda x: x[1], reverse=True)
+    for bucket, seeds in bucketize.BUCKET_SEEDS.items():
+        for tag, _ in sorted_tags:
+            if tag in seeds and tag not in used and len(buckets[bucket]) < 10:
+                buckets[bucket].append(tag)
+                used.add(tag)
+    remaining = [(t, s) for t, s in sorted_tags if t not in used]
+    idx = 0
+    while remaining and any(len(buckets[b]) < 10 for b in bucketize.BUCKET_ORDER):
+        bucket = bucketize.BUCKET_ORDER[idx % len(bucketize.BUCKET_ORDER)]
+        if len(buckets[bucket]) < 10:
+            tag, _ = remaining.pop(0)
+            if tag not in used:
+                buckets[bucket].append(tag)
+                used.add(tag)
+        idx += 1
+    total = sum(len(v) for v in buckets.values())
+    while remaining and total < 70:
+        tag, _ = remaining.pop(0)
+        if tag not in used:
+            buckets["extra"].append(tag)
+            used.add(tag)
+            total += 1
+    return buckets
+
+
+def test_bucketize_matches_legacy_on_large_inputs():
+    import random
+    import time
+
+    rng = random.Random(5)
+    seeds = sorted({s for v in bucketize.BUCKET_SEEDS.values() for s in v})
+    for n in (0, 3, 12, 45, 200, 10_000):
+        for _ in range(5):
+            names = [f"tag{i}" for i in range(n)] + rng.sample(seeds, rng.randint(0, len(seeds)))
+            tags = {t: rng.choice([0.5, 0.6, rng.random()]) for t in names}
+            assert bucketize.bucketize(tags) == _legacy_bucketize(tags)
+
+    tags = {f"tag{i}": rng.random() for i in range(10_000)}
+    start = time.perf_counter()
+    buckets = bucketize.bucketize(tags)
+    assert time.perf_counter() - start < 0.5
+    assert sum(len(v) for v in buckets.values()) == 70
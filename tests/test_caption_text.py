@@ -0,0 +1,62 @@
+import random
+import re
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+from img2prompt.utils import caption_text
+from img2prompt.utils.text_filters import CAPTION_OBJECTS, sync_caption_to_prompt
+
+
+def _legacy_sync(caption, tokens, objects):
+    """``sync_caption_to_prompt`` before the patterns were precompiled."""
+    if not caption:
+        return caption
+    s = {t.lower().strip() for t in tokens}
+    text = " " + caption.strip()
+    for obj in objects:
+        if obj not in s and re.search(rf"\b{obj}s?\b", text, flags=re.I):
+            for pat in (
+                rf"\s(?:with|holding|using|on|at|near|by)\b[^,\.]*\b{obj}s?\b",
+                rf"\s(?:sitting|standing)\s+(?:at|near|by)\b[^,\.]*\b{obj}s?\b",
+            ):
+                text = re.sub(pat, "", text, flags=re.I)
+    return re.sub(r"\s{2,}", " ", text).strip(" ,.;")
+
+
+WORDS = [
+    "a", "woman", "man", "sitting", "standing", "at", "near", "by", "with", "holding",
+    "using", "on", "the", "and", "smiling", "Table", "cups", "phone", "Laptops",
+    "headphones", "guitar", "book", ",", ".", "in", "room", "bottle", "pen",
+]
+
+
+def test_prune_objects_matches_per_object_regexes():
+    rng = random.Random(3)
+    objects = list(CAPTION_OBJECTS) + [f"widget{i}" for i in range(300)]
+    for _ in range(2000):
+        caption = " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 18)))
+        tokens = rng.sample(["table", "cup", "phone", "laptop", "smile", "book"], 2)
+        assert caption_text.prune_objects(caption, tokens, objects) == _legacy_sync(
+            caption, tokens, objects
+        )
+        assert sync_caption_to_prompt(caption, tokens) == _legacy_sync(
+            caption, tokens, CAPTION_OBJECTS
+        )
+    assert sync_caption_to_prompt("a man sitting at a table with a cup", ["cup"]) == "a man sitting with a cup"
+
+
+def test_nounish_and_ranked_phrases():
+    caption = "A girl in a red dress, standing near the old tree at sunset!"
+    assert caption_text.nounish_phrases(caption) == [
+        p.strip()
+        for p in re.findall(r"[a-z][a-z ]{2,40}", caption.lower())
+        if 1 <= len(p.split()) <= 4
+    ]
+    raw = "soft light, a girl, a girl, portrait of a girl with rim light / 35mm;x;film grain film grain"
+    picks = caption_text.rank_phrases(raw, ["rim light", "soft light"], max_take=3)
+    assert picks == ["portrait of a girl with rim light", "soft light", "film grain film grain"]
+    assert caption_text.rank_phrases_batch([raw, ""], ["rim light"], 2)[1] == []
+    assert caption_text.prune_objects_batch(["a cat on a table"], [[]], ["table"]) == ["a cat"]
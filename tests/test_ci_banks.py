@@ -0,0 +1,39 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+from img2prompt.extract import ci_banks
+
+
+def test_prune_labels_uses_pipeline_filters():
+    labels = [
+        "soft lighting",
+        "manga panel",
+        "by makoto shinkai",
+        "artist name",
+        "日本語",
+        "x" * 60,
+        "trending on artstation, comic",
+    ]
+    kept = [labels[i] for i in ci_banks.prune_labels(labels)]
+    assert kept == ["soft lighting", "trending on artstation, comic"]
+
+
+def test_write_bank_matches_interrogator_cache(tmp_path):
+    from clip_interrogator.clip_interrogator import Config, LabelTable
+
+    labels = ["soft lighting", "film grain"]
+    embeds = np.random.RandomState(0).rand(2, 8).astype("float32")
+    ci_banks.write_bank(tmp_path, "ViT-L-14/openai", "flavors", labels, embeds)
+
+    table = LabelTable.__new__(LabelTable)
+    table.config = Config(cache_path=str(tmp_path), download_cache=False)
+    table.embeds = []
+    digest = ci_banks._labels_hash(labels)
+    assert table._load_cached("flavors", digest, "ViT-L-14_openai")
+    assert len(table.embeds) == 2
+    assert np.allclose(np.stack(table.embeds), embeds, atol=1e-3)
@@ -9,6 +9,7 @@ ROOT = Path(__file__).resolve().parents[1]
 sys.path.append(str(ROOT))
 
 from img2prompt import cli
+from img2prompt.extract import blip
 
 
 def test_cli_generates_clean_output(tmp_path, monkeypatch):
@@ -17,7 +18,7 @@ def test_cli_generates_clean_output(tmp_path, monkeypatch):
     img_path.write_bytes(b"fake")
 
     # Stub model outputs
-    monkeypatch.setattr(cli.blip, "generate_caption", lambda p: "a caption")
+    monkeypatch.setattr(blip, "generate_caption", lambda p: "a caption")
 
     letters = string.ascii_lowercase
 
@@ -42,7 +43,7 @@ def test_cli_generates_clean_output(tmp_path, monkeypatch):
     monkeypatch.setattr(
         cli.palette,
         "extract_palette",
-        lambda p: ["#010101", "#020202", "#030303", "#040404", "#050505"],
+        lambda p, pixels=None: ["#010101", "#020202", "#030303", "#040404", "#050505"],
     )
 
     out = cli.run(str(img_path))
@@ -73,7 +74,7 @@ def test_cli_handles_deepdanbooru_failure(tmp_path, monkeypatch):
     img_path = tmp_path / "test.jpg"
     img_path.write_bytes(b"fake")
 
-    monkeypatch.setattr(cli.blip, "generate_caption", lambda p: "a caption")
+    monkeypatch.setattr(blip, "generate_caption", lambda p: "a caption")
 
     letters = string.ascii_lowercase
 
@@ -98,7 +99,7 @@ def test_cli_handles_deepdanbooru_failure(tmp_path, monkeypatch):
     monkeypatch.setattr(
         cli.palette,
         "extract_palette",
-        lambda p: ["#010101", "#020202", "#030303", "#040404", "#050505"],
+        lambda p, pixels=None: ["#010101", "#020202", "#030303", "#040404", "#050505"],
     )
 
     out = cli.run(str(img_path))
@@ -113,7 +114,7 @@ def test_cli_applies_style_preset(tmp_path, monkeypatch):
     img_path = tmp_path / "test.jpg"
     img_path.write_bytes(b"fake")
 
-    monkeypatch.setattr(cli.blip, "generate_caption", lambda p: "a caption")
+    monkeypatch.setattr(blip, "generate_caption", lambda p: "a caption")
 
     letters = string.ascii_lowercase
 
@@ -136,7 +137,7 @@ def test_cli_applies_style_preset(tmp_path, monkeypatch):
     monkeypatch.setattr(
         cli.palette,
         "extract_palette",
-        lambda p: ["#010101", "#020202", "#030303", "#040404", "#050505"],
+        lambda p, pixels=None: ["#010101", "#020202", "#030303", "#040404", "#050505"],
     )
 
     out = cli.run(str(img_path), style_preset="cinematic")
@@ -144,3 +145,195 @@ def test_cli_applies_style_preset(tmp_path, monkeypatch):
     tags = [t.strip() for t in data["prompt"].split(",") if t.strip()]
     assert "cinematic feel" in tags
     assert "bokeh" in tags
+
+
+def test_cli_reuses_ci_caption(tmp_path, monkeypatch):
+    img_path = tmp_path / "test.jpg"
+    img_path.write_bytes(b"fake")
+
+    def no_blip(p):
+        raise AssertionError("BLIP should not run when reusing the CI caption")
+
+    monkeypatch.setattr(blip, "generate_caption", no_blip)
+    monkeypatch.setattr(cli.wd14_onnx, "extract_tags", lambda p: {"smile": 1.0})
+    monkeypatch.setattr(cli.deepdanbooru, "extract_tags", lambda p: ({}, None))
+    monkeypatch.setattr(
+        cli.clip_interrogator,
+        "interrogate",
+        lambda p: ({"soft lighting": 0.55}, ["soft lighting"], "a ci caption, soft lighting", "a ci caption"),
+    )
+    monkeypatch.setattr(cli.palette, "extract_palette", lambda p, pixels=None: ["#010101"])
+
+    out = cli.run(str(img_path), caption_reuse="ci")
+    data = json.loads(Path(out).read_text("utf-8"))
+    assert data["caption"] == "a ci caption"
+
+
+def test_cli_deadline_drops_slow_extractor(tmp_path, monkeypatch):
+    import threading
+
+    img_path = tmp_path / "test.jpg"
+    img_path.write_bytes(b"fake")
+    release = threading.Event()
+
+    def slow_ci(p):
+        release.wait(5)
+        return {"soft lighting": 0.55}, ["soft lighting"], "soft lighting"
+
+    monkeypatch.setattr(blip, "generate_caption", lambda p: "a caption")
+    monkeypatch.setattr(cli.wd14_onnx, "extract_tags", lambda p: {"smile": 1.0})
+    monkeypatch.setattr(cli.deepdanbooru, "extract_tags", lambda p: ({}, None))
+    monkeypatch.setattr(cli.clip_interrogator, "extract_tags", slow_ci)
+    monkeypatch.setattr(cli.palette, "extract_palette", lambda p, pixels=None: ["#010101"])
+
+    try:
+        out = cli.run(str(img_path), deadline=0.5)
+    finally:
+        release.set()
+    data = json.loads(Path(out).read_text("utf-8"))
+    dbg = data["meta"]["tags_debug"]
+    assert dbg["clip_interrogator"]["dropped"] == "deadline"
+    assert dbg["wd14_onnx"]["ok"] is True
+    assert data["meta"]["deadline"]["dropped"] == ["clip_interrogator"]
+    assert data["caption"] == "a caption"
+    tags = [t.strip() for t in data["prompt"].split(",") if t.strip()]
+    assert len(tags) >= 55
+
+
+def _stub_cascade(monkeypatch, wd_tags):
+    calls = []
+
+    def dd(p):
+        calls.append("deepdanbooru")
+        return {"smile": 0.9}, None
+
+    def ci(p):
+        calls.append("clip_interrogator")
+        return {"soft lighting": 0.55}, ["soft lighting"], "soft lighting"
+
+    monkeypatch.setattr(blip, "generate_caption", lambda p: "a caption")
+    monkeypatch.setattr(cli.wd14_onnx, "extract_tags", lambda p: wd_tags)
+    monkeypatch.setattr(cli.deepdanbooru, "extract_tags", dd)
+    monkeypatch.setattr(cli.clip_interrogator, "extract_tags", ci)
+    monkeypatch.setattr(cli.palette, "extract_palette", lambda p, pixels=None: ["#010101"])
+    return calls
+
+
+def test_cli_cascade_skips_when_wd14_is_confident(tmp_path, monkeypatch):
+    img_path = tmp_path / "test.jpg"
+    img_path.write_bytes(b"fake")
+    wd_tags = {"solo": 1.0, "chibi": 0.9, "smile": 0.9, "long hair": 0.8, "blue eyes": 0.8}
+    calls = _stub_cascade(monkeypatch, wd_tags)
+
+    out = cli.run(str(img_path), cascade={"min_tags": 4})
+    data = json.loads(Path(out).read_text("utf-8"))
+    assert calls == []
+    meta = data["meta"]
+    assert meta["cascade"]["skip"] is True
+    assert meta["cascade"]["style"] == "anime"
+    assert meta["cascade"]["profile"] == "single_upper"
+    assert meta["tags_debug"]["clip_interrogator"]["skipped"] == "cascade"
+
+
+def test_cli_cascade_falls_back_when_wd14_is_short(tmp_path, monkeypatch):
+    img_path = tmp_path / "test.jpg"
+    img_path.write_bytes(b"fake")
+    calls = _stub_cascade(monkeypatch, {"solo": 1.0, "chibi": 0.9})
+
+    out = cli.run(str(img_path), cascade={})
+    data = json.loads(Path(out).read_text("utf-8"))
+    assert sorted(calls) == ["clip_interrogator", "deepdanbooru"]
+    assert data["meta"]["cascade"]["skip"] is False
+    assert data["meta"]["cascade"]["skipped"] == []
+
+
+def test_cli_deadline_uses_fallback_palette(tmp_path, monkeypatch):
+    import threading
+
+    img_path = tmp_path / "test.jpg"
+    img_path.write_bytes(b"fake")
+    release = threading.Event()
+    calls = []
+
+    def slow_palette(p, pixels=None):
+        calls.append(p)
+        release.wait(5)
+        return ["#010101"]
+
+    monkeypatch.setattr(blip, "generate_caption", lambda p: "a caption")
+    monkeypatch.setattr(cli.wd14_onnx, "extract_tags", lambda p: {"smile": 1.0})
+    monkeypatch.setattr(cli.deepdanbooru, "extract_tags", lambda p: ({}, None))
+    monkeypatch.setattr(cli.clip_interrogator, "extract_tags", lambda p: ({}, [], ""))
+    monkeypatch.setattr(cli.palette, "extract_palette", slow_palette)
+
+    try:
+        out = cli.run(str(img_path), deadline=0.5)
+    finally:
+        release.set()
+    data = json.loads(Path(out).read_text("utf-8"))
+    assert len(calls) == 1
+    assert data["meta"]["palette_hex"] == cli.palette.FALLBACK_PALETTE[:5]
+    assert data["meta"]["deadline"]["dropped"] == ["palette"]
+
+
+@pytest.mark.parametrize("deadline", [None, 5.0])
+def test_cli_decodes_the_palette_image_once(tmp_path, monkeypatch, deadline):
+    from PIL import Image
+
+    img_path = tmp_path / "test.png"
+    Image.new("RGB", (64, 32), (200, 40, 40)).save(img_path)
+    decodes = []
+    load_small = cli.palette.load_small
+
+    def counting_load_small(path, *args, **kwargs):
+        decodes.append(path)
+        return load_small(path, *args, **kwargs)
+
+    monkeypatch.setattr(cli.palette, "load_small", counting_load_small)
+    monkeypatch.setattr(blip, "generate_caption", lambda p: "a caption")
+    monkeypatch.setattr(cli.wd14_onnx, "extract_tags", lambda p: {"smile": 1.0})
+    monkeypatch.setattr(cli.deepdanbooru, "extract_tags", lambda p: ({}, None))
+    monkeypatch.setattr(cli.clip_interrogator, "extract_tags", lambda p: ({}, [], ""))
+
+    out = cli.run(str(img_path), deadline=deadline)
+    data = json.loads(Path(out).read_text("utf-8"))
+    assert decodes == [img_path]
+    assert data["meta"]["palette_hex"][0] == "#c82828"
+
+
+def test_cli_deadline_captions_when_ci_is_skipped(tmp_path, monkeypatch):
+    img_path = tmp_path / "test.jpg"
+    img_path.write_bytes(b"fake")
+    wd_tags = {"solo": 1.0, "chibi": 0.9, "smile": 0.9, "long hair": 0.8, "blue eyes": 0.8}
+    calls = _stub_cascade(monkeypatch, wd_tags)
+
+    out = cli.run(str(img_path), caption_reuse="ci", deadline=5.0, cascade={"min_tags": 4})
+    data = json.loads(Path(out).read_text("utf-8"))
+    assert calls == []
+    assert data["caption"] == "a caption"
+    assert data["meta"]["deadline"]["dropped"] == []
+
+
+def test_cli_deadline_falls_back_to_default_caption_when_out_of_time(tmp_path, monkeypatch):
+    import threading
+
+    img_path = tmp_path / "test.jpg"
+    img_path.write_bytes(b"fake")
+    release = threading.Event()
+
+    def slow_caption(p):
+        release.wait(5)
+        return "a late caption"
+
+    wd_tags = {"solo": 1.0, "chibi": 0.9, "smile": 0.9, "long hair": 0.8, "blue eyes": 0.8}
+    calls = _stub_cascade(monkeypatch, wd_tags)
+    monkeypatch.setattr(blip, "generate_caption", slow_caption)
+
+    try:
+        out = cli.run(str(img_path), caption_reuse="ci", deadline=0.3, cascade={"min_tags": 4})
+    finally:
+        release.set()
+    data = json.loads(Path(out).read_text("utf-8"))
+    assert calls == []
+    assert data["caption"] == cli.caption_backends.FALLBACK_CAPTION
+    assert data["meta"]["deadline"]["dropped"] == ["caption"]
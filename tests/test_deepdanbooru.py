@@ -0,0 +1,70 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+from img2prompt.extract import deepdanbooru
+
+
+def test_extract_tags_batch_thresholds_per_image(tmp_path, monkeypatch):
+    tags = ["long_hair", "rating:safe", "smile", "blue_eyes"]
+    for name in ("_tags", "_tag_index", "_tag_names", "_verdicts"):
+        monkeypatch.setattr(deepdanbooru, name, None)
+    deepdanbooru._set_tags(tags)
+    calls = []
+
+    def fake_model(x, training=False):
+        calls.append(x.shape)
+        return np.array([[0.9, 0.99, 0.1, 0.5], [0.2, 0.99, 0.8, 0.35]][: len(x)])
+
+    monkeypatch.setattr(deepdanbooru, "_model", fake_model)
+    paths = []
+    for i in range(2):
+        p = tmp_path / f"{i}.png"
+        Image.new("RGB", (32, 32)).save(p)
+        paths.append(p)
+
+    out = deepdanbooru.extract_tags_batch(paths + [tmp_path / "missing.png"], threshold=0.35)
+
+    assert calls == [(2, 512, 512, 3)]
+    assert out[0] == ({"long hair": 0.9, "blue eyes": 0.5}, None)
+    assert out[1] == ({"smile": 0.8, "blue eyes": 0.35}, None)
+    assert out[2][0] == {} and out[2][1]
+
+
+def test_load_prefers_converted_onnx(tmp_path, monkeypatch):
+    (tmp_path / "model.onnx").write_bytes(b"onnx")
+    (tmp_path / "tags.txt").write_text("smile\nrating:safe\n", encoding="utf-8")
+
+    class FakeInput:
+        name = "input"
+
+    class FakeSession:
+        def __init__(self, path, providers):
+            self.path = path
+
+        def get_inputs(self):
+            return [FakeInput()]
+
+        def run(self, outputs, feeds):
+            return [np.tile([0.7, 0.9], (len(feeds["input"]), 1))]
+
+    class FakeOrt:
+        InferenceSession = FakeSession
+
+    for name in ("_model", "_session", "_tags", "_tag_index", "_tag_names"):
+        monkeypatch.setattr(deepdanbooru, name, None)
+    monkeypatch.setattr(deepdanbooru, "ort", FakeOrt)
+    monkeypatch.setattr(deepdanbooru, "MODEL_DIRS", [tmp_path])
+    monkeypatch.setenv("IMG2PROMPT_CACHE_DIR", str(tmp_path / "cache"))
+
+    img = tmp_path / "a.png"
+    Image.new("RGB", (16, 16)).save(img)
+    assert deepdanbooru.extract_tags(img) == ({"smile": 0.7}, None)
+    assert deepdanbooru._session.path == str(tmp_path / "model.onnx")
+    assert (tmp_path / "cache" / "deepdanbooru_tag_verdicts.json").exists()
+    assert not (tmp_path / "tag_verdicts.json").exists()
@@ -0,0 +1,65 @@
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+from img2prompt.assemble import fusion
+from img2prompt.assemble.normalize import SYNONYMS, merge_tags
+
+
+def _legacy_merge(wd, dd, ci):
+    """``merge_tags`` before fusion moved to score arrays."""
+    combined = {}
+    for src, weight in ((wd, 1.0), (dd, 0.8), (ci, 0.7)):
+        for tag, score in src.items():
+            combined[tag] = max(combined.get(tag, 0.0), score * weight)
+    normalized = {}
+    for tag, score in combined.items():
+        canonical = SYNONYMS.get(tag, tag)
+        normalized[canonical] = max(normalized.get(canonical, score), score)
+    return dict(sorted(normalized.items(), key=lambda x: x[1], reverse=True))
+
+
+def _random_sources(rng):
+    pool = [f"tag{i}" for i in range(40)] + ["serafuku", "school uniform"]
+    levels = [0.0, 0.25, 0.5, 0.875, 1.0]
+    return tuple(
+        {t: rng.choice(levels) if rng.random() < 0.5 else rng.random() for t in rng.sample(pool, rng.randint(0, 20))}
+        for _ in range(3)
+    )
+
+
+def test_merge_tags_matches_legacy_including_tie_order():
+    rng = random.Random(49)
+    for _ in range(500):
+        wd, dd, ci = _random_sources(rng)
+        got = merge_tags(wd, dd, ci)
+        want = _legacy_merge(wd, dd, ci)
+        assert list(got.items()) == list(want.items())
+
+
+def test_fuse_dicts_batch_and_fusion_functions():
+    rng = random.Random(7)
+    batch = [_random_sources(rng) for _ in range(30)]
+    for how in fusion.FUSIONS:
+        together = fusion.fuse_dicts(batch, how=how, synonyms=SYNONYMS)
+        assert together == [fusion.fuse_dicts([b], how=how, synonyms=SYNONYMS)[0] for b in batch]
+
+    wd, dd, ci = {"smile": 0.5}, {"smile": 0.5, "serafuku": 1.0}, {}
+    assert fusion.fuse_dicts([(wd, dd, ci)], how="mean", synonyms=SYNONYMS)[0] == {
+        "school uniform": 0.8 / 3,
+        "smile": 0.3,
+    }
+    noisy = fusion.fuse_dicts([(wd, dd, ci)], how="noisy_or")[0]
+    assert np.isclose(noisy["smile"], 1 - 0.5 * 0.6)
+
+    vocab = fusion.TagVocab(synonyms=SYNONYMS)
+    cols = [vocab.ids(["smile", "serafuku"]), vocab.ids(["school uniform", "smile"])]
+    scores = [np.array([[0.5, 0.2], [0.1, 0.9]]), np.array([[0.5, 1.0], [0.0, 0.0]])]
+    fused = fusion.fuse_columns(scores, cols, len(vocab))
+    assert vocab.names == ["smile", "school uniform"]
+    assert np.allclose(fused, [[0.8, 0.4], [0.1, 0.9]])
@@ -0,0 +1,79 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+from img2prompt.extract import health
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = _Clock()
+    monkeypatch.setattr(health, "time", c)
+    health.reset()
+    health.configure(failure_threshold=3, cooldown_s=60.0)
+    yield c
+    health.reset()
+    health.configure()
+
+
+def test_opens_after_consecutive_failures_and_retries_after_cooldown(clock):
+    for _ in range(2):
+        health.record_failure("wd14_onnx", RuntimeError("broken model"))
+    assert health.available("wd14_onnx")
+    health.record_failure("wd14_onnx", RuntimeError("broken model"))
+    assert not health.available("wd14_onnx")
+    rep = health.report("wd14_onnx")
+    assert rep["state"] == "open" and rep["last_error"] == "broken model"
+
+    clock.now += 61
+    assert health.available("wd14_onnx")
+    # 再試行1回で失敗すれば即座に再オープン
+    health.record_failure("wd14_onnx", RuntimeError("still broken"))
+    assert not health.available("wd14_onnx")
+
+    clock.now += 61
+    assert health.available("wd14_onnx")
+    health.record_success("wd14_onnx")
+    assert health.report("wd14_onnx") == {"state": "closed", "failures": 0}
+
+
+def test_import_error_opens_immediately(clock):
+    health.record_failure("deepdanbooru", ImportError("No module named 'deepdanbooru'"))
+    assert not health.available("deepdanbooru")
+
+
+def test_deepdanbooru_skips_load_when_open(clock, monkeypatch):
+    from img2prompt.extract import deepdanbooru
+
+    calls = []
+    monkeypatch.setattr(deepdanbooru, "_load", lambda: calls.append(1))
+    health.record_failure("deepdanbooru", ImportError("missing"))
+    assert deepdanbooru.extract_tags(Path("x.jpg")) == ({}, None)
+    assert calls == []
+
+
+def test_unreadable_images_do_not_open_the_breaker(clock, monkeypatch, tmp_path):
+    from img2prompt.extract import clip_interrogator, wd14_onnx
+
+    bad = tmp_path / "broken.jpg"
+    bad.write_bytes(b"not an image")
+    loads = []
+    monkeypatch.setattr(wd14_onnx, "_load", lambda: loads.append("wd14"))
+    monkeypatch.setattr(clip_interrogator, "_load", lambda profile=None: loads.append("ci"))
+    for _ in range(5):
+        assert wd14_onnx.extract_tags(bad) == {}
+        assert clip_interrogator.interrogate(bad) == ({}, [], "", "")
+    assert health.available("wd14_onnx") and health.available("clip_interrogator")
+    assert loads == []
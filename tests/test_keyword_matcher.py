@@ -0,0 +1,35 @@
+import random
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+from img2prompt.utils import text_filters
+from img2prompt.utils.keyword_matcher import KeywordMatcher
+
+
+def test_matcher_agrees_with_substring_scan():
+    keywords = {"he", "she", "his", "hers", "a", "ab", "bab", "abc"}
+    m = KeywordMatcher(keywords)
+    rng = random.Random(0)
+    for _ in range(500):
+        text = "".join(rng.choice("abcehirs ") for _ in range(rng.randint(0, 12)))
+        assert m.search(text) == any(k in text for k in keywords)
+        assert m.findall(text) == {k for k in keywords if k in text}
+    assert not KeywordMatcher([]).search("anything")
+
+
+def test_refresh_rules_picks_up_table_edits():
+    version = text_filters.RULES_VERSION
+    assert not text_filters.is_bad_token("vaporwave poster")
+    text_filters.BAN_SUBSTR.add("vaporwave")
+    try:
+        assert text_filters.refresh_rules() == version + 1
+        assert text_filters.is_bad_token("vaporwave poster")
+    finally:
+        text_filters.BAN_SUBSTR.discard("vaporwave")
+        text_filters.refresh_rules()
+    assert not text_filters.is_bad_token("vaporwave poster")
+    assert text_filters.choose_style([], "a chibi drawing") == "anime"
+    assert text_filters.select_profile([], "a group of friends, full body") == "group_fullbody"
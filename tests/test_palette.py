@@ -0,0 +1,39 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+from img2prompt.assemble import palette
+
+
+def test_palette_finds_dominant_colours_and_replaces_black():
+    arr = np.zeros((60, 60, 3), dtype=np.uint8)
+    arr[:30] = (200, 30, 30)
+    arr[30:45] = (20, 200, 40)
+    out = palette.palette_from_array(arr, k=3)
+    assert out == ["#c81e1e", palette.BLACK_SUBSTITUTE, "#14c828"]
+    assert palette.palette_from_array(arr, k=3) == out
+
+
+def test_palette_pads_flat_images_and_reads_files(tmp_path):
+    from PIL import Image
+
+    flat = np.full((10, 10, 3), 128, dtype=np.uint8)
+    out = palette.palette_from_array(flat)
+    assert out[0] == "#808080" and len(out) == 5 and len(set(out)) == 5
+
+    path = tmp_path / "img.png"
+    rng = np.random.RandomState(0)
+    Image.fromarray(rng.randint(0, 256, (300, 200, 3)).astype(np.uint8)).save(path)
+    pixels = palette.load_small(path)
+    assert max(pixels.shape[:2]) == palette.SMALL_SIZE
+    assert palette.extract_palette(path) == palette.extract_palette(path, pixels=pixels)
+
+
+def test_palette_falls_back_on_unreadable_file(tmp_path):
+    path = tmp_path / "broken.jpg"
+    path.write_bytes(b"fake")
+    assert palette.extract_palette(path) == palette.FALLBACK_PALETTE
@@ -0,0 +1,136 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+from img2prompt.utils import text_filters
+from img2prompt.utils.rule_engine import RuleSet, load_rule_file, rule_terms
+from img2prompt.utils.vocab import Vocab
+
+
+def test_rule_set_only_evaluates_triggered_rules():
+    rules = [
+        {"any": ["a", "b"], "min": 2, "drop": ["a", "b"]},
+        {"all": ["c", "d"], "none": ["e"], "drop": ["d"]},
+        {"any": ["f"], "drop": ["g"], "style": "anime"},
+    ]
+    v = Vocab(sorted(rule_terms(rules)))
+    rs = RuleSet(rules, v)
+    assert rs.candidates(v.mask(["c"])) == [1]
+    assert rs.candidates(v.mask(["x", "g"])) == []
+    assert v.terms_of(rs.apply(v.mask(["a", "b", "c", "d"]))) == ["c"]
+    assert v.terms_of(rs.apply(v.mask(["c", "d", "e"]))) == ["c", "d", "e"]
+    assert v.terms_of(rs.apply(v.mask(["f", "g"]), "photo")) == ["f", "g"]
+    assert v.terms_of(rs.apply(v.mask(["f", "g"]), "anime")) == ["f"]
+    with pytest.raises(ValueError):
+        RuleSet([{"drop": ["a"]}], v)
+
+
+def test_rule_set_blocks_terms_a_firing_rule_would_drop():
+    rules = [
+        {"any": ["a"], "drop": ["b"]},
+        {"any": ["b"], "drop": ["a"]},
+        {"all": ["c", "d"], "drop": ["e"], "style": "photo"},
+    ]
+    v = Vocab(sorted(rule_terms(rules)))
+    rs = RuleSet(rules, v)
+    assert rs.blocks(v.mask(["a"]), v.mask(["b"]))
+    assert rs.blocks(v.mask(["b"]), v.mask(["a"]))
+    assert not rs.blocks(v.mask(["c"]), v.mask(["b", "e"]))
+    assert rs.blocks(v.mask(["c", "d"]), v.mask(["e"]), "photo")
+    assert not rs.blocks(v.mask(["c", "d"]), v.mask(["e"]), "anime")
+    assert not rs.blocks(v.mask(["a"]), 0)
+
+
+def test_rule_file_hot_reload(tmp_path):
+    path = tmp_path / "rules.json"
+    rules = {
+        "normalize": {"looking at the viewer": "looking at camera"},
+        "redundant_groups": [{"terms": ["glossy finish", "shiny finish"], "prefer": "shiny finish"}],
+        "contradictions": [{"any": ["night"], "drop": ["sunlight"]}],
+        "base_contradictions": [{"any": ["night"], "drop": ["sunlight"]}],
+        "fill_conflicts": [{"any": ["night"], "drop": ["sunlight"]}],
+        "profiles": {"single_upper": {"framing_k": 1}},
+    }
+    path.write_text(json.dumps(rules), encoding="utf-8")
+    try:
+        text_filters.use_rule_file(path)
+        assert text_filters.normalize_terms(["looking at the viewer"]) == ["looking at camera"]
+        assert text_filters.compress_redundant(["glossy finish", "shiny finish"]) == ["shiny finish"]
+        assert text_filters.drop_contradictions_style(["night", "sunlight"]) == ["night"]
+        assert text_filters.drop_contradictions(["night", "sunlight"]) == ["night"]
+        assert text_filters._would_conflict("sunlight", ["night"])
+        assert text_filters.PROFILES["single_upper"]["framing_k"] == 1
+        assert not text_filters.reload_rules_if_changed()
+
+        rules["contradictions"] = [{"any": ["sunlight"], "drop": ["night"]}]
+        path.write_text(json.dumps(rules), encoding="utf-8")
+        st = path.stat()
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert text_filters.reload_rules_if_changed()
+        assert text_filters.drop_contradictions_style(["night", "sunlight"]) == ["sunlight"]
+
+        path.write_text("{not json", encoding="utf-8")
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 2 * 10**9))
+        assert not text_filters.reload_rules_if_changed()
+        assert text_filters.drop_contradictions_style(["night", "sunlight"]) == ["sunlight"]
+    finally:
+        text_filters.use_rule_file(None)
+    assert text_filters.drop_contradictions_style(["night", "sunlight"]) == ["night", "sunlight"]
+    assert text_filters.drop_contradictions(["night", "sunlight"]) == ["night", "sunlight"]
+    assert not text_filters._would_conflict("sunlight", ["night"])
+    assert text_filters.PROFILES["single_upper"]["framing_k"] == 2
+
+    bad = tmp_path / "bad.json"
+    bad.write_text(json.dumps({"contradiction": []}), encoding="utf-8")
+    with pytest.raises(ValueError):
+        load_rule_file(bad)
+
+
+@pytest.mark.parametrize(
+    "broken",
+    [
+        {"redundant_groups": ["abc"]},
+        {"prefer_order": {"warm tones": "first"}},
+        {"contradictions": [{"any": "night", "drop": ["sunlight"]}]},
+        {"base_contradictions": [["night"]]},
+        {"contra_fill": {"night": "sunlight"}},
+        {"profiles": {"single_upper": {"framing_k": "1"}}},
+    ],
+)
+def test_broken_rule_file_keeps_the_previous_rules(tmp_path, broken):
+    path = tmp_path / "rules.json"
+    good = {"contradictions": [{"any": ["night"], "drop": ["sunlight"]}]}
+    path.write_text(json.dumps(good), encoding="utf-8")
+    try:
+        text_filters.use_rule_file(path)
+        version = text_filters.RULES_VERSION
+        rules = list(text_filters.STYLE_CONTRADICTION_RULES)
+        with pytest.raises(ValueError):
+            text_filters.apply_rule_file(broken)
+
+        path.write_text(json.dumps(dict(good, **broken)), encoding="utf-8")
+        st = path.stat()
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        out = text_filters.finalize_pipeline(["night", "sunlight"], caption="a photo")
+        assert "sunlight" not in out[2]
+        assert text_filters.RULES_VERSION == version
+        assert text_filters.STYLE_CONTRADICTION_RULES == rules
+        assert text_filters.drop_contradictions_style(["night", "sunlight"]) == ["night"]
+    finally:
+        text_filters.use_rule_file(None)
+
+
+def test_rule_file_normalize_keys_match_like_built_in_ones():
+    try:
+        text_filters.apply_rule_file({"normalize": {"Looking At The Viewer ": "Looking At Camera"}})
+        for token in ("looking at the viewer", "Looking at the Viewer"):
+            assert text_filters.normalize_terms([token]) == ["looking at camera"]
+        assert text_filters.normalize_terms(["Simple Background"]) == ["clean background"]
+    finally:
+        text_filters.use_rule_file(None)
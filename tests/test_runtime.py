@@ -0,0 +1,41 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+from img2prompt.extract import runtime
+
+
+@pytest.fixture(autouse=True)
+def _restore_runtime():
+    yield
+    runtime.configure("default")
+
+
+def test_shared_profile_splits_cores(monkeypatch):
+    monkeypatch.setattr(runtime.os, "cpu_count", lambda: 16)
+    cfg = runtime.configure("shared", workers=4)
+    assert cfg["threads"] == 4
+    assert cfg["interop_threads"] == 1
+    assert runtime.configure("shared", threads=2, workers=4)["threads"] == 2
+
+
+def test_inference_context_follows_profile():
+    import torch
+
+    runtime.configure("default")
+    with runtime.inference():
+        assert torch.is_inference_mode_enabled()
+    runtime.configure("legacy")
+    with runtime.inference():
+        assert not torch.is_inference_mode_enabled()
+        assert not torch.is_grad_enabled()
+    assert runtime.model_kwargs() == {}
+
+
+def test_unknown_profile_raises():
+    with pytest.raises(ValueError):
+        runtime.configure("turbo")
@@ -0,0 +1,243 @@
+"""Growth guards for the public functions of ``assemble`` and ``text_filters``.
+
+Each function runs at ``SIZES`` (10 to 100k tokens/tags/rows).  The
+exponent of its run time is fitted over the sizes from ``FIT_FROM`` up and
+must stay within ``MARGIN`` of the n log n exponent, so a quadratic step
+(``w in out`` on a growing list, ``list.index`` in a sort key, ...) fails
+here long before a noisy extractor feeds such a list in production.
+
+Runs start from cold ``classify``/``_token_bit`` caches with the garbage
+collector off; the best of a few runs counts.  Once one tenfold step grows
+faster than the limit plus ``MARGIN``, larger sizes are skipped and the
+fit uses what was measured.
+
+The timing tests take ~20s and depend on wall-clock time, so they only run
+with ``IMG2PROMPT_SCALING_TESTS=1``; the coverage check always runs.
+"""
+
+import contextlib
+import gc
+import inspect
+import io
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+from img2prompt.assemble import bucketize, fusion, normalize, palette, style
+from img2prompt.utils import text_filters as tf
+
+SIZES = (10, 100, 1_000, 10_000, 100_000)
+FIT_FROM = 1_000
+MARGIN = 0.4
+MIN_TIME = 0.2  # seconds of repeated runs per size
+MAX_RUNS = 5
+
+timing = pytest.mark.skipif(
+    os.environ.get("IMG2PROMPT_SCALING_TESTS") != "1",
+    reason="timing test; set IMG2PROMPT_SCALING_TESTS=1",
+)
+
+# Their input is the rule configuration, not a token list.
+NOT_SCALED = {
+    "apply_rule_file": "rule table",
+    "use_rule_file": "rule table",
+    "reload_rules_if_changed": "rule table",
+    "refresh_rules": "rule table",
+    "classify_stats": "no input",
+    "load_small": "image file, resized to a fixed size",
+}
+
+_RULE_TERMS = sorted(
+    {t for g in tf.REDUNDANT_GROUPS for t in g}
+    | set(tf.FRAMING_ORDER)
+    | tf.HAIR_LENGTHS
+    | tf.LOWER_GARMENTS
+    | {"smile", "closed mouth", "closed eyes", "sharp focus", "soft focus", "loose framing",
+       "tight framing", "white background", "plain background", "1girl", "serafuku"}
+)
+
+
+def _tokens(n, seed=0):
+    """Rule terms mixed with distinct noise tokens."""
+    rng = random.Random(seed)
+    return [rng.choice(_RULE_TERMS) if i % 4 == 0 else f"word{i} tag{i % 97}" for i in range(n)]
+
+
+def _tags(n, seed=0):
+    rng = random.Random(seed)
+    return {t: rng.random() for t in _tokens(n, seed)}
+
+
+def _caption(n):
+    return " ".join(
+        f"a girl with a cup{i} sitting at a table" if i % 5 == 0 else f"word{i}"
+        for i in range(n // 4 + 1)
+    )
+
+
+def _traces(n):
+    runs = [tf.run_pipeline(_tokens(30, i), "a girl", None, trace=[]) for i in range(max(1, n // 300))]
+    return [flags["stages"] for *_, flags in runs] * 10
+
+
+def _pixels(n):
+    return np.random.RandomState(0).randint(0, 256, (n, 3)).astype(np.uint8)
+
+
+_TMP = tempfile.TemporaryDirectory()
+
+
+def _artist_file(n):
+    path = Path(_TMP.name) / f"artists_{n}.txt"
+    path.write_text("\n".join(f"first{i} last{i}" for i in range(n)), encoding="utf-8")
+    return path
+
+
+TEXT_FILTER_CASES = {
+    "clean_tokens": lambda n: (_tokens(n),),
+    "purge_artist_fragments": lambda n: (_tokens(n), {f"name{i} last{i}" for i in range(n // 10)}),
+    "dedupe_background": lambda n: (_tokens(n),),
+    "unify_background": lambda n: (_tokens(n),),
+    "drop_invisible_clothes": lambda n: (_tokens(n),),
+    "drop_contradictions": lambda n: (_tokens(n),),
+    "adjust_framing_for_cues": lambda n: (_tokens(n),),
+    "compress_redundant": lambda n: (_tokens(n),),
+    "sync_caption_to_prompt": lambda n: (_caption(n), _tokens(n)),
+    "is_bad_token": lambda n: ("photo " * (n // 6 + 1),),
+    "classify": lambda n: ("photo " * (n // 6 + 1),),
+    "normalize_terms": lambda n: (_tokens(n),),
+    "merge_unique": lambda n: (_tokens(n), _tokens(n, 1)),
+    "finalize_prompt_safe": lambda n: (_tokens(n),),
+    "finalize_pipeline": lambda n: (_tokens(n), _caption(n), _tokens(n, 2)),
+    "finalize_pipeline_batch": lambda n: (
+        [(_tokens(30, i), "a girl", ["1girl"]) for i in range(max(1, n // 30))],
+    ),
+    "choose_style": lambda n: (_tokens(n), _caption(n)),
+    "select_profile": lambda n: (_tokens(n), _caption(n)),
+    "install_vocab_verdicts": lambda n: (
+        {f"word{i}": tf.TokenInfo(f"word{i}", False, False, False, False, None) for i in range(n)},
+    ),
+    "unify_background_style": lambda n: (_tokens(n), "photo", True),
+    "drop_contradictions_style": lambda n: (_tokens(n), "photo"),
+    "compress_framing": lambda n: (_tokens(n),),
+    "finalize_prompt_safe_ext": lambda n: (_tokens(n),),
+    "fill_constrained": lambda n: (_tokens(n), "photo", "single_upper"),
+    "fill_chain": lambda n: (_tokens(n), "photo", "single_upper"),
+    "run_pipeline": lambda n: (_tokens(n), _caption(n), _tokens(n, 2)),
+    "summarize_traces": lambda n: (_traces(n),),
+    "add_artist_names": lambda n: ([f"first{i} last{i}" for i in range(n)],),
+    "load_artist_names": lambda n: (_artist_file(n),),
+}
+
+ASSEMBLE_CASES = {
+    "bucketize": lambda n: (_tags(n),),
+    "ensure_50_70": lambda n: (_tokens(n), _caption(n), _tokens(n, 3)),
+    "remove_placeholders": lambda n: (_tags(n),),
+    "merge_tags": lambda n: (_tags(n), _tags(n, 1), _tags(n, 2)),
+    "fuse_dicts": lambda n: ([(_tags(n), _tags(n, 1), {})],),
+    "fuse_columns": lambda n: ([np.random.rand(4, n)], [np.arange(n)], n),
+    "determine_style": lambda n: (_caption(n), _tags(n)),
+    "palette_from_array": lambda n: (_pixels(n),),
+    "extract_palette": lambda n: (None, 5, _pixels(n)),
+}
+ASSEMBLE_MODULES = (bucketize, fusion, normalize, palette, style)
+
+
+def _public_functions(module):
+    names = set()
+    for name, obj in inspect.getmembers(module, callable):
+        fn = inspect.unwrap(obj)  # lru_cache wrappers such as classify
+        if inspect.isfunction(fn) and not name.startswith("_") and fn.__module__ == module.__name__:
+            names.add(name)
+    return names
+
+
+def _function(name, modules):
+    for m in modules:
+        if name in _public_functions(m):
+            return getattr(m, name)
+    raise KeyError(name)
+
+
+@contextlib.contextmanager
+def _isolated_rules():
+    artists = set(tf.ARTIST_FULL)
+    try:
+        yield
+    finally:
+        if tf.ARTIST_FULL != artists:
+            tf.ARTIST_FULL.clear()
+            tf.ARTIST_FULL.update(artists)
+            tf.refresh_rules()
+        tf._VOCAB_INFO.clear()
+
+
+def _best_time(fn, args) -> float:
+    best, spent, runs = math.inf, 0.0, 0
+    while runs < MAX_RUNS and (runs == 0 or spent < MIN_TIME):
+        call = [list(a) if isinstance(a, list) else a for a in args]
+        with _isolated_rules():
+            tf.classify.cache_clear()
+            tf._token_bit.cache_clear()
+            gc.disable()
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    t0 = time.perf_counter()
+                    fn(*call)
+                    dt = time.perf_counter() - t0
+            finally:
+                gc.enable()
+        best, spent, runs = min(best, dt), spent + dt, runs + 1
+    return best
+
+
+def _exponent(sizes, values) -> float:
+    x = np.log([float(n) for n in sizes])
+    y = np.log([max(v, 1e-9) for v in values])
+    return float(np.polyfit(x, y, 1)[0])
+
+
+def _too_fast_growing(cases, modules):
+    fit = [n for n in SIZES if n >= FIT_FROM]
+    limit = _exponent(fit, [n * math.log(n) for n in fit]) + MARGIN
+    report = {}
+    for name, make in sorted(cases.items()):
+        fn = _function(name, modules)
+        times = []
+        for i, n in enumerate(SIZES):
+            times.append(_best_time(fn, make(n)))
+            if n > FIT_FROM and _exponent(SIZES[i - 1 : i + 1], times[-2:]) > limit + MARGIN:
+                break
+        k = _exponent(fit[: len(times) - SIZES.index(FIT_FROM)], times[SIZES.index(FIT_FROM) :])
+        if k > limit:
+            report[name] = (round(k, 2), [f"{t * 1e3:.2f}ms" for t in times])
+    return report, round(limit, 2)
+
+
+def test_every_public_function_has_a_scaling_case():
+    covered = set(TEXT_FILTER_CASES) | set(NOT_SCALED)
+    assert _public_functions(tf) - covered == set()
+    assembled = set().union(*(_public_functions(m) for m in ASSEMBLE_MODULES))
+    assert assembled - set(ASSEMBLE_CASES) - set(NOT_SCALED) == set()
+
+
+@timing
+def test_text_filters_grow_at_most_n_log_n():
+    report, limit = _too_fast_growing(TEXT_FILTER_CASES, (tf,))
+    assert report == {}, f"exponent above {limit}: {report}"
+
+
+@timing
+def test_assemble_grows_at_most_n_log_n():
+    report, limit = _too_fast_growing(ASSEMBLE_CASES, ASSEMBLE_MODULES)
+    assert report == {}, f"exponent above {limit}: {report}"
@@ -0,0 +1,90 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+from img2prompt.assemble import normalize
+from img2prompt.utils import tag_verdicts, text_filters
+
+
+NAMES = [
+    "long_hair",
+    "serafuku",
+    "white_background",
+    "looking_at_viewer",
+    "ayami_kojima",
+    "1girl",
+    "subject_extra_1",
+    "smile",
+]
+
+
+def test_verdicts_match_per_tag_rules_and_feed_classify():
+    v = tag_verdicts.build(NAMES)
+    for i, name in enumerate(NAMES):
+        shown = tag_verdicts.display_name(name)
+        merged = normalize.SYNONYMS.get(shown, shown)
+        assert v.infos[shown] == text_filters.classify(shown)
+        assert v.infos[merged].bad == text_filters.is_bad_token(merged)
+        assert v.placeholder[i] == (not normalize.remove_placeholders({shown: 1.0}))
+    assert v.infos["school uniform"].norm == "school uniform"
+    assert v.infos["ayami kojima"].bad and v.infos["1girl"].bad
+    assert v.keep.all()
+
+    try:
+        assert v.install() == len(v.infos)
+        text_filters.classify.cache_clear()
+        assert text_filters.classify("long hair") is v.infos["long hair"]
+        text_filters.refresh_rules()
+        assert not v.current and v.install() == 0
+        assert text_filters.classify("long hair") is not v.infos["long hair"]
+    finally:
+        text_filters.refresh_rules()
+
+
+def test_verdict_cache_is_keyed_by_rules(tmp_path, monkeypatch):
+    path = tmp_path / "verdicts.json"
+    first = tag_verdicts.load_or_build(NAMES, path)
+    assert path.exists()
+
+    def no_build(names):
+        raise AssertionError("should have been read from the cache")
+
+    monkeypatch.setattr(tag_verdicts, "build", no_build)
+    cached = tag_verdicts.load_or_build(NAMES, path)
+    assert cached.infos == first.infos
+    assert np.array_equal(cached.keep, first.keep)
+
+    monkeypatch.undo()
+    try:
+        text_filters.BAN_EXACT.add("smile")
+        text_filters.refresh_rules()
+        rebuilt = tag_verdicts.load_or_build(NAMES, path)
+        assert rebuilt.key != first.key
+        assert rebuilt.infos["smile"].bad
+    finally:
+        text_filters.BAN_EXACT.discard("smile")
+        text_filters.refresh_rules()
+
+
+
+def test_cache_path_is_under_the_user_cache_dir(tmp_path, monkeypatch):
+    monkeypatch.delenv(tag_verdicts.CACHE_DIR_ENV, raising=False)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "xdg"))
+    assert tag_verdicts.cache_path("wd14_onnx") == tmp_path / "xdg" / "img2prompt" / "wd14_onnx_tag_verdicts.json"
+    monkeypatch.setenv(tag_verdicts.CACHE_DIR_ENV, str(tmp_path / "own"))
+    assert tag_verdicts.cache_path("deepdanbooru").parent == tmp_path / "own"
+
+
+def test_concurrent_cache_writers_do_not_share_a_temp_file(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    path = tmp_path / "wd14_tag_verdicts.json"
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: tag_verdicts.load_or_build(NAMES, path), range(16)))
+    assert all(r.infos == results[0].infos for r in results)
+    assert [p.name for p in tmp_path.iterdir()] == [path.name]
+    assert tag_verdicts.load_or_build(NAMES, path).infos == results[0].infos
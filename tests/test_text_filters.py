@@ -237,3 +237,189 @@ def test_adjust_framing_for_cues_converts_loose_to_tight():
     assert "tight framing" in out
     assert "loose framing" not in out
 
+
+
+def test_classify_caches_verdicts_until_rules_refresh():
+    from img2prompt.utils import text_filters
+
+    text_filters.refresh_rules()
+    info = text_filters.classify(" Upper Body ")
+    assert info.norm == "upper body" and info.safe and info.framing and not info.bad
+    assert text_filters.classify("white background").background
+    assert text_filters.classify("1girl").bad
+    for _ in range(3):
+        clean_tokens(["1girl", " Upper Body ", "white background"])
+    stats = text_filters.classify_stats()
+    assert stats["hits"] >= 6 and 0.0 < stats["hit_rate"] < 1.0
+    text_filters.refresh_rules()
+    assert text_filters.classify_stats()["size"] == 0
+
+
+def test_rule_groups_are_bitmasks_rebuilt_on_refresh():
+    from img2prompt.utils import text_filters
+    from img2prompt.utils.vocab import Vocab
+
+    v = Vocab(["a", "b", "c"])
+    assert v.mask(["c", "a", "zzz"]) == 0b101
+    assert v.terms_of(0b110) == ["b", "c"]
+
+    # 同順位は辞書順で決まる
+    assert compress_redundant(["clean rendition", "natural rendition", "x"]) == [
+        "clean rendition",
+        "x",
+    ]
+    text_filters.REDUNDANT_GROUPS.append({"glossy finish", "shiny finish"})
+    try:
+        text_filters.refresh_rules()
+        assert compress_redundant(["shiny finish", "glossy finish"]) == ["glossy finish"]
+    finally:
+        text_filters.REDUNDANT_GROUPS.pop()
+        text_filters.refresh_rules()
+    assert compress_redundant(["shiny finish", "glossy finish"]) == ["shiny finish", "glossy finish"]
+
+
+def _legacy_fill_chain(t, st, pf, ci_picks):
+    """The finalize_prompt_safe_ext retry chain run_pipeline used before fill_constrained."""
+    from img2prompt.utils import text_filters as tf
+
+    cfg = tf.PROFILES[pf]
+    pool = tf._choose_safe_pool(st, pf)
+    F = lambda t: tf.finalize_prompt_safe_ext(t, 55, 65, context=ci_picks or t, safe_pool=pool)
+    U = lambda t: tf.unify_background_style(t, st, enable=bool(cfg["unify_background"]))
+    t = F(t)
+    t = U(tf.compress_redundant(tf.drop_contradictions_style(t, style=st)))
+    if len(t) < 55:
+        t = U(F(t))
+        if len(t) < 55:
+            t = F(t)
+    t = tf.dedupe_background(t)
+    if len(t) < 55:
+        t = tf.dedupe_background(U(F(t)))
+    return t
+
+
+def _fill_terms():
+    from img2prompt.utils import text_filters as tf
+
+    return sorted(
+        set(tf.SAFE_FILL)
+        | set().union(*tf.REDUNDANT_GROUPS)
+        | {"smile", "closed mouth", "long hair", "short hair", "red dress", "white background"}
+        | {f"tag{i}" for i in range(40)}
+    )
+
+
+def test_fill_chain_matches_legacy_chain():
+    import random
+
+    from img2prompt.utils import text_filters as tf
+
+    terms = _fill_terms()
+    rng = random.Random(43)
+    for _ in range(500):
+        st = rng.choice(["photo", "anime"])
+        pf = rng.choice(sorted(tf.PROFILES))
+        t0 = rng.sample(terms, rng.randint(0, 70))
+        ci = rng.choice([None, rng.sample(terms, 10)])
+        assert tf.fill_chain(t0[:], st, pf, ci) == _legacy_fill_chain(t0[:], st, pf, ci)
+
+    sample = (["portrait", "smile", "white background"], "a woman", ["solo"])
+    assert tf.finalize_pipeline(*sample) == tf.finalize_pipeline(*sample, fill="chain")
+    with pytest.raises(ValueError):
+        tf.finalize_pipeline(*sample, fill="greedy")
+
+
+def test_fill_constrained_keeps_rules_and_length():
+    import random
+
+    from img2prompt.utils import text_filters as tf
+
+    terms = _fill_terms()
+    rng = random.Random(0)
+    for _ in range(300):
+        st = rng.choice(["photo", "anime"])
+        pf = rng.choice(sorted(tf.PROFILES))
+        unify = bool(tf.PROFILES[pf]["unify_background"])
+        t0 = rng.sample(terms, rng.randint(0, 70))
+        ci = rng.choice([None, rng.sample(terms, 10)])
+        old = tf.fill_chain(t0[:], st, pf, ci)
+        new = tf.fill_constrained(t0[:], st, pf, context=ci or t0)
+
+        # 旧方式は規則に反する語（重複グループ・背景の二重指定）を残すことがある
+        old_clean = tf._post_fill_rules(old, st, unify) == old
+        assert tf._post_fill_rules(new, st, unify) == new
+        assert len(new) <= 65
+        assert set(new) <= set(t0) | set(tf._choose_safe_pool(st, pf))
+        if old_clean:
+            assert len(new) >= min(55, len(old))
+        no_fill = len(tf._post_fill_rules(tf.compress_redundant(t0)[:65], st, unify)) >= 55
+        # 文脈が固定で、旧方式の最初の補充がそのまま規則を満たすなら結果は一致する
+        first = tf.finalize_prompt_safe_ext(
+            t0[:], 55, 65, context=ci or t0, safe_pool=tf._choose_safe_pool(st, pf)
+        )
+        one_round = ci and len(first) >= 55 and tf._post_fill_rules(first, st, unify) == first
+        if no_fill or one_round:
+            assert new == old
+
+
+def test_finalize_pipeline_batch_matches_per_item_calls():
+    import random
+
+    from img2prompt.utils import text_filters as tf
+
+    terms = sorted(set(tf.SAFE_FILL) | set().union(*tf.REDUNDANT_GROUPS) | {"1girl", "smile"})
+    rng = random.Random(1)
+    items = []
+    for i in range(40):
+        wd14 = rng.sample(["solo", "2girls", "full body", "chibi", "anime", "smile"], 2)
+        caption = rng.choice(["a woman in a park", "an anime girl", None])
+        ci = rng.choice([None, rng.sample(terms, 5)])
+        items.append((rng.sample(terms, rng.randint(3, 30)), caption, wd14, ci))
+    items.append({"tokens": ["portrait", "smile"], "caption": "a man"})
+
+    expected = [
+        tf.finalize_pipeline(tokens, caption=caption, wd14_tags=wd14, ci_picks=ci)
+        for tokens, caption, wd14, ci in (tf._batch_record(it) for it in items)
+    ]
+    assert tf.finalize_pipeline_batch(items) == expected
+    assert tf.finalize_pipeline_batch(items, processes=2) == expected
+
+
+def test_pipeline_trace_records_stages_without_changing_output():
+    from img2prompt.utils import text_filters as tf
+
+    sample = ["portrait", "long hair", "short hair", "smile", "closed mouth", "ayami kojima"]
+    plain = tf.finalize_pipeline(sample[:], caption="a woman", wd14_tags=["solo"])
+    trace = []
+    traced = tf.finalize_pipeline(sample[:], caption="a woman", wd14_tags=["solo"], trace=trace)
+    assert traced[:4] == plain[:4]
+    assert traced[4]["stages"] is trace
+
+    by_stage = {rec["stage"]: rec for rec in trace}
+    assert [r["stage"] for r in trace][:2] == ["normalize_terms", "dedupe_background"]
+    dcs = by_stage["drop_contradictions_style"]
+    assert sorted(dcs["dropped"]) == ["closed mouth", "long hair", "short hair"]
+    assert dcs["rules"] == {"0": ["long hair", "short hair"], "2": ["closed mouth"]}
+    assert by_stage["fill/safe_ext"]["out"] >= 55 and all(r["us"] >= 0 for r in trace)
+
+    summary = tf.summarize_traces([trace, trace])
+    assert summary["drop_contradictions_style"]["calls"] == 2
+    assert summary["drop_contradictions_style"]["dropped"] == 6
+    assert summary["drop_contradictions_style"]["rules"] == {"0": 4, "2": 2}
+    stages = [r["stage"] for r in trace]
+    assert len(stages) == len(set(stages))
+    assert summary["fill/compress_redundant"]["calls"] == 2
+
+    kw = dict(caption="a woman", wd14_tags=["solo"], fill="constrained")
+    constrained = tf.finalize_pipeline(sample[:], **kw)
+    ctrace = []
+    assert tf.finalize_pipeline(sample[:], trace=ctrace, **kw)[:4] == constrained[:4]
+    draw = {rec["stage"]: rec for rec in ctrace}["fill/draw"]
+    assert draw["out"] == len(constrained[2]) and draw["taken"] == len(draw["added"])
+    assert draw["draws"] >= draw["taken"]
+    stages = [r["stage"] for r in ctrace]
+    assert len(stages) == len(set(stages)) and "fill/trim" in stages
+
+    batch = tf.finalize_pipeline_batch([(sample, "a woman", ["solo"])], instrument=True)
+    assert batch[0][:4] == plain[:4]
+    assert [r["stage"] for r in batch[0][4]["stages"]] == [r["stage"] for r in trace]
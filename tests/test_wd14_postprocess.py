@@ -1,6 +1,7 @@
 import sys
 from pathlib import Path
 import numpy as np
+from types import SimpleNamespace
 
 ROOT = Path(__file__).resolve().parents[1]
 sys.path.append(str(ROOT))
@@ -17,3 +18,32 @@ def test_postprocess_filters_numeric_and_character(monkeypatch):
     monkeypatch.setattr(wd14_onnx, "_cats", cats)
     result = wd14_onnx._postprocess_wd14(scores, threshold=0.25)
     assert result == {"valid tag": 0.95}
+
+
+def test_postprocess_orders_by_category_then_score(monkeypatch):
+    names = ["b_tag", "a_tag", "shirt", "rating:general", "c_tag"]
+    cats = ["general", "general", "clothing", "rating", "other"]
+    scores = np.array([0.5, 0.5, 0.9, 0.99, 0.95], dtype=np.float32)
+    monkeypatch.setattr(wd14_onnx, "_names", names)
+    monkeypatch.setattr(wd14_onnx, "_cats", cats)
+    result = wd14_onnx._postprocess_wd14(scores, threshold=0.25, topk=3)
+    assert list(result) == ["b tag", "a tag", "shirt"]
+
+
+def test_verdict_mask_drops_columns_before_top_k(tmp_path, monkeypatch):
+    names = ["a_tag", "b_tag", "c_tag"]
+    cats = ["general", "general", "general"]
+    monkeypatch.setattr(wd14_onnx, "_names", names)
+    monkeypatch.setattr(wd14_onnx, "_cats", cats)
+    monkeypatch.setattr(wd14_onnx, "_columns", None)
+    seen = {}
+
+    def fake_load_or_build(shown, path):
+        seen["args"] = (shown, path)
+        return SimpleNamespace(keep=np.array([True, False, True]), install=lambda: 0)
+
+    monkeypatch.setattr(wd14_onnx.tag_verdicts, "load_or_build", fake_load_or_build)
+    wd14_onnx._install_verdicts(tmp_path / "v.json")
+    assert seen["args"] == (["a tag", "b tag", "c tag"], tmp_path / "v.json")
+    result = wd14_onnx._postprocess_wd14(np.array([0.5, 0.9, 0.4]), threshold=0.25, topk=2)
+    assert list(result) == ["a tag", "c tag"]